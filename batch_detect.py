@@ -0,0 +1,282 @@
+"""命令行批量疲劳检测：扫描目录中的录像，用进程池并行分析，每个视频输出报告和逐帧 EAR/MAR 数据
+
+每个工作进程启动时加载一份自己的模型，之后依次处理分配到的视频（单个视频内部不再分进程）。
+已完成的视频记录在输出目录的 manifest.jsonl 中，中断后重新运行同一命令会跳过已完成、文件未修改且检测配置相同的视频。
+
+Usage:
+    $ python batch_detect.py video/ --output batch_results --workers 4
+    $ python batch_detect.py /data/dashcam/2024-05-01 /data/dashcam/2024-05-02 --face-detector dnn --cache
+    $ python batch_detect.py video/ --output batch_results --retry-failed  # 重新处理上次失败的视频
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import CancelledError, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+import numpy as np
+
+import myfatigue
+from myanalysis import (analyse_file, EAR_THRESHOLD, MAR_THRESHOLD, FATIGUE_CONSEC_FRAMES, YAWN_CONSEC_FRAMES,
+                        ADAPTIVE_SAMPLING)
+from mycache import LandmarkCache
+from myregistry import registry
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.flv', '.ts')
+MANIFEST_NAME = 'manifest.jsonl'
+POOL_RESTARTS = 2  # 工作进程崩溃导致进程池损坏时，最多重建几次继续处理剩余视频
+
+# 工作进程内的关键点缓存，由 _init_worker 创建
+_cache = None
+
+
+def find_videos(inputs, extensions=VIDEO_EXTENSIONS, recursive=True):
+    """inputs 中的视频文件及目录下的视频文件，按路径排序去重后返回绝对路径列表"""
+    found = set()
+    for item in inputs:
+        if os.path.isfile(item):
+            found.add(os.path.abspath(item))
+            continue
+        for root, dirs, files in os.walk(item):
+            found.update(os.path.abspath(os.path.join(root, name)) for name in files
+                         if name.lower().endswith(extensions))
+            if not recursive:
+                break
+    return sorted(found)
+
+
+def file_key(path):
+    """判断文件是否变化用的 (大小, 修改时间)，不读取文件内容"""
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def output_dir(root, path):
+    """视频的结果目录：文件名 + 完整路径哈希，不同目录下的同名录像互不覆盖"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(root, f"{stem}_{hashlib.sha1(path.encode('utf-8')).hexdigest()[:8]}")
+
+
+class Manifest:
+    """每行一条 JSON 记录的任务清单，同一视频以最后一条记录为准
+
+    每处理完一个视频追加一行并立即落盘，进程被中断时最多丢失正在写的一行（读取时忽略）
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._partial = False  # 文件以写了一半的行结尾，下一条记录先换行
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    self._partial = not line.endswith('\n')
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.entries[entry['video']] = entry
+
+    def _matches(self, path, key, config, status):
+        entry = self.entries.get(path)
+        return (entry is not None and entry['status'] == status and entry['key'] == key
+                and entry.get('config') == config)
+
+    def done(self, path, key, config):
+        """视频已用相同配置（阈值、抽帧方式、人脸检测后端）成功处理，且之后没有修改"""
+        return self._matches(path, key, config, 'done') and os.path.isdir(self.entries[path]['output'])
+
+    def failed(self, path, key, config):
+        """视频上次用相同配置处理失败，且之后没有修改"""
+        return self._matches(path, key, config, 'failed')
+
+    def stale(self, path, key, config):
+        """视频已成功处理过，但文件或配置已变化"""
+        entry = self.entries.get(path)
+        return entry is not None and entry['status'] == 'done' and not self.done(path, key, config)
+
+    def record(self, entry):
+        self.entries[entry['video']] = entry
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(('\n' if self._partial else '') + json.dumps(entry, ensure_ascii=False) + '\n')
+            self._partial = False
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def _init_worker(face_detector=None, use_cache=False):
+    """工作进程初始化：单线程 OpenCV，加载本进程自己的模型实例"""
+    global _cache
+    cv2.setNumThreads(1)
+    if face_detector:
+        myfatigue.set_face_detector(face_detector)
+    registry.preload(*myfatigue.MODELS)
+    registry.wait(*myfatigue.MODELS)
+    _cache = LandmarkCache() if use_cache else None
+
+
+def write_series(path, telemetry):
+    """逐帧数据导出为 CSV：帧序号、时间、EAR、MAR、是否检出人脸、疲劳/打哈欠状态和事件"""
+    t = telemetry
+    table = np.column_stack([np.arange(len(t)), t['timestamp'], t['ear'], t['mar'],
+                             *(t[name].astype(np.int8) for name in
+                               ('found', 'fatigue', 'yawn', 'fatigue_event', 'yawn_event'))])
+    np.savetxt(path, table, delimiter=',', fmt=['%d', '%.3f', '%.4f', '%.4f', '%d', '%d', '%d', '%d', '%d'],
+               header='frame,time,ear,mar,found,fatigue,yawn,fatigue_event,yawn_event', comments='')
+
+
+def process_video(path, root, params, adaptive):
+    """在工作进程中分析一个视频，结果写入 output_dir(root, path)，返回汇总信息"""
+    t = time.perf_counter()
+    out = output_dir(root, path)
+    # 上次中断留下的不完整结果直接清除
+    shutil.rmtree(out, ignore_errors=True)
+    os.makedirs(out)
+
+    try:
+        analysis, series = analyse_file(path, params, adaptive, telemetry_dir=os.path.join(out, 'telemetry'),
+                                        cache=_cache)
+    except Exception:
+        shutil.rmtree(out, ignore_errors=True)
+        raise
+    with open(os.path.join(out, 'report.md'), 'w', encoding='utf-8') as f:
+        f.write(f"# {os.path.basename(path)}\n\n{analysis.generate_detection_report()}\n"
+                f"{analysis.generate_statistics()}")
+    write_series(os.path.join(out, 'series.csv'), analysis.telemetry)
+
+    fps = analysis.telemetry.fps
+    summary = {
+        'frames': analysis.total_frames,
+        'fps': fps,
+        'duration': analysis.total_frames / fps,
+        'fatigue_events': analysis.fatigue_frames,
+        'yawn_events': analysis.yawn_frames,
+        'face_rate': float(np.count_nonzero(series.found)) / max(len(series), 1),
+        'sampling_rate': analysis.sampling_rate,
+        'from_cache': analysis.from_cache,
+        'seconds': time.perf_counter() - t,
+    }
+    with open(os.path.join(out, 'summary.json'), 'w', encoding='utf-8') as f:
+        json.dump({'video': path, 'params': params, 'adaptive': adaptive,
+                   'face_detector': myfatigue.get_face_detector().name, **summary}, f, ensure_ascii=False, indent=2)
+    return out, summary
+
+
+def run(videos, root, params, adaptive=ADAPTIVE_SAMPLING, workers=None, face_detector=None, use_cache=False,
+        retry_failed=False, force=False):
+    """处理 videos 中尚未完成的视频，返回 (完成数, 跳过数, 失败数, 视频总秒数, 墙钟秒数)"""
+    os.makedirs(root, exist_ok=True)
+    manifest = Manifest(os.path.join(root, MANIFEST_NAME))
+    # 影响结果的配置，与清单中的记录不一致时重新处理
+    config = {'params': params, 'adaptive': adaptive, 'face_detector': face_detector or myfatigue.FACE_DETECTOR}
+    pending, skipped, stale = [], 0, 0
+    for path in videos:
+        key = file_key(path)
+        if not force and (manifest.done(path, key, config)
+                          or (manifest.failed(path, key, config) and not retry_failed)):
+            skipped += 1
+        else:
+            stale += manifest.stale(path, key, config)
+            pending.append((path, key))
+    print(f"共 {len(videos)} 个视频: 待处理 {len(pending)}, 跳过 {skipped}（已完成或上次失败）")
+    if stale:
+        print(f"其中 {stale} 个视频的文件或检测配置与上次不同，将重新处理并覆盖原结果")
+    if not pending:
+        return 0, skipped, 0, 0.0, 0.0
+
+    workers = max(1, min(workers or os.cpu_count() or 1, len(pending)))
+    counts = {'total': len(pending), 'finished': 0, 'done': 0, 'failed': 0, 'video_seconds': 0.0,
+              'start': time.perf_counter()}
+    for restart in range(POOL_RESTARTS + 1):
+        if restart:
+            print(f"工作进程异常退出，重建进程池继续处理剩余 {len(pending)} 个视频")
+        pending = _run_pool(pending, manifest, root, config, workers, use_cache, counts)
+        if not pending:
+            break
+    else:
+        print(f"进程池多次异常退出，{len(pending)} 个视频未处理（未记入清单，重新运行时继续）")
+    return (counts['done'], skipped, counts['failed'], counts['video_seconds'],
+            time.perf_counter() - counts['start'])
+
+
+def _run_pool(pending, manifest, root, config, workers, use_cache, counts):
+    """用一个进程池处理 pending，结果写入清单并累计到 counts，返回因进程池损坏而没有结果的视频
+
+    工作进程崩溃（段错误、被系统杀掉）时所有未完成的任务都会抛出 BrokenProcessPool，
+    这些视频不是自身处理失败，不记入清单
+    """
+    broken = []
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                               initargs=(config['face_detector'], use_cache))
+    try:
+        futures = {pool.submit(process_video, path, root, config['params'], config['adaptive']): (path, key)
+                   for path, key in pending}
+        for future in as_completed(futures):
+            path, key = futures[future]
+            entry = {'video': path, 'key': key, 'config': config, 'finished': time.strftime('%Y-%m-%d %H:%M:%S')}
+            try:
+                out, summary = future.result()
+            except (BrokenProcessPool, CancelledError):
+                broken.append((path, key))
+                continue
+            except Exception as e:
+                counts['finished'] += 1
+                counts['failed'] += 1
+                manifest.record({**entry, 'status': 'failed', 'error': f"{type(e).__name__}: {e}"})
+                print(f"[{counts['finished']}/{counts['total']}] {os.path.basename(path)}: "
+                      f"失败 - {type(e).__name__}: {e}")
+                continue
+            counts['finished'] += 1
+            counts['done'] += 1
+            counts['video_seconds'] += summary['duration']
+            manifest.record({**entry, 'status': 'done', 'output': out, **summary})
+            elapsed = time.perf_counter() - counts['start']
+            print(f"[{counts['finished']}/{counts['total']}] {os.path.basename(path)}: "
+                  f"{summary['duration']:.1f}s 视频, 用时 {summary['seconds']:.1f}s, "
+                  f"疲劳 {summary['fatigue_events']} 次, 打哈欠 {summary['yawn_events']} 次 | "
+                  f"累计 {counts['video_seconds'] / elapsed:.1f} 视频秒/秒")
+    except KeyboardInterrupt:
+        print("已中断，已完成的视频记录在清单中，重新运行将从未完成的视频继续")
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    pool.shutdown()
+    return broken
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='批量疲劳检测')
+    parser.add_argument('inputs', nargs='+', help='视频文件或目录')
+    parser.add_argument('--output', type=str, default='batch_results', help='结果目录（含清单 manifest.jsonl）')
+    parser.add_argument('--workers', type=int, default=0, help='工作进程数，0 为 CPU 核数')
+    parser.add_argument('--extensions', nargs='+', default=list(VIDEO_EXTENSIONS), help='视频扩展名')
+    parser.add_argument('--no-recursive', action='store_true', help='只扫描目录的第一层')
+    parser.add_argument('--ear-threshold', type=float, default=EAR_THRESHOLD, help='眼睛闭合阈值')
+    parser.add_argument('--mar-threshold', type=float, default=MAR_THRESHOLD, help='打哈欠阈值')
+    parser.add_argument('--fatigue-frames', type=int, default=FATIGUE_CONSEC_FRAMES, help='疲劳确认帧数')
+    parser.add_argument('--yawn-frames', type=int, default=YAWN_CONSEC_FRAMES, help='打哈欠确认帧数')
+    parser.add_argument('--adaptive', action='store_true', default=ADAPTIVE_SAMPLING,
+                        help='自适应抽帧（更快，结果为插值近似；缓存的关键点只在阈值相同时复用）')
+    parser.add_argument('--face-detector', type=str, default=None, help='人脸检测后端 hog / dnn / yolo')
+    parser.add_argument('--cache', action='store_true', help='使用关键点缓存（逐帧分析的关键点在修改阈值重新处理时也可复用）')
+    parser.add_argument('--retry-failed', action='store_true', help='重新处理上次失败的视频')
+    parser.add_argument('--force', action='store_true', help='忽略清单，全部重新处理')
+    opt = parser.parse_args()
+
+    extensions = tuple(e.lower() if e.startswith('.') else f'.{e.lower()}' for e in opt.extensions)
+    videos = find_videos(opt.inputs, extensions, recursive=not opt.no_recursive)
+    params = {
+        'ear_threshold': opt.ear_threshold,
+        'mar_threshold': opt.mar_threshold,
+        'fatigue_consec_frames': opt.fatigue_frames,
+        'yawn_consec_frames': opt.yawn_frames,
+    }
+    done, skipped, failed, video_seconds, wall = run(
+        videos, opt.output, params, adaptive=opt.adaptive, workers=opt.workers,
+        face_detector=opt.face_detector, use_cache=opt.cache, retry_failed=opt.retry_failed, force=opt.force)
+    print(f"\n完成 {done}, 跳过 {skipped}, 失败 {failed}")
+    if done:
+        print(f"视频总时长 {video_seconds:.1f}s, 用时 {wall:.1f}s, 吞吐量 {video_seconds / wall:.2f} 视频秒/秒")
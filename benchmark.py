@@ -0,0 +1,789 @@
+"""疲劳检测各环节的性能基准测试
+
+Usage:
+    $ python benchmark.py faces --source video/1.mp4 --frames 200 --backends hog dnn yolo
+    $ python benchmark.py detect --source video/1.mp4 --frames 200 --backends torch onnx openvino --threads 4
+    $ python benchmark.py batch --source video/1.mp4 --frames 128 --backend torch --batch-sizes 1 2 4 8 16
+    $ python benchmark.py sampling --source video/1.mp4 --max-steps 2 4 8
+    $ python benchmark.py preprocess --source video/1.mp4 --frames 200 --img-size 640
+    $ python benchmark.py nms --batch-sizes 1 4 8 16 --trials 20
+    $ python benchmark.py state --frames 100000 --trials 5
+    $ python benchmark.py pipeline --source video/1.mp4 --frames 300 --thread-counts 1 2 4 --json results/build.json
+    $ python benchmark.py pipeline --frames 300 --json results/new.json --compare results/build.json  # 合成片段，与基线比较
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+
+def read_frames(source, n, size=(640, 480)):
+    """从视频读取最多 n 帧，并缩放到与摄像头流程相同的尺寸"""
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise FileNotFoundError(f"无法打开视频: {source}")
+    frames = []
+    while len(frames) < n:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(cv2.resize(frame, size))
+    cap.release()
+    if not frames:
+        raise RuntimeError(f"视频中没有可读取的帧: {source}")
+    return frames
+
+
+def summarize(times, hits=None):
+    """耗时列表（秒） -> 统计字典（毫秒）"""
+    ms = np.asarray(times) * 1000.0
+    result = {
+        'frames': len(ms),
+        'mean_ms': float(ms.mean()),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'fps': float(1000.0 / ms.mean()) if ms.mean() > 0 else float('inf'),
+    }
+    if hits is not None:
+        result['hit_rate'] = float(np.mean(hits))
+    return result
+
+
+def bench_faces(frames, backends):
+    """各人脸检测后端的单帧耗时（不含灰度化和直方图均衡化）"""
+    import myface
+
+    grays = [cv2.equalizeHist(cv2.cvtColor(f, cv2.COLOR_BGR2GRAY)) for f in frames]
+    results = {}
+    for name in backends:
+        try:
+            backend = myface.create_face_detector(name)
+        except Exception as e:
+            print(f"{name}: 跳过 ({e})")
+            continue
+
+        backend.detect(grays[0], frames[0])  # 预热
+        times, hits = [], []
+        for gray, frame in zip(grays, frames):
+            t = time.perf_counter()
+            faces = backend.detect(gray, frame)
+            times.append(time.perf_counter() - t)
+            hits.append(bool(faces))
+        results[name] = summarize(times, hits)
+
+        if backend.uses_yolo:
+            # 复用 myframe.process 中已经运行过的 YOLO 结果，只计推算人脸框的耗时
+            import mydetect
+            detections = [mydetect.predict(f) for f in frames]
+            times, hits = [], []
+            for gray, frame, det in zip(grays, frames, detections):
+                t = time.perf_counter()
+                faces = backend.detect(gray, frame, det)
+                times.append(time.perf_counter() - t)
+                hits.append(bool(faces))
+            results[f'{name} (复用YOLO)'] = summarize(times, hits)
+    return results
+
+
+def _iou(a, b):
+    a, b = [float(v) for v in a], [float(v) for v in b]
+    w = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    h = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - w * h
+    return w * h / union if union > 0 else 0.0
+
+
+def compare_detections(reference, outputs):
+    """逐帧比较两组 predict() 结果：标签序列一致的帧比例、配对框的最小IoU、最大置信度差"""
+    same, min_iou, max_conf = 0, 1.0, 0.0
+    for ref, out in zip(reference, outputs):
+        if [r[0] for r in ref] != [o[0] for o in out]:
+            continue
+        same += 1
+        for (_, conf_r, box_r), (_, conf_o, box_o) in zip(ref, out):
+            min_iou = min(min_iou, _iou(box_r, box_o))
+            max_conf = max(max_conf, abs(conf_r - conf_o))
+    return {'label_match': same / max(len(reference), 1), 'min_iou': min_iou, 'max_conf_diff': max_conf}
+
+
+def bench_detect(frames, backends, threads=0):
+    """各YOLO推理后端的单帧耗时（含预处理和NMS），以及与第一个后端（通常是 torch）的输出一致性"""
+    import mydetect
+
+    results, parity = {}, {}
+    reference = None
+    for name in backends:
+        try:
+            backend = mydetect.create_backend(name, threads=threads)
+        except Exception as e:
+            print(f"{name}: 跳过 ({e})")
+            continue
+
+        # 固定输入尺寸的导出模型按其尺寸推理，参考后端也使用同一尺寸
+        size = backend.fixed_size[0] if backend.fixed_size is not None else None
+        mydetect.predict(frames[0], size, backend)  # 预热
+        times, outputs = [], []
+        for frame in frames:
+            t = time.perf_counter()
+            outputs.append(mydetect.predict(frame, size, backend))
+            times.append(time.perf_counter() - t)
+        results[name] = summarize(times, [bool(o) for o in outputs])
+
+        if reference is None:
+            reference = (name, backend, outputs)
+            continue
+        ref_name, ref_backend, ref_outputs = reference
+        if size is not None and ref_backend.fixed_size is None:
+            ref_outputs = [mydetect.predict(f, size, ref_backend) for f in frames]
+        check = compare_detections(ref_outputs, outputs)
+
+        # 原始输出（NMS之前）的最大误差
+        img = mydetect.preprocess(frames[0], mydetect._input_size(backend, size))
+        raw_ref = ref_backend(img).float().cpu().numpy()
+        raw = backend(img).float().cpu().numpy()
+        check['max_box_diff'] = float(np.abs(raw_ref[..., :4] - raw[..., :4]).max())
+        check['max_score_diff'] = float(np.abs(raw_ref[..., 4:] - raw[..., 4:]).max())
+        parity[f'{name} vs {ref_name}'] = check
+    return results, parity
+
+
+def bench_batch(frames, backend_name, batch_sizes, threads=0):
+    """mydetect.predict_batch 在不同批大小下的吞吐量，第一项为逐帧调用 predict 的基线"""
+    import mydetect
+
+    backend = mydetect.create_backend(backend_name, threads=threads)
+    results = {}
+
+    mydetect.predict(frames[0], backend=backend)  # 预热
+    t = time.perf_counter()
+    for frame in frames:
+        mydetect.predict(frame, backend=backend)
+    results['predict 逐帧'] = (time.perf_counter() - t) / len(frames)
+
+    for bs in batch_sizes:
+        mydetect.predict_batch(frames[:bs], batch_size=bs, backend=backend)  # 预热
+        t = time.perf_counter()
+        mydetect.predict_batch(frames, batch_size=bs, backend=backend)
+        results[f'batch={bs}'] = (time.perf_counter() - t) / len(frames)
+    return results
+
+
+def print_throughput(results):
+    base = next(iter(results.values()))
+    print(f"\n{'名称':<20}{'ms/帧':>10}{'FPS':>10}{'加速比':>10}")
+    for name, per_frame in results.items():
+        print(f"{name:<20}{per_frame*1000:>10.2f}{1/per_frame:>10.1f}{base/per_frame:>10.2f}")
+
+
+def bench_sampling(source, max_steps, ear_threshold=0.3, mar_threshold=0.5):
+    """自适应抽帧与逐帧分析对比：耗时、有效采样率和事件一致性"""
+    import myvideo
+
+    t = time.perf_counter()
+    reference = myvideo.extract_range(source, 0)
+    results = {'逐帧': {'seconds': time.perf_counter() - t, 'sampling_rate': 1.0}}
+    detector = myvideo.EventDetector(30, ear_threshold, mar_threshold)
+    for step in max_steps:
+        sampler = myvideo.AdaptiveSampler(ear_threshold, mar_threshold, max_step=step)
+        t = time.perf_counter()
+        series = myvideo.extract_range(source, 0, sampler=sampler)
+        seconds = time.perf_counter() - t
+        results[f'max_step={step}'] = dict(myvideo.compare_series(reference, series, detector), seconds=seconds)
+    return results
+
+
+def print_sampling(results):
+    base = results['逐帧']['seconds']
+    print(f"\n{'名称':<16}{'耗时s':>8}{'加速比':>8}{'采样率':>8}{'EAR误差':>10}{'MAR误差':>10}"
+          f"{'疲劳事件':>10}{'哈欠事件':>10}{'事件召回':>10}")
+    for name, r in results.items():
+        if 'ear_mae' not in r:
+            print(f"{name:<16}{r['seconds']:>8.1f}{1.0:>8.2f}{'100.0%':>8}")
+            continue
+        print(f"{name:<16}{r['seconds']:>8.1f}{base / r['seconds']:>8.2f}{r['sampling_rate']*100:>7.1f}%"
+              f"{r['ear_mae']:>10.4f}{r['mar_mae']:>10.4f}"
+              f"{'%d/%d' % r['fatigue_events'][::-1]:>10}{'%d/%d' % r['yawn_events'][::-1]:>10}"
+              f"{r['event_recall']*100:>9.1f}%")
+
+
+def bench_preprocess(frames, img_size=640):
+    """YOLO输入预处理：逐帧分配（preprocess + 归一化）与 mydetect.Preprocessor 复用缓冲区的耗时和每帧临时内存"""
+    import mydetect
+
+    size = (img_size, img_size)
+    pre = mydetect.Preprocessor(1, *size)
+    paths = {
+        'preprocess 逐帧分配': lambda f: np.divide(mydetect.preprocess(f, size), 255.0, dtype=np.float32),
+        'Preprocessor 复用': lambda f: pre.load(0, f),
+    }
+    canvas_bytes = img_size * img_size * 3
+    results = {}
+    for name, fn in paths.items():
+        fn(frames[0])  # 预热（Preprocessor 第一次使用时填充画布）
+        t = time.perf_counter()
+        for frame in frames:
+            fn(frame)
+        seconds = (time.perf_counter() - t) / len(frames)
+
+        # 每帧新分配的内存峰值（tracemalloc 可以跟踪 numpy 和 OpenCV 返回的数组）
+        peaks = []
+        tracemalloc.start()
+        for frame in frames[:20]:
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            out = fn(frame)
+            peaks.append(tracemalloc.get_traced_memory()[1] - base)
+            del out
+        tracemalloc.stop()
+        peak = float(np.mean(peaks))
+        results[name] = {'ms': seconds * 1000, 'alloc_kb': peak / 1024, 'canvases': peak / canvas_bytes}
+
+    ref = np.divide(mydetect.preprocess(frames[-1], size), 255.0, dtype=np.float32)[0]
+    results['max_diff'] = float(np.abs(pre.load(0, frames[-1]) - ref).max())
+    return results
+
+
+def print_preprocess(results):
+    max_diff = results.pop('max_diff')
+    print(f"\n{'名称':<24}{'ms/帧':>10}{'临时内存KB/帧':>16}{'相当于整帧画布':>16}")
+    for name, r in results.items():
+        print(f"{name:<24}{r['ms']:>10.3f}{r['alloc_kb']:>16.1f}{r['canvases']:>16.2f}")
+    print(f"输入张量最大差: {max_diff:.2e}")
+
+
+def synthetic_predictions(batch, anchors=25200, nc=4, objects=20, seed=0):
+    """模拟YOLO解码输出 (batch, anchors, 5+nc)：框聚集在若干目标附近，并包含完全重复的框和相同的分数"""
+    import torch
+
+    g = torch.Generator().manual_seed(seed)
+    pred = torch.zeros(batch, anchors, 5 + nc)
+    centers = torch.rand(batch, objects, 2, generator=g) * 600 + 20
+    sizes = torch.rand(batch, objects, 2, generator=g) * 150 + 10
+    obj = torch.randint(0, objects, (batch, anchors), generator=g)
+    pick = lambda t: torch.gather(t, 1, obj[..., None].expand(-1, -1, 2))
+    pred[..., 0:2] = pick(centers) + torch.randn(batch, anchors, 2, generator=g) * 4
+    pred[..., 2:4] = pick(sizes) * (1 + torch.randn(batch, anchors, 2, generator=g) * 0.1)
+    pred[..., 4] = torch.sigmoid(torch.randn(batch, anchors, generator=g) * 2 - 6)  # 大多数锚框没有目标
+    pred[..., 5:] = torch.rand(batch, anchors, nc, generator=g)
+    pred[:, 1::97] = pred[:, ::97][:, :pred[:, 1::97].shape[1]]  # 重复的框
+    pred[..., 4:] = (pred[..., 4:] * 256).round() / 256  # 量化分数，制造相同分数
+    return pred
+
+
+def check_nms(batch_sizes, conf_thres=(0.001, 0.25, 0.6), trials=10):
+    """batched_non_max_suppression 与逐图 non_max_suppression 的一致性（逐项完全相等）和耗时"""
+    import torch
+    from utils.general import batched_non_max_suppression, non_max_suppression
+
+    results = {}
+    for bs in batch_sizes:
+        for conf in conf_thres:
+            for agnostic, classes in ((False, None), (True, None), (False, [0, 2])):
+                mismatches, t_ref, t_new = 0, 0.0, 0.0
+                for trial in range(trials):
+                    pred = synthetic_predictions(bs, seed=trial)
+                    t = time.perf_counter()
+                    ref = non_max_suppression(pred.clone(), conf, 0.45, classes, agnostic)
+                    t_ref += time.perf_counter() - t
+                    t = time.perf_counter()
+                    out = batched_non_max_suppression(pred.clone(), conf, 0.45, classes, agnostic)
+                    t_new += time.perf_counter() - t
+                    mismatches += sum(not torch.equal(a, b) for a, b in zip(ref, out)) + abs(len(ref) - len(out))
+                name = f"batch={bs} conf={conf}" + (' agnostic' if agnostic else '') + (' classes' if classes else '')
+                results[name] = {'images': bs * trials, 'mismatches': mismatches,
+                                 'ref_ms': t_ref / trials * 1000, 'new_ms': t_new / trials * 1000}
+    return results
+
+
+def print_nms(results):
+    print(f"\n{'名称':<34}{'图像数':>8}{'不一致':>8}{'逐图ms':>10}{'批量ms':>10}{'加速比':>8}")
+    for name, r in results.items():
+        print(f"{name:<34}{r['images']:>8}{r['mismatches']:>8}{r['ref_ms']:>10.2f}{r['new_ms']:>10.2f}"
+              f"{r['ref_ms'] / max(r['new_ms'], 1e-9):>8.2f}")
+    bad = sum(r['mismatches'] for r in results.values())
+    print(f"一致性: {'通过' if bad == 0 else f'不通过（{bad} 张图像结果不同）'}")
+
+
+def synthetic_series(n, fps=30, seed=0):
+    """模拟的 EAR/MAR 序列：睁眼时的噪声、若干次眨眼和闭眼、张嘴打哈欠，以及未检测到人脸的帧"""
+    rng = np.random.default_rng(seed)
+    ear = np.clip(rng.normal(0.31, 0.03, n), 0.21, None)
+    for s in rng.integers(0, n, n // (fps * 3)):
+        ear[s:s + rng.integers(2, fps)] = rng.uniform(0.21, 0.26)
+    ear[rng.random(n) < 0.02] = 0.0
+    mar = np.clip(rng.normal(0.3, 0.05, n), 0, None)
+    for s in rng.integers(0, n, n // (fps * 10)):
+        mar[s:s + rng.integers(5, fps * 2)] = rng.uniform(0.55, 0.9)
+    return ear, mar
+
+
+def check_state(n, trials=5, fps=30):
+    """FatigueEngine / EventDetector 的 replay() 与逐帧 update() 的一致性和耗时"""
+    from mystate import EventDetector, FatigueEngine
+
+    results = {}
+    for name, make in (('FatigueEngine', lambda: FatigueEngine(fps, reset_interval=120, yawn_window=30)),
+                       ('EventDetector', lambda: EventDetector(fps))):
+        mismatches, t_loop, t_replay = 0, 0.0, 0.0
+        for trial in range(trials):
+            ear, mar = synthetic_series(n, fps, seed=trial)
+            times = np.arange(n) / fps
+            engine = make()
+            t = time.perf_counter()
+            if name == 'FatigueEngine':
+                engine.reset(times[0])
+                states = [engine.update(e, m, s) for e, m, s in zip(ear.tolist(), mar.tolist(), times.tolist())]
+            else:
+                engine.reset()
+                states = [engine.update(i, e, m) for i, (e, m) in enumerate(zip(ear.tolist(), mar.tolist()))]
+            t_loop += time.perf_counter() - t
+            t = time.perf_counter()
+            replay = engine.replay(ear, mar, times) if name == 'FatigueEngine' else engine.replay(ear, mar)
+            t_replay += time.perf_counter() - t
+            for field, values in replay.items():
+                expected = np.array([getattr(s, field) for s in states])
+                same = np.allclose(expected, values) if values.dtype.kind == 'f' else np.array_equal(expected, values)
+                mismatches += not same
+        results[name] = {'frames': n * trials, 'mismatches': mismatches,
+                         'loop_ms': t_loop / trials * 1000, 'replay_ms': t_replay / trials * 1000}
+    return results
+
+
+def print_state(results):
+    print(f"\n{'名称':<16}{'帧数':>10}{'不一致字段':>10}{'逐帧ms':>10}{'重放ms':>10}{'加速比':>8}")
+    for name, r in results.items():
+        print(f"{name:<16}{r['frames']:>10}{r['mismatches']:>10}{r['loop_ms']:>10.1f}{r['replay_ms']:>10.1f}"
+              f"{r['loop_ms'] / max(r['replay_ms'], 1e-9):>8.2f}")
+    bad = sum(r['mismatches'] for r in results.values())
+    print(f"一致性: {'通过' if bad == 0 else f'不通过（{bad} 个字段结果不同）'}")
+
+
+def synthetic_clip(path, n=300, size=(640, 480), fps=30):
+    """生成合成测试片段：移动的椭圆和噪声纹理（没有真实人脸，关键点阶段只测到人脸检测）"""
+    w, h = size
+    rng = np.random.default_rng(0)
+    background = rng.integers(60, 120, (h, w, 3), dtype=np.uint8)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    for i in range(n):
+        frame = background.copy()
+        cx, cy = int(w / 2 + w / 4 * np.sin(i / 20)), int(h / 2 + h / 6 * np.cos(i / 25))
+        cv2.ellipse(frame, (cx, cy), (70, 95), 0, 0, 360, (150, 170, 200), -1)
+        cv2.ellipse(frame, (cx - 28, cy - 20), (14, 3 + (i // 10) % 6), 0, 0, 360, (40, 40, 40), -1)
+        cv2.ellipse(frame, (cx + 28, cy - 20), (14, 3 + (i // 10) % 6), 0, 0, 360, (40, 40, 40), -1)
+        cv2.ellipse(frame, (cx, cy + 40), (22, 4 + (i // 15) % 15), 0, 0, 360, (30, 30, 90), -1)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+class StageTimer:
+    """按阶段收集耗时样本，输出各阶段的分位数统计"""
+
+    def __init__(self):
+        self.samples = {}
+
+    @contextmanager
+    def __call__(self, stage):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.samples.setdefault(stage, []).append(time.perf_counter() - t)
+
+    def add(self, stage, seconds):
+        self.samples.setdefault(stage, []).append(seconds)
+
+    def stats(self):
+        result = {}
+        for stage, times in self.samples.items():
+            ms = np.asarray(times) * 1000.0
+            result[stage] = {'count': len(ms), 'mean_ms': float(ms.mean()),
+                             **{f'p{q}_ms': float(np.percentile(ms, q)) for q in (50, 90, 95, 99)},
+                             'max_ms': float(ms.max())}
+        return result
+
+
+def peak_rss_mb():
+    """进程的峰值常驻内存（MB）；Linux/macOS 用 resource，Windows 用 psutil"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024  # macOS 单位为字节，Linux 为KB
+    except ImportError:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / 1024 ** 2
+
+
+def build_info():
+    """结果文件中记录的构建信息，便于比较不同版本"""
+    import torch
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                         cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        commit = ''
+    versions = {'python': platform.python_version(), 'numpy': np.__version__, 'opencv': cv2.__version__,
+                'torch': torch.__version__}
+    try:
+        import onnxruntime
+        versions['onnxruntime'] = onnxruntime.__version__
+    except ImportError:
+        pass
+    return {'commit': commit, 'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'platform': platform.platform(),
+            'processor': platform.processor(), 'cpu_count': os.cpu_count(), 'versions': versions}
+
+
+def set_threads(n):
+    import torch
+    cv2.setNumThreads(n if n > 0 else -1)
+    if n > 0:
+        torch.set_num_threads(n)
+
+
+def bench_stages(frames, backend, writer):
+    """逐帧拆分各阶段：人脸检测、关键点、EAR/MAR、YOLO 预处理/推理/后处理、绘制、编码"""
+    import torch
+    from imutils import face_utils
+
+    import mydetect
+    import myfatigue
+    from utils.general import batched_non_max_suppression
+
+    timer = StageTimer()
+    h, w = mydetect._input_size(backend, None), None
+    h, w = (h, h) if isinstance(h, int) else h
+    pre = mydetect.Preprocessor(1, h, w)
+    predictor = myfatigue.get_predictor()
+    for frame in frames:
+        frame = frame.copy()
+        t_frame = time.perf_counter()
+        with timer('face_detect'):
+            gray = cv2.equalizeHist(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+            faces = myfatigue.detect_faces(gray, frame)
+        shape = None
+        if faces:
+            with timer('landmarks'):
+                face = max(faces, key=lambda r: (r[2] - r[0]) * (r[3] - r[1]))
+                shape = face_utils.shape_to_np(predictor(gray, myfatigue.face_to_rect(face, frame.shape)))
+            with timer('ear_mar'):
+                ear, mar = myfatigue.fatigue_ratios(shape)
+
+        with timer('yolo_pre'):
+            img = pre.load(0, frame)[None]
+        with timer('yolo_infer'):
+            pred = backend(img)
+        with timer('yolo_post'):
+            with torch.no_grad():
+                det = batched_non_max_suppression(pred, mydetect.opt_conf_thres, mydetect.opt_iou_thres)[0]
+            action = mydetect._postprocess(det, (h, w), frame, backend.names)
+
+        with timer('draw'):
+            if shape is not None:
+                myfatigue.draw_landmarks(frame, shape, ear, mar)
+            for label, prob, xyxy in action:
+                left, top, right, bottom = map(int, xyxy)
+                cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 1)
+                cv2.putText(frame, f"{label} {prob:.2f}", (left, top - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 1)
+        with timer('encode'):
+            writer.write(frame)
+        timer.add('frame', time.perf_counter() - t_frame)
+    return timer
+
+
+def bench_process(frames):
+    """摄像头模式 myframe.process 的单帧延迟（含人脸跟踪、ROI、并行分支）"""
+    import myframe
+    import myimage
+
+    myimage.reset_stats()
+    myframe.tracker.reset()
+    myframe._roi_box = None
+    timer = StageTimer()
+    for frame in frames:
+        with timer('myframe.process'):
+            myframe.process(frame.copy())
+        for k, v in myframe.timings.items():
+            if k != 'total':
+                timer.add(f'myframe.{k}', v)
+    return timer
+
+
+class _LimitedCapture:
+    """只读取前 n 帧的 VideoCapture 包装"""
+
+    def __init__(self, cap, n):
+        self.cap, self.left = cap, n
+
+    def get(self, prop):
+        return self.cap.get(prop)
+
+    def read(self, image=None):
+        if self.left <= 0:
+            return False, None
+        self.left -= 1
+        return self.cap.read(image)
+
+
+def bench_video(source, n, out_path):
+    """离线视频模式（与 gradio_frontend.process_video 相同的逐帧分析 + VideoPipeline 解码/编码重叠）的吞吐量"""
+    import myfatigue
+    from myvideo import EventDetector, VideoPipeline, draw_overlay
+
+    cap = cv2.VideoCapture(source)
+    fps = int(cap.get(cv2.CAP_PROP_FPS)) or 30
+    size = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    writer = cv2.VideoWriter(out_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    detector = EventDetector(fps, min_interval_frames=fps)
+    timer = StageTimer()
+
+    def render(index, frame):
+        with timer('video.analyse'):
+            shape, ear, mar = myfatigue.analyse(frame)
+        if shape is not None:
+            myfatigue.draw_landmarks(frame, shape, ear, mar)
+        draw_overlay(frame, detector.update(index, ear, mar), detector, index, None, fps)
+        return frame
+
+    pipeline = VideoPipeline(_LimitedCapture(cap, n), writer).run(render)
+    cap.release()
+    writer.release()
+    return timer, pipeline.frames / pipeline.wall_time if pipeline.wall_time > 0 else 0.0
+
+
+def _bench_config(source, n, threads, backend_name, tmp):
+    """bench_pipeline 的一个线程数配置，在单独的进程中运行"""
+    import mydetect
+    import myimage
+    from myregistry import registry
+
+    frames = read_frames(source, n)
+    set_threads(threads)
+    backend = mydetect.create_backend(backend_name, threads=threads)
+    registry.set('yolo', backend)  # myframe.process 使用同一个后端
+    mydetect.predict(frames[0], backend=backend)  # 预热
+
+    writer = cv2.VideoWriter(os.path.join(tmp, f'stages_{threads}.mp4'), cv2.VideoWriter_fourcc(*'mp4v'), 30,
+                             frames[0].shape[1::-1])
+    t = time.perf_counter()
+    timer = bench_stages(frames, backend, writer)
+    stage_fps = len(frames) / (time.perf_counter() - t)
+    writer.release()
+
+    t = time.perf_counter()
+    process_timer = bench_process(frames)
+    process_fps = len(frames) / (time.perf_counter() - t)
+    video_timer, video_fps = bench_video(source, len(frames), os.path.join(tmp, f'video_{threads}.mp4'))
+
+    return {
+        'threads': threads,
+        'frames': len(frames),
+        'stages': {**timer.stats(), **process_timer.stats(), **video_timer.stats()},
+        'throughput_fps': {'stages': stage_fps, 'myframe.process': process_fps, 'process_video': video_fps},
+        'peak_rss_mb': peak_rss_mb(),
+        'image_cache': myimage.stats(),  # myframe.process 期间的图像变换计算/节省次数
+    }
+
+
+def bench_pipeline(source, n, thread_counts, backend_name=None):
+    """端到端基准：每个线程数配置下的分阶段延迟分位数、吞吐量和峰值内存
+
+    每个配置在新启动的子进程中运行：峰值内存是整个进程的历史最大值，同一进程内后面的配置会沿用前面的峰值
+    """
+    import mydetect
+
+    tmp = tempfile.mkdtemp(prefix='fatigue_bench_')
+    if not source:
+        source = synthetic_clip(os.path.join(tmp, 'synthetic.mp4'), n)
+    results = {'build': build_info(), 'source': source, 'frames': 0,
+               'backend': backend_name or mydetect.opt_backend, 'configs': []}
+
+    ctx = multiprocessing.get_context('spawn')
+    for threads in thread_counts:
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+            config = pool.submit(_bench_config, source, n, threads, results['backend'], tmp).result()
+        results['frames'] = config.pop('frames')
+        results['configs'].append(config)
+        fps = config['throughput_fps']
+        print(f"线程数 {threads or '默认'}: 分阶段 {fps['stages']:.1f} fps, "
+              f"myframe.process {fps['myframe.process']:.1f} fps, 视频处理 {fps['process_video']:.1f} fps, "
+              f"峰值内存 {config['peak_rss_mb']:.0f} MB")
+    return results
+
+
+def print_pipeline(results):
+    for config in results['configs']:
+        print(f"\n### 线程数 {config['threads'] or '默认'}（峰值内存 {config['peak_rss_mb']:.0f} MB）")
+        print(f"{'阶段':<22}{'次数':>8}{'平均ms':>10}{'p50ms':>10}{'p90ms':>10}{'p95ms':>10}{'p99ms':>10}{'最大ms':>10}")
+        for stage, r in config['stages'].items():
+            print(f"{stage:<22}{r['count']:>8}{r['mean_ms']:>10.2f}{r['p50_ms']:>10.2f}{r['p90_ms']:>10.2f}"
+                  f"{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['max_ms']:>10.2f}")
+        print("吞吐量: " + ", ".join(f"{k} {v:.1f} fps" for k, v in config['throughput_fps'].items()))
+        if 'image_cache' in config:
+            cache = config['image_cache']
+            print(f"myframe.process 图像变换: 计算 {cache['total_computed']} 次, 节省 {cache['total_saved']} 次 "
+                  f"{cache['saved']}")
+
+
+def compare_results(baseline, current, tolerance=0.1, min_ms=0.5):
+    """与基线结果比较：p50/p95 延迟变慢、吞吐量下降或峰值内存增加超过 tolerance 的项记为回归，返回 [(项目, 基线, 当前, 变化)]
+
+    延迟增加不足 min_ms 毫秒的项不计（亚毫秒阶段的相对抖动很大）
+    """
+    regressions = []
+    base_configs = {c['threads']: c for c in baseline['configs']}
+    for config in current['configs']:
+        base = base_configs.get(config['threads'])
+        if base is None:
+            continue
+        tag = f"threads={config['threads']}"
+        for stage, r in config['stages'].items():
+            b = base['stages'].get(stage)
+            if b is None:
+                continue
+            for key in ('p50_ms', 'p95_ms'):
+                if b[key] > 0 and r[key] > b[key] * (1 + tolerance) and r[key] - b[key] >= min_ms:
+                    regressions.append((f"{tag} {stage} {key}", b[key], r[key], r[key] / b[key] - 1))
+        for name, fps in config['throughput_fps'].items():
+            b = base['throughput_fps'].get(name)
+            if b and fps < b * (1 - tolerance):
+                regressions.append((f"{tag} {name} fps", b, fps, fps / b - 1))
+        b, rss = base.get('peak_rss_mb'), config.get('peak_rss_mb')
+        if b and rss and rss > b * (1 + tolerance):
+            regressions.append((f"{tag} peak_rss_mb", b, rss, rss / b - 1))
+    return regressions
+
+
+def print_regressions(regressions, baseline):
+    print(f"\n与基线比较（{baseline['build'].get('commit') or '未知版本'}, {baseline['build'].get('time', '')}）:")
+    if not regressions:
+        print("未发现性能回归")
+        return
+    print(f"{'项目':<44}{'基线':>10}{'当前':>10}{'变化':>10}")
+    for name, b, c, change in regressions:
+        print(f"{name:<44}{b:>10.2f}{c:>10.2f}{change*100:>+9.1f}%")
+
+
+def print_parity(parity, score_tol=1e-3, match_tol=0.99):
+    for name, c in parity.items():
+        ok = c['max_score_diff'] < score_tol and c['label_match'] >= match_tol
+        print(f"{name}: {'通过' if ok else '不通过'} - 标签一致 {c['label_match']*100:.1f}%, "
+              f"最小IoU {c['min_iou']:.4f}, 置信度最大差 {c['max_conf_diff']:.2e}, "
+              f"原始输出最大差 框 {c['max_box_diff']:.2e} / 分数 {c['max_score_diff']:.2e}")
+
+
+def print_table(results):
+    print(f"\n{'名称':<20}{'帧数':>8}{'平均ms':>10}{'p50ms':>10}{'p95ms':>10}{'FPS':>10}{'检出率':>10}")
+    for name, r in results.items():
+        hit = f"{r['hit_rate']*100:.1f}%" if 'hit_rate' in r else '-'
+        print(f"{name:<20}{r['frames']:>8}{r['mean_ms']:>10.2f}{r['p50_ms']:>10.2f}"
+              f"{r['p95_ms']:>10.2f}{r['fps']:>10.1f}{hit:>10}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('faces', help='人脸检测后端 ms/帧')
+    p.add_argument('--source', type=str, default='video/1.mp4', help='测试视频')
+    p.add_argument('--frames', type=int, default=200, help='测试帧数')
+    p.add_argument('--backends', nargs='+', default=['hog', 'dnn', 'yolo'], help='hog / dnn / yolo')
+    p.add_argument('--threads', type=int, default=0, help='OpenCV/PyTorch 线程数，0 为默认')
+    p = sub.add_parser('detect', help='YOLO推理后端 ms/帧及与PyTorch的一致性')
+    p.add_argument('--source', type=str, default='video/1.mp4', help='测试视频')
+    p.add_argument('--frames', type=int, default=200, help='测试帧数')
+    p.add_argument('--backends', nargs='+', default=['torch', 'onnx', 'openvino'], help='torch / onnx / openvino，第一个作为一致性参考')
+    p.add_argument('--threads', type=int, default=0, help='OpenCV/PyTorch 线程数，0 为默认')
+    p = sub.add_parser('batch', help='predict_batch 吞吐量随批大小的变化')
+    p.add_argument('--source', type=str, default='video/1.mp4', help='测试视频')
+    p.add_argument('--frames', type=int, default=128, help='测试帧数')
+    p.add_argument('--backend', type=str, default='torch', help='torch / onnx / openvino')
+    p.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 2, 4, 8, 16], help='批大小')
+    p.add_argument('--threads', type=int, default=0, help='OpenCV/PyTorch 线程数，0 为默认')
+    p = sub.add_parser('sampling', help='自适应抽帧与逐帧分析的速度和准确性对比')
+    p.add_argument('--source', type=str, default='video/1.mp4', help='测试视频')
+    p.add_argument('--max-steps', nargs='+', type=int, default=[2, 4, 8], help='最大分析间隔')
+    p.add_argument('--ear-threshold', type=float, default=0.3, help='眼睛闭合阈值')
+    p.add_argument('--mar-threshold', type=float, default=0.5, help='打哈欠阈值')
+    p.add_argument('--threads', type=int, default=0, help='OpenCV/PyTorch 线程数，0 为默认')
+    p = sub.add_parser('nms', help='批量NMS与逐图NMS的一致性和耗时（模拟的YOLO输出）')
+    p.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 4, 8, 16], help='批大小')
+    p.add_argument('--conf-thres', nargs='+', type=float, default=[0.001, 0.25, 0.6], help='置信度阈值')
+    p.add_argument('--trials', type=int, default=10, help='每种配置的随机输入数')
+    p.add_argument('--threads', type=int, default=0, help='OpenCV/PyTorch 线程数，0 为默认')
+    p = sub.add_parser('state', help='疲劳状态机向量化重放与逐帧更新的一致性和耗时（模拟的EAR/MAR序列）')
+    p.add_argument('--frames', type=int, default=100000, help='每次测试的帧数')
+    p.add_argument('--trials', type=int, default=5, help='随机序列数')
+    p.add_argument('--threads', type=int, default=0, help='OpenCV/PyTorch 线程数，0 为默认')
+    p = sub.add_parser('pipeline', help='端到端分阶段延迟、吞吐量和峰值内存，结果可保存为JSON并与基线比较')
+    p.add_argument('--source', type=str, default='', help='测试视频，留空时生成合成片段')
+    p.add_argument('--frames', type=int, default=300, help='测试帧数')
+    p.add_argument('--backend', type=str, default=None, help='YOLO推理后端，默认使用 mydetect.opt_backend')
+    p.add_argument('--thread-counts', nargs='+', type=int, default=[1, 2, 4], help='依次测试的线程数，0 为默认')
+    p.add_argument('--json', type=str, default='', help='结果保存路径')
+    p.add_argument('--compare', type=str, default='', help='基线结果JSON，出现回归时以状态码1退出')
+    p.add_argument('--tolerance', type=float, default=0.1, help='允许的性能下降比例')
+    p.add_argument('--threads', type=int, default=0, help='OpenCV/PyTorch 线程数，0 为默认')
+    p = sub.add_parser('preprocess', help='YOLO输入预处理的耗时和每帧内存分配')
+    p.add_argument('--source', type=str, default='video/1.mp4', help='测试视频')
+    p.add_argument('--frames', type=int, default=200, help='测试帧数')
+    p.add_argument('--img-size', type=int, default=640, help='letterbox 尺寸')
+    p.add_argument('--threads', type=int, default=0, help='OpenCV/PyTorch 线程数，0 为默认')
+    opt = parser.parse_args()
+    print(opt)
+
+    # 基准测试固定在CPU上运行
+    os.environ['CUDA_VISIBLE_DEVICES'] = ''
+    if opt.threads > 0:
+        cv2.setNumThreads(opt.threads)
+        import torch
+        torch.set_num_threads(opt.threads)
+
+    if opt.command == 'faces':
+        frames = read_frames(opt.source, opt.frames)
+        print_table(bench_faces(frames, opt.backends))
+    elif opt.command == 'detect':
+        frames = read_frames(opt.source, opt.frames)
+        results, parity = bench_detect(frames, opt.backends, opt.threads)
+        print_table(results)
+        print()
+        print_parity(parity)
+    elif opt.command == 'batch':
+        frames = read_frames(opt.source, opt.frames)
+        print_throughput(bench_batch(frames, opt.backend, opt.batch_sizes, opt.threads))
+    elif opt.command == 'sampling':
+        print_sampling(bench_sampling(opt.source, opt.max_steps, opt.ear_threshold, opt.mar_threshold))
+    elif opt.command == 'nms':
+        print_nms(check_nms(opt.batch_sizes, opt.conf_thres, opt.trials))
+    elif opt.command == 'state':
+        print_state(check_state(opt.frames, opt.trials))
+    elif opt.command == 'pipeline':
+        results = bench_pipeline(opt.source, opt.frames, opt.thread_counts, opt.backend)
+        print_pipeline(results)
+        if opt.json:
+            os.makedirs(os.path.dirname(os.path.abspath(opt.json)), exist_ok=True)
+            with open(opt.json, 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+            print(f"\n结果已保存: {opt.json}")
+        if opt.compare:
+            with open(opt.compare, encoding='utf-8') as f:
+                baseline = json.load(f)
+            regressions = compare_results(baseline, results, opt.tolerance)
+            print_regressions(regressions, baseline)
+            if regressions:
+                sys.exit(1)
+    elif opt.command == 'preprocess':
+        frames = read_frames(opt.source, opt.frames)
+        print_preprocess(bench_preprocess(frames, opt.img_size))
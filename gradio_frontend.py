@@ -1,47 +1,214 @@
 import gradio as gr
 import cv2
 import tempfile
-from myfatigue import detfatigue
+import myfatigue
+from myvideo import (LandmarkSeries, AdaptiveSampler, VideoPipeline, analyse_video, draw_overlay, event_windows,
+                     merge_ranges, open_writer, render_ranges, MIN_PARALLEL_FRAMES, EVENT_PAD_BEFORE, EVENT_PAD_AFTER)
+from mystate import EventDetector, FatigueEngine
+from myjobs import Job, JobScheduler, QueueFullError
+from mycache import LandmarkCache
+from myregistry import registry
+from myanalysis import (VideoAnalysis, analyse_file, cache_keys, EAR_THRESHOLD, MAR_THRESHOLD, FATIGUE_CONSEC_FRAMES,
+                        YAWN_CONSEC_FRAMES, ADAPTIVE_SAMPLING)
+from mytelemetry import TelemetryStore
 import os
 import time
+import threading
+from collections import deque
+
+import numpy as np
+
+# 实时流模式参数
+STREAM_FPS = 10            # 浏览器摄像头推流的名义帧率，用于事件最小间隔换算
+STREAM_MAX_WIDTH = 640     # 分析前把画面缩放到不超过该宽度
+STREAM_HISTORY = 60        # 滚动统计使用的最近帧数
+
+# 视频检测任务调度参数
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))          # 同时处理的视频数
+JOB_QUEUE_DEPTH = int(os.environ.get('JOB_QUEUE_DEPTH', 8))  # 最多排队等待的视频数
+
+# 视频检测默认参数（EAR_THRESHOLD 等阈值见 myanalysis，界面上可调整）
+USE_CACHE = True             # 同一视频再次检测时复用缓存的关键点
+# 输出方式：full 完整标注视频；clips 只编码事件前后的片段（集锦 + 每个事件一个片段）；
+# none 仅分析，只生成报告和逐帧数据，不绘制、不编码视频（标注视频之后按需渲染）
+OUTPUT_MODE = 'full'
+OUTPUT_MODES = {'完整标注视频': 'full', '事件片段': 'clips', '仅分析': 'none'}
+
+
+def parse_time_ranges(text, fps):
+    """解析 "10-20, 35.5-40" 形式的时间范围（秒），返回 [起始帧, 结束帧) 列表"""
+    ranges = []
+    for part in text.replace('，', ',').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            start, end = (float(x) for x in part.split('-'))
+        except ValueError:
+            raise ValueError(f"无法解析时间范围: {part}（格式如 10-20）")
+        if end <= start:
+            raise ValueError(f"时间范围的结束时间应大于开始时间: {part}")
+        ranges.append((int(start * fps), int(np.ceil(end * fps))))
+    return ranges
+
+
+class StreamSession:
+    """单个浏览器会话的实时检测状态：人脸跟踪、连续帧计数、眨眼/哈欠计数和事件日志"""
 
-class FatigueDetectionSystem:
     def __init__(self):
-        self.detection_results = []
-        self.total_frames = 0
-        self.fatigue_frames = 0
-        self.yawn_frames = 0
-        # 添加状态跟踪变量
-        self.fatigue_counter = 0
-        self.yawn_counter = 0
-        self.fatigue_detected = False
-        self.yawn_detected = False
-        self.last_fatigue_time = -1
-        self.last_yawn_time = -1
-
-    def process_video(self, input_video, progress=gr.Progress()):
-        """处理上传的视频文件，进行疲劳检测"""
+        self.tracker = myfatigue.FaceTracker()
+        self.detector = EventDetector(STREAM_FPS)
+        self.engine = FatigueEngine(STREAM_FPS)  # 与桌面端相同的眨眼/哈欠计数规则
+        self.engine_state = None
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.frame_index = 0
+        self.dropped = 0
+        self.events = deque(maxlen=50)
+        self.latencies = deque(maxlen=STREAM_HISTORY)   # 每帧处理耗时（秒）
+        self.frame_times = deque(maxlen=STREAM_HISTORY)  # 每帧处理完成的时间
+        self.last_output = None
+        self.last_ear = 0.0
+        self.last_mar = 0.0
+
+    def process(self, frame_rgb):
+        """分析一帧RGB画面，返回标注后的RGB画面"""
+        t0 = time.perf_counter()
+        frame = cv2.cvtColor(frame_rgb, cv2.COLOR_RGB2BGR)
+        if frame.shape[1] > STREAM_MAX_WIDTH:
+            scale = STREAM_MAX_WIDTH / frame.shape[1]
+            frame = cv2.resize(frame, None, fx=scale, fy=scale)
+
+        shape, ear, mar = self.tracker.analyse(frame)
+        if shape is not None:
+            myfatigue.draw_landmarks(frame, shape, ear, mar)
+
+        elapsed = time.time() - self.start_time
+        state = self.detector.update(self.frame_index, ear, mar)
+        if shape is not None:
+            self.engine_state = self.engine.update(ear, mar)
+        else:
+            self.engine.interrupt()
+        draw_overlay(frame, state, self.detector, self.frame_index, None, STREAM_FPS, current_time=elapsed)
+
+        clock = time.strftime("%H:%M:%S", time.localtime())
+        if state.fatigue_logged:
+            self.events.append(f"{clock} 检测到疲劳 (眼睛比值: {ear:.3f})")
+        if state.yawn_logged:
+            self.events.append(f"{clock} 检测到打哈欠 (嘴巴比值: {mar:.3f})")
+
+        self.frame_index += 1
+        self.last_ear, self.last_mar = ear, mar
+        self.last_output = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        self.latencies.append(time.perf_counter() - t0)
+        self.frame_times.append(time.time())
+        return self.last_output
+
+    def status(self):
+        """滚动状态文本"""
+        if not self.latencies:
+            return "等待摄像头画面..."
+        lat = np.asarray(self.latencies) * 1000.0
+        span = self.frame_times[-1] - self.frame_times[0]
+        fps = (len(self.frame_times) - 1) / span if span > 0 else 0.0
+
+        text = f"""### 实时状态
+- **已分析帧数**: {self.frame_index}（丢弃 {self.dropped} 帧）
+- **分析帧率**: {fps:.1f} fps
+- **处理延迟**: 平均 {lat.mean():.0f} ms, p95 {np.percentile(lat, 95):.0f} ms
+- **当前 EAR / MAR**: {self.last_ear:.3f} / {self.last_mar:.3f}
+- **连续帧计数**: 疲劳 {self.detector.fatigue_frame_count}/{self.detector.FATIGUE_CONSEC_FRAMES}, 打哈欠 {self.detector.yawn_frame_count}/{self.detector.YAWN_CONSEC_FRAMES}
+- **事件数**: 疲劳 {self.detector.fatigue_events} 次, 打哈欠 {self.detector.yawn_events} 次
+"""
+        engine = self.engine_state
+        if engine is not None and engine.valid:
+            text += (f"- **眨眼 / 哈欠**: 近{self.engine.RESET_INTERVAL // 60}分钟眨眼 {engine.blinks} 次, "
+                     f"近{self.engine.YAWN_INTERVAL}秒哈欠 {engine.yawns} 次（平滑 EAR {engine.avg_ear:.3f}）\n")
+            if engine.fatigue:
+                text += f"- **疲劳特征**: {'，'.join(self.engine.fatigue_signs(engine))}\n"
+        if self.events:
+            text += "\n### 最近事件\n" + "".join(f"- {e}\n" for e in list(self.events)[-5:][::-1])
+        return text
+
+
+class FatigueDetectionSystem:
+    def __init__(self, workers=None, job_workers=JOB_WORKERS, queue_depth=JOB_QUEUE_DEPTH):
+        # 离线分析使用的进程数，1 表示串行处理；同时运行的任务平分这些进程
+        self.workers = workers or os.cpu_count() or 1
+        self.scheduler = JobScheduler(job_workers, queue_depth)
+        self.cache = LandmarkCache() if USE_CACHE else None
+
+    def process_video(self, input_video, ear_threshold=EAR_THRESHOLD, mar_threshold=MAR_THRESHOLD,
+                      fatigue_consec_frames=FATIGUE_CONSEC_FRAMES, yawn_consec_frames=YAWN_CONSEC_FRAMES,
+                      adaptive=ADAPTIVE_SAMPLING, output_mode=OUTPUT_MODE, pad_before=EVENT_PAD_BEFORE,
+                      pad_after=EVENT_PAD_AFTER, progress=gr.Progress()):
+        """提交视频检测任务，排队期间显示排队位置和预计等待时间
+
+        output_mode: full / clips / none，也可以是 OUTPUT_MODES 中的界面名称
+        pad_before/pad_after: 事件片段在事件前后保留的秒数
+        返回 (输出视频, 状态, 报告, 统计, 事件片段文件列表, 任务信息)；任务信息供 render_segments 之后按需渲染
+        """
         if input_video is None:
-            return None, "请先上传视频文件", "", ""
-        
-        # 重置统计数据
-        self.detection_results = []
-        self.total_frames = 0
-        self.fatigue_frames = 0
-        self.yawn_frames = 0
-        # 重置状态跟踪变量
-        self.fatigue_counter = 0
-        self.yawn_counter = 0
-        self.fatigue_detected = False
-        self.yawn_detected = False
-        self.last_fatigue_time = -1
-        self.last_yawn_time = -1
+            return None, "请先上传视频文件", "", "", None, None
+
+        cap = cv2.VideoCapture(input_video)
+        if not cap.isOpened():
+            return None, "无法打开视频文件", "", "", None, None
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+
+        try:
+            params = {
+                'ear_threshold': float(ear_threshold),
+                'mar_threshold': float(mar_threshold),
+                'fatigue_consec_frames': int(fatigue_consec_frames),
+                'yawn_consec_frames': int(yawn_consec_frames),
+            }
+            output_mode = OUTPUT_MODES.get(output_mode, output_mode)
+            job = self.scheduler.submit(self._run_job, input_video, params, bool(adaptive), output_mode,
+                                        (float(pad_before), float(pad_after)), total_frames=total_frames)
+        except QueueFullError as e:
+            return None, str(e), "", "", None, None
+
+        self._wait(job, progress)
+        if job.error is not None:
+            return None, f"处理视频时出错: {str(job.error)}", "", "", None, None
+        output_path, status, report, statistics, clips, job_info = job.result
+        if job.queue_time >= 1:
+            status += f"（排队 {job.queue_time:.0f} 秒）"
+        return output_path, status, report, statistics, clips, job_info
+
+    def _wait(self, job, progress):
+        """等待任务完成，排队期间显示排队位置和预计等待时间，运行中显示任务进度"""
+        while not job.wait(timeout=0.5):
+            if job.state == Job.PENDING:
+                progress(0, desc=f"排队中: 第 {self.scheduler.position(job)} 位, "
+                                 f"预计等待 {self.scheduler.eta(job):.0f} 秒")
+            else:
+                progress(job.progress, desc=job.progress_desc or "处理中...")
+
+    def _run_job(self, job, input_video, params, adaptive=ADAPTIVE_SAMPLING, output_mode=OUTPUT_MODE,
+                 clip_pad=(EVENT_PAD_BEFORE, EVENT_PAD_AFTER)):
+        """在调度器工作线程中处理一个视频，所有分析状态都保存在本任务的 VideoAnalysis 中
+
+        output_mode 为 clips / none 时先提取关键点并重放时序逻辑，不经过整段的绘制/编码流水线；
+        clips 再只解码、编码事件前后 clip_pad=(前, 后) 秒的片段
+        """
+        analysis_only = output_mode != 'full'
+        workers = max(1, self.workers // self.scheduler.workers)
+        if not registry.ready(*myfatigue.MODELS):
+            job.report_progress(0, desc="模型加载中...")
+            registry.retry(*myfatigue.MODELS)  # 新任务时重新加载之前失败的模型
+            registry.preload(*myfatigue.MODELS)
+            registry.wait(*myfatigue.MODELS)
+            if not registry.ready(*myfatigue.MODELS):
+                return None, "模型加载失败，无法检测", "", "", None, None
 
         # 打开视频文件
         cap = cv2.VideoCapture(input_video)
         
         if not cap.isOpened():
-            return None, "无法打开视频文件", "", ""
+            return None, "无法打开视频文件", "", "", None, None
         
         # 获取视频属性
         fps = int(cap.get(cv2.CAP_PROP_FPS))
@@ -51,300 +218,325 @@ class FatigueDetectionSystem:
         height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
         total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
         
-        # 创建输出文件路径，使用H264编码确保兼容性
-        timestamp = int(time.time())
-        output_filename = f"fatigue_detection_result_{timestamp}.mp4"
-        output_path = os.path.join(tempfile.gettempdir(), output_filename)
-
-        # 使用H264编码器，兼容性更好
-        fourcc = cv2.VideoWriter_fourcc(*'H264')
-        out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
-
-        # 如果H264不可用，尝试其他编码器
-        if not out.isOpened():
-            fourcc = cv2.VideoWriter_fourcc(*'XVID')
-            out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
-
-        # 如果还是不行，尝试MP4V
-        if not out.isOpened():
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
-
-        if not out.isOpened():
+        output_path, output_filename, out = None, None, None
+        if analysis_only:
             cap.release()
-            return None, "无法创建输出视频文件", "", ""
-
-        frame_count = 0
-
-        # 调整检测阈值和参数，提高检测灵敏度
-        EAR_THRESHOLD = 0.3  # 眼睛闭合阈值
-        MAR_THRESHOLD = 0.5   # 降低打哈欠阈值，提高检测灵敏度
-        FATIGUE_CONSEC_FRAMES = 15  # 降低连续帧要求
-        YAWN_CONSEC_FRAMES = 10     # 降低连续帧要求
-        MIN_INTERVAL_FRAMES = fps * 1  # 降低最小间隔到1秒
-
-        # 连续帧计数器
-        fatigue_frame_count = 0
-        yawn_frame_count = 0
+        else:
+            # 创建输出文件路径，优先使用H264编码确保兼容性
+            timestamp = int(time.time())
+            output_filename = f"fatigue_detection_result_{timestamp}_{job.id}.mp4"  # 并发任务可能在同一秒内开始
+            output_path = os.path.join(tempfile.gettempdir(), output_filename)
+            out = open_writer(output_path, fps, (width, height))
+            if out is None:
+                cap.release()
+                return None, "无法创建输出视频文件", "", "", None, None
 
         # 添加详细的调试信息
-        print(f"视频处理开始:")
+        mode_name = {'clips': '（事件片段）', 'none': '（仅分析）'}.get(output_mode, '')
+        print(f"视频处理开始{mode_name}:")
         print(f"- 视频尺寸: {width}x{height}")
         print(f"- 帧率: {fps} fps")
         print(f"- 总帧数: {total_frames}")
-        print(f"- 检测阈值: EAR < {EAR_THRESHOLD}, MAR > {MAR_THRESHOLD}")
-        print(f"- 确认帧数: 疲劳{FATIGUE_CONSEC_FRAMES}帧, 打哈欠{YAWN_CONSEC_FRAMES}帧")
+        print(f"- 检测阈值: EAR < {params['ear_threshold']}, MAR > {params['mar_threshold']}")
+        print(f"- 确认帧数: 疲劳{params['fatigue_consec_frames']}帧, 打哈欠{params['yawn_consec_frames']}帧")
 
         try:
-            while True:
-                ret, frame = cap.read()
-                if not ret:
-                    break
-                
-                # 进行疲劳检测
-                processed_frame, ear, mar = detfatigue(frame.copy())
-                current_time = frame_count / fps
-
-                # 改进的疲劳检测逻辑
-                current_fatigue = ear < EAR_THRESHOLD and ear > 0
-                current_yawn = mar > MAR_THRESHOLD and mar > 0
-
-                # 疲劳状态检测（需要连续帧确认）
-                if current_fatigue:
-                    fatigue_frame_count += 1
-                else:
-                    fatigue_frame_count = 0
-
-                # 打哈欠检测（需要连续帧确认）
-                if current_yawn:
-                    yawn_frame_count += 1
-                else:
-                    yawn_frame_count = 0
-
-                # 确认疲劳状态
-                is_fatigue_confirmed = fatigue_frame_count >= FATIGUE_CONSEC_FRAMES
-                is_yawn_confirmed = yawn_frame_count >= YAWN_CONSEC_FRAMES
-
-                # 添加状态文本
-                status_text = ""
-                fatigue_logged = False
-                yawn_logged = False
-
-                # 疲劳检测逻辑
-                if is_fatigue_confirmed:
-                    # 检查是否需要记录新的疲劳事件
-                    if self.last_fatigue_time == -1 or (frame_count - self.last_fatigue_time) >= MIN_INTERVAL_FRAMES:
-                        status_text = "检测到疲劳 - 眼睛闭合"
-                        self.fatigue_frames += 1
-                        self.last_fatigue_time = frame_count
-                        fatigue_logged = True
-
-                    cv2.putText(processed_frame, "FATIGUE DETECTED!", (10, 100),
-                              cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 3)
-
-                # 打哈欠检测逻辑
-                if is_yawn_confirmed:
-                    # 检查是否需要记录新的打哈欠事件
-                    if self.last_yawn_time == -1 or (frame_count - self.last_yawn_time) >= MIN_INTERVAL_FRAMES:
-                        status_text += " | 检测到打哈欠" if status_text else "检测到打哈欠"
-                        self.yawn_frames += 1
-                        self.last_yawn_time = frame_count
-                        yawn_logged = True
-
-                    cv2.putText(processed_frame, "YAWNING DETECTED!", (10, 140),
-                              cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 165, 255), 3)
-
-                if not status_text:
-                    status_text = "正常状态"
-                    cv2.putText(processed_frame, "NORMAL", (10, 100),
-                              cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 3)
-                
-                # 显示连续帧计数（用于调试）
-                if fatigue_frame_count > 0:
-                    cv2.putText(processed_frame, f"Fatigue frames: {fatigue_frame_count}/{FATIGUE_CONSEC_FRAMES}",
-                              (10, 180), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 0), 1)
-                if yawn_frame_count > 0:
-                    cv2.putText(processed_frame, f"Yawn frames: {yawn_frame_count}/{YAWN_CONSEC_FRAMES}",
-                              (10, 200), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 0), 1)
-
-                # 添加时间戳
-                timestamp_text = f"Time: {current_time:.1f}s Frame: {frame_count}/{total_frames}"
-                cv2.putText(processed_frame, timestamp_text, (10, height-20),
-                          cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-                
-                # 只在确认检测到事件时记录结果
-                if fatigue_logged or yawn_logged:
-                    self.detection_results.append({
-                        'frame': frame_count,
-                        'timestamp': current_time,
-                        'ear': ear,
-                        'mar': mar,
-                        'is_fatigue': fatigue_logged,
-                        'is_yawn': yawn_logged,
-                        'status': status_text
-                    })
-
-                # 写入输出视频
-                out.write(processed_frame)
-                
-                frame_count += 1
-                self.total_frames = frame_count
-                
-                # 使用Gradio进度条显示百分比进度
-                if frame_count % 10 == 0:  # 每10帧更新一次进度
-                    current_time = frame_count / fps
-                    total_time = total_frames / fps
-                    progress_ratio = (current_time / total_time) if total_time > 0 else 0
-                    progress_text = f"处理进度: {progress_ratio*100:.1f}% ({current_time:.1f}s/{total_time:.1f}s)"
-                    progress(progress_ratio, desc=progress_text)
+            if analysis_only:
+                # 与命令行批处理共用同一分析流程：提取关键点（或读取缓存）、向量化重放时序逻辑、写入逐帧数据
+                t = time.perf_counter()
+                job.report_progress(0, desc="提取关键点...")
+                analysis, series = analyse_file(
+                    input_video, params, adaptive, cache=self.cache, workers=workers,
+                    progress=lambda done, n: job.report_progress(done / n, desc=f"关键点提取: {done}/{n} 段"))
+                detector = analysis.detector
+                pipeline_report = (f"仅分析: {len(series)} 帧, 用时 {time.perf_counter() - t:.1f}s"
+                                   f"{'（关键点来自缓存）' if analysis.from_cache else ''}（未绘制和编码整段视频）")
+            else:
+                # 检测阈值和连续帧数来自界面参数，最小间隔1秒
+                detector = EventDetector(fps, min_interval_frames=fps * 1, **params)
+                analysis = VideoAnalysis(fps, capacity=total_frames)
+                analysis.detector = detector
+                pipeline_report, series = self._analyse_and_render(job, cap, out, input_video, detector, analysis,
+                                                                   adaptive, workers, fps, total_frames)
+            print(f"- {pipeline_report}")
+            print(f"- 逐帧数据: {analysis.telemetry.path}")
+
+            clips = None
+            if output_mode == 'clips':
+                # 只对事件前后的片段解码、绘制和编码
+                output_path, clips, clip_report = self._render_clips(
+                    job, input_video, series, detector, analysis.telemetry, fps, (width, height), clip_pad)
+                print(f"- {clip_report}")
+                pipeline_report += f"\n{clip_report}"
 
         except Exception as e:
-            cap.release()
-            out.release()
-            if os.path.exists(output_path):
+            if out is not None:
+                out.release()
+            if output_path is not None and os.path.exists(output_path):
                 os.remove(output_path)
-            return None, f"处理视频时出错: {str(e)}", "", ""
+            return None, f"处理视频时出错: {str(e)}", "", "", None, None
         
         finally:
             cap.release()
-            out.release()
+            if out is not None:
+                out.release()
         
         # 检查输出文件是否生成成功
-        if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
-            return None, "输出视频文件生成失败", "", ""
+        if not analysis_only and (not os.path.exists(output_path) or os.path.getsize(output_path) == 0):
+            return None, "输出视频文件生成失败", "", "", None, None
 
         # 生成检测报告
-        detection_report = self.generate_detection_report()
-        statistics = self.generate_statistics()
-        
-        return output_path, f"视频处理完成！输出文件: {output_filename}", detection_report, statistics
-
-    def generate_detection_report(self):
-        """生成详细的检测报告"""
-        if self.total_frames == 0:
-            return "暂无检测数据"
-        
-        report = "### 疲劳检测详细报告\n\n"
-        
-        # 按时间顺序显示重要事件
-        fatigue_events = []
-        yawn_events = []
-        
-        for result in self.detection_results:
-            if result['is_fatigue']:
-                fatigue_events.append(f"{result['timestamp']:.1f}s: 检测到疲劳 (眼睛比值:: {result['ear']:.3f})")
-            if result['is_yawn']:
-                yawn_events.append(f"{result['timestamp']:.1f}s: 检测到打哈欠 (嘴巴比值: {result['mar']:.3f})")
-
-        if fatigue_events:
-            report += "### 疲劳事件记录\n"
-            for event in fatigue_events[:10]:  # 显示前10个事件
-                report += f"- {event}\n"
-            if len(fatigue_events) > 10:
-                report += f"- ... 还有 {len(fatigue_events) - 10} 个疲劳事件\n"
-            report += "\n"
-        
-        if yawn_events:
-            report += "### 打哈欠事件记录\n"
-            for event in yawn_events[:10]:  # 显示前10个事件
-                report += f"- {event}\n"
-            if len(yawn_events) > 10:
-                report += f"- ... 还有 {len(yawn_events) - 10} 个打哈欠事件\n"
-            report += "\n"
-        
-        if not fatigue_events and not yawn_events:
-            report += "### 检测结果\n"
-            report += "✅ **一切正常** - 未检测到明显的疲劳或打哈欠行为\n\n"
-            report += "### 检测过程\n"
-            fps = 30  # 假设30fps
-            total_duration = self.total_frames / fps
-            report += f"- **处理帧数**: {self.total_frames} 帧\n"
-            report += f"- **检测时长**: {total_duration:.1f} 秒\n"
-            report += f"- **检测状态**: 全程监控正常\n"
-            report += f"- **安全评级**: 驾驶状态良好\n\n"
-
-        return report
-    
-    def generate_statistics(self):
-        """生成统计信息"""
-        if self.total_frames == 0:
-            return "暂无统计数据"
-        
-        # 计算实际检测时长
-        fps = 30  # 假设30fps
-        total_duration = self.total_frames / fps
-
-        # 计算事件统计
-        fatigue_events_count = len([r for r in self.detection_results if r['is_fatigue']])
-        yawn_events_count = len([r for r in self.detection_results if r['is_yawn']])
-
-        # 计算平均EAR和MAR（从所有有效检测中计算）
-        if self.detection_results:
-            valid_ears = [r['ear'] for r in self.detection_results if r['ear'] > 0]
-            valid_mars = [r['mar'] for r in self.detection_results if r['mar'] > 0]
-            avg_ear = sum(valid_ears) / len(valid_ears) if valid_ears else 0
-            avg_mar = sum(valid_mars) / len(valid_mars) if valid_mars else 0
-        else:
-            avg_ear = 0
-            avg_mar = 0
-
-        # 基于事件频率评估风险等级
-        total_events = fatigue_events_count + yawn_events_count
-        events_per_minute = (total_events * 60) / total_duration if total_duration > 0 else 0
-
-        if events_per_minute > 10:
-            risk_level = "🔴 **高风险** - 频繁疲劳，建议立即休息"
-        elif events_per_minute > 5:
-            risk_level = "🟡 **中风险** - 存在疲劳迹象，建议注意休息"
-        elif events_per_minute > 0:
-            risk_level = "🟢 **低风险** - 偶有疲劳，保持警惕"
+        detection_report = analysis.generate_detection_report()
+        statistics = analysis.generate_statistics()
+        job_info = {'video': input_video, 'telemetry': analysis.telemetry.path, 'params': params}
+        if output_mode == 'clips':
+            status = f"事件片段生成完成！共 {len(clips)} 个片段" if clips else "视频分析完成！"
+        elif analysis_only:
+            status = "视频分析完成！"
         else:
-            risk_level = "✅ **无风险** - 状态良好"
-
-        stats = f"""### 检测统计信息
-
-### 基本信息
-- **检测时长**: {total_duration:.1f} 秒
-- **总帧数**: {self.total_frames}
-- **疲劳事件数**: {fatigue_events_count} 次
-- **打哈欠事件数**: {yawn_events_count} 次
-
-### 风险评估
-- {risk_level}
-- **事件频率**: {events_per_minute:.1f} 次/分钟
-
-### 生理指标
-- **平均眼睛纵横比 (EAR)**: {avg_ear:.3f}
-- **平均嘴巴纵横比 (MAR)**: {avg_mar:.3f}
+            status = f"视频处理完成！输出文件: {output_filename}"
+        return output_path, f"{status}\n{pipeline_report}", detection_report, statistics, clips, job_info
+
+    def _analyse_and_render(self, job, cap, out, input_video, detector, analysis, adaptive, workers, fps,
+                            total_frames):
+        """完整标注视频：关键点（缓存、并行提取或逐帧分析）、时序逻辑、绘制和编码，返回 (流水线报告, LandmarkSeries)"""
+        sampler = AdaptiveSampler.for_detector(detector) if adaptive else None
+
+        # 同一视频再次检测时直接使用缓存的关键点，只重放时序逻辑
+        series = None
+        keys = []
+        if self.cache is not None:
+            job.report_progress(0, desc="计算视频哈希...")
+            keys = cache_keys(self.cache, input_video, sampler)
+            for key in keys:
+                series = self.cache.get(key)
+                if series is not None:
+                    analysis.from_cache = True
+                    analysis.sampling_rate = series.sampling_rate
+                    print(f"- 命中关键点缓存: {len(series)} 帧")
+                    break
 
-### 检测阈值
-- **疲劳检测阈值 (EAR)**: < 0.25
-- **打哈欠检测阈值 (MAR)**: > 0.6
-- **连续帧确认**: 疲劳15帧，打哈欠10帧
-"""
+        # 长视频先用进程池并行提取关键点，自适应抽帧时也先单独提取，再顺序运行时序逻辑并编码
+        parallel = workers > 1 and total_frames >= MIN_PARALLEL_FRAMES
+        if series is None and (parallel or sampler is not None):
+            print(f"- 提取关键点: {workers if parallel else 1} 进程, {'自适应抽帧' if sampler else '逐帧'}")
+            job.report_progress(0, desc="提取关键点...")
+            series = analyse_video(
+                input_video, workers, sampler=sampler,
+                progress=lambda done, n: job.report_progress(done / n, desc=f"关键点提取: {done}/{n} 段"))
+            analysis.sampling_rate = series.sampling_rate
+
+        pipeline_report, series = self._render_video(job, cap, out, series, detector, analysis, fps, total_frames)
+
+        # 保存关键点，之后按需渲染标注片段时不必重新提取
+        analysis.telemetry.save_landmarks(series.shapes)
+        analysis.telemetry.flush()
+        if keys and not analysis.from_cache:
+            self.cache.put(keys[-1], series)
+        analysis.summarize_events()
+        return pipeline_report, series
+
+    def _render_video(self, job, cap, out, series, detector, analysis, fps, total_frames):
+        """逐帧分析（或使用已提取的关键点）、绘制并编码整段视频，返回 (流水线报告, LandmarkSeries)"""
+        # 串行提取时逐帧收集结果，结束后写入缓存
+        extracted = {'ear': [], 'mar': [], 'found': [], 'shapes': []}
+
+        def render(index, frame):
+            # 进行疲劳检测
+            if series is not None and index < len(series):
+                shape = series.shape(index)
+                ear, mar = float(series.ear[index]), float(series.mar[index])
+            else:
+                shape, ear, mar = myfatigue.analyse(frame)
+                extracted['ear'].append(ear)
+                extracted['mar'].append(mar)
+                extracted['found'].append(shape is not None)
+                extracted['shapes'].append(shape if shape is not None else np.zeros((68, 2), dtype=np.int32))
+            if shape is not None:
+                myfatigue.draw_landmarks(frame, shape, ear, mar)
+
+            # 连续帧确认和事件记录
+            state = detector.update(index, ear, mar)
+            draw_overlay(frame, state, detector, index, total_frames, fps)
+            analysis.record(index, fps, ear, mar, state, found=shape is not None)
+
+            # 使用Gradio进度条显示百分比进度
+            if (index + 1) % 10 == 0:  # 每10帧更新一次进度
+                current_time = (index + 1) / fps
+                total_time = total_frames / fps
+                progress_ratio = (current_time / total_time) if total_time > 0 else 0
+                progress_text = f"处理进度: {progress_ratio*100:.1f}% ({current_time:.1f}s/{total_time:.1f}s)"
+                job.report_progress(progress_ratio, desc=progress_text)
+            return frame
+
+        # 解码、编码在独立线程中与分析/绘制重叠执行
+        pipeline = VideoPipeline(cap, out).run(render)
+        if series is None:
+            series = LandmarkSeries(np.asarray(extracted['ear'], dtype=np.float64),
+                                    np.asarray(extracted['mar'], dtype=np.float64),
+                                    np.asarray(extracted['found'], dtype=bool),
+                                    np.asarray(extracted['shapes'], dtype=np.int32).reshape(-1, 68, 2))
+        return pipeline.report(), series
+
+    def _render_clips(self, job, input_video, series, detector, telemetry, fps, size, clip_pad):
+        """事件集锦和每个事件的单独片段，返回 (集锦路径, 片段路径列表, 说明文字)；没有事件时集锦为 None
+
+        集锦为各事件窗口合并后的区间依次拼接；每帧只解码、绘制一次，同时写入集锦和覆盖它的事件片段
+        """
+        total = len(series)
+        fatigue, yawn = telemetry.events('fatigue'), telemetry.events('yawn')
+        events = sorted([(int(i), 'fatigue') for i in fatigue] + [(int(i), 'yawn') for i in yawn])
+        if not events:
+            return None, [], "未检测到事件，没有生成事件片段"
+        before, after = clip_pad
+        frames = [i for i, _ in events]
+        ranges = event_windows(frames, fps, total, before, after)
+        windows = event_windows(frames, fps, total, before, after, merge=False)
+
+        out_dir = tempfile.mkdtemp(prefix=f"fatigue_clips_{int(time.time())}_{job.id}_")
+        clips = [(start, end, os.path.join(out_dir, f"event_{k + 1:03d}_{kind}_{i / fps:.1f}s.mp4"))
+                 for k, ((i, kind), (start, end)) in enumerate(zip(events, windows))]
+        reel_path = os.path.join(out_dir, "highlights.mp4")
+        reel = open_writer(reel_path, fps, size)
+        if reel is None:
+            raise RuntimeError("无法创建输出视频文件")
+
+        def open_clip(path):
+            writer = open_writer(path, fps, size)
+            if writer is None:
+                raise RuntimeError(f"无法创建事件片段文件: {path}")
+            return writer
+
+        t = time.perf_counter()
+        try:
+            written = render_ranges(input_video, series, detector, ranges, reel, total, fps,
+                                    progress=lambda done, n: job.report_progress(done / n, desc=f"事件片段: {done}/{n} 帧"),
+                                    clips=clips, open_clip=open_clip)
+        finally:
+            reel.release()
+        paths = [path for _, _, path in clips if os.path.exists(path)]
+        size_mb = sum(os.path.getsize(f) for f in paths + [reel_path]) / 1e6
+        return reel_path, paths, (f"事件片段: {len(events)} 个事件, 集锦 {written} 帧（{written / max(fps, 1):.1f}s, "
+                                  f"全片的 {written / max(total, 1) * 100:.1f}%）, 编码 {time.perf_counter() - t:.1f}s, "
+                                  f"共 {size_mb:.1f} MB")
+
+    def render_segments(self, job_info, ranges_text="", pad_before=EVENT_PAD_BEFORE, pad_after=EVENT_PAD_AFTER,
+                        progress=gr.Progress()):
+        """按需渲染标注视频：只解码并绘制指定的时间范围（秒，如 "10-20, 35.5-40"），
+        留空时渲染全部事件前后的片段；关键点和状态来自检测时保存的逐帧数据"""
+        if not job_info:
+            return None, "请先完成一次视频检测"
+        try:
+            telemetry = TelemetryStore.open(job_info['telemetry'])
+            shapes = telemetry.landmarks()
+        except FileNotFoundError:
+            return None, "该任务的逐帧数据已被清理，请重新检测"
+        if shapes is None:
+            return None, "该任务没有保存关键点，请重新检测"
+        fps, total = telemetry.fps, len(telemetry)
+
+        if ranges_text and ranges_text.strip():
+            try:
+                ranges = merge_ranges(parse_time_ranges(ranges_text, fps), total)
+            except ValueError as e:
+                return None, str(e)
+        else:
+            events = np.union1d(telemetry.events('fatigue'), telemetry.events('yawn'))
+            ranges = event_windows(events, fps, total, float(pad_before), float(pad_after))
+        if not ranges:
+            return None, "没有需要渲染的片段（时间范围超出视频或未检测到事件）"
 
-        return stats
+        series = LandmarkSeries(np.asarray(telemetry['ear']), np.asarray(telemetry['mar']),
+                                np.asarray(telemetry['found']), shapes)
+        try:
+            job = self.scheduler.submit(self._render_job, job_info, series, fps, ranges,
+                                        total_frames=sum(end - start for start, end in ranges))
+        except QueueFullError as e:
+            return None, str(e)
+        self._wait(job, progress)
+        if job.error is not None:
+            return None, f"渲染出错: {str(job.error)}"
+        return job.result
+
+    def _render_job(self, job, job_info, series, fps, ranges):
+        detector = EventDetector(fps, min_interval_frames=fps * 1, **job_info['params'])
+        cap = cv2.VideoCapture(job_info['video'])
+        if not cap.isOpened():
+            return None, "无法打开原视频文件"
+        size = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        cap.release()
+        output_path = os.path.join(tempfile.gettempdir(), f"fatigue_segments_{int(time.time())}_{job.id}.mp4")
+        writer = open_writer(output_path, fps, size)
+        if writer is None:
+            return None, "无法创建输出视频文件"
+        t = time.perf_counter()
+        try:
+            written = render_ranges(job_info['video'], series, detector, ranges, writer, len(series), fps,
+                                    progress=lambda done, n: job.report_progress(done / n, desc=f"渲染: {done}/{n} 帧"))
+        finally:
+            writer.release()
+        spans = ", ".join(f"{start / fps:.1f}-{end / fps:.1f}s" for start, end in ranges[:5])
+        more = f" 等 {len(ranges)} 段" if len(ranges) > 5 else ""
+        return output_path, (f"已渲染 {written} 帧（{spans}{more}），耗时 {time.perf_counter() - t:.1f}s，"
+                             f"占全片 {written / max(len(series), 1) * 100:.1f}%")
+
+    def process_stream(self, frame, session):
+        """实时流模式：逐帧增量分析，状态保存在每个会话自己的 StreamSession 中"""
+        if frame is None:
+            return None, "等待摄像头画面...", session
+        if not registry.ready(*myfatigue.MODELS):
+            if registry.failed(*myfatigue.MODELS):
+                return frame, "模型加载失败，请点击上方的“重试加载模型”", session
+            registry.preload(*myfatigue.MODELS)
+            return frame, "模型加载中，请稍候...", session
+        if session is None:
+            session = StreamSession()
+
+        # 上一帧还在处理时直接丢弃当前帧，返回上一次的结果，避免排队积压
+        if not session.lock.acquire(blocking=False):
+            session.dropped += 1
+            return session.last_output, session.status(), session
+        try:
+            output = session.process(frame)
+        except Exception as e:
+            return session.last_output, f"处理画面时出错: {str(e)}", session
+        finally:
+            session.lock.release()
+        return output, session.status(), session
+
+    def model_status(self):
+        """模型加载状态"""
+        if registry.ready(*myfatigue.MODELS):
+            return "模型已就绪"
+        loading = not registry.wait(*myfatigue.MODELS, timeout=0)
+        return ("**模型加载中...**" if loading else "**模型加载失败**") + "\n\n" + "\n".join(
+            f"- {registry.entry(name).format()}" for name in myfatigue.MODELS)
+
+    def refresh_model_status(self):
+        """定时刷新模型状态：加载结束（成功或失败）后停止定时器，失败时显示重试按钮"""
+        done = registry.wait(*myfatigue.MODELS, timeout=0)
+        return (self.model_status(), gr.Timer(active=not done),
+                gr.Button(visible=registry.failed(*myfatigue.MODELS)))
+
+    def retry_models(self):
+        """重新加载失败的模型，并重新开始刷新状态"""
+        registry.retry(*myfatigue.MODELS)
+        return self.model_status(), gr.Timer(active=True), gr.Button(visible=False)
+
+    def reset_stream(self):
+        """清除当前会话的实时检测状态"""
+        return None, "等待摄像头画面...", None
 
     def clear_all(self):
-        """清除所有数据和界面内容"""
-        # 重置所有统计数据
-        self.detection_results = []
-        self.total_frames = 0
-        self.fatigue_frames = 0
-        self.yawn_frames = 0
-        self.fatigue_counter = 0
-        self.yawn_counter = 0
-        self.fatigue_detected = False
-        self.yawn_detected = False
-        self.last_fatigue_time = -1
-        self.last_yawn_time = -1
-
+        """清除界面内容（分析状态都属于各自的任务，无需重置）"""
         return (
             None,  # input_video
             None,  # output_video
             "等待上传视频...",  # status_text
             "上传视频并开始检测后，这里将显示详细的检测报告",  # report_output
-            "上传视频并开始检测后，这里将显示统计信息"  # statistics_output
+            "上传视频并开始检测后，这里将显示统计信息",  # statistics_output
+            None,  # event_clips
+            None  # job_state
         )
 
     def create_interface(self):
@@ -356,6 +548,10 @@ class FatigueDetectionSystem:
                 <p>上传视频文件进行疲劳检测，系统将自动分析眼睛闭合和打哈欠行为</p>
             </div>
             """)
+            with gr.Row():
+                model_status = gr.Markdown(value=self.model_status)
+                retry_models_btn = gr.Button("重试加载模型", size="sm", visible=False)
+            model_timer = gr.Timer(2)
             
             with gr.Row():
                 # 左侧：视频处理区域
@@ -384,6 +580,38 @@ class FatigueDetectionSystem:
                             size="lg"
                         )
 
+                    with gr.Accordion("检测参数", open=False):
+                        with gr.Row():
+                            ear_slider = gr.Slider(0.1, 0.4, value=EAR_THRESHOLD, step=0.01,
+                                                   label="眼睛闭合阈值 (EAR <)")
+                            mar_slider = gr.Slider(0.3, 1.0, value=MAR_THRESHOLD, step=0.01,
+                                                   label="打哈欠阈值 (MAR >)")
+                        with gr.Row():
+                            fatigue_frames_slider = gr.Slider(1, 60, value=FATIGUE_CONSEC_FRAMES, step=1,
+                                                              label="疲劳确认帧数")
+                            yawn_frames_slider = gr.Slider(1, 60, value=YAWN_CONSEC_FRAMES, step=1,
+                                                           label="打哈欠确认帧数")
+                        adaptive_checkbox = gr.Checkbox(value=ADAPTIVE_SAMPLING, label="自适应抽帧",
+                                                        info="状态平稳时隔帧分析、接近阈值时逐帧分析，结果为插值近似；"
+                                                             "抽帧结果与阈值有关，修改阈值后需重新提取关键点")
+                        output_mode_radio = gr.Radio(list(OUTPUT_MODES), label="输出方式",
+                                                     value=next(k for k, v in OUTPUT_MODES.items() if v == OUTPUT_MODE),
+                                                     info="事件片段只编码事件前后的画面；仅分析只生成报告和统计")
+                        with gr.Row():
+                            pad_before_slider = gr.Slider(0, 10, value=EVENT_PAD_BEFORE, step=0.5,
+                                                          label="事件前保留（秒）")
+                            pad_after_slider = gr.Slider(0, 10, value=EVENT_PAD_AFTER, step=0.5,
+                                                         label="事件后保留（秒）")
+                        gr.Markdown("逐帧分析时，同一视频修改参数后重新检测会复用已提取的关键点，只重新判定事件")
+
+                    job_state = gr.State(None)
+                    with gr.Accordion("按需渲染标注视频", open=False):
+                        ranges_text = gr.Textbox(label="时间范围（秒）", placeholder="如 10-20, 35.5-40；留空渲染全部事件前后的片段")
+                        render_btn = gr.Button("渲染标注片段", size="sm")
+                        gr.Markdown("使用检测时保存的关键点，只解码和绘制所选时间范围")
+
+                    event_clips = gr.File(label="事件片段", file_count="multiple", interactive=False)
+
                     gr.Markdown("### 处理状态")
                     status_text = gr.Textbox(
                         label="处理状态",
@@ -452,17 +680,75 @@ class FatigueDetectionSystem:
                     - **风险等级**: 根据疲劳帧占比自动评估
                     """)
 
+            gr.Markdown("### 实时摄像头检测")
+            stream_session = gr.State(None)
+            with gr.Row():
+                with gr.Column(scale=3):
+                    with gr.Row():
+                        webcam_input = gr.Image(
+                            label="摄像头画面",
+                            sources=["webcam"],
+                            streaming=True,
+                            type="numpy",
+                            height=300
+                        )
+                        webcam_output = gr.Image(
+                            label="实时检测结果",
+                            type="numpy",
+                            height=300
+                        )
+                    stream_reset_btn = gr.Button("重置实时统计", size="sm")
+                with gr.Column(scale=2):
+                    stream_status = gr.Markdown("打开摄像头后，这里将显示实时检测状态")
+
             # 绑定事件
+            # 模型状态只在加载期间刷新
+            model_timer.tick(
+                fn=self.refresh_model_status,
+                outputs=[model_status, model_timer, retry_models_btn],
+                show_progress="hidden"
+            )
+            retry_models_btn.click(
+                fn=self.retry_models,
+                outputs=[model_status, model_timer, retry_models_btn]
+            )
+
+            # 实时流：处理中时只保留最新一帧（always_last），其余帧丢弃
+            webcam_input.stream(
+                fn=self.process_stream,
+                inputs=[webcam_input, stream_session],
+                outputs=[webcam_output, stream_status, stream_session],
+                trigger_mode="always_last",
+                show_progress="hidden"
+            )
+
+            stream_reset_btn.click(
+                fn=self.reset_stream,
+                inputs=[],
+                outputs=[webcam_output, stream_status, stream_session]
+            )
+
+            # 并发由 JobScheduler 控制，这里放行足够多的请求进入调度器排队
             process_btn.click(
                 fn=self.process_video,
-                inputs=[input_video],
-                outputs=[output_video, status_text, report_output, statistics_output]
+                inputs=[input_video, ear_slider, mar_slider, fatigue_frames_slider, yawn_frames_slider,
+                        adaptive_checkbox, output_mode_radio, pad_before_slider, pad_after_slider],
+                outputs=[output_video, status_text, report_output, statistics_output, event_clips, job_state],
+                concurrency_limit=self.scheduler.workers + self.scheduler.queue_depth
+            )
+
+            render_btn.click(
+                fn=self.render_segments,
+                inputs=[job_state, ranges_text, pad_before_slider, pad_after_slider],
+                outputs=[output_video, status_text],
+                concurrency_limit=self.scheduler.workers + self.scheduler.queue_depth
             )
 
             clear_btn.click(
                 fn=self.clear_all,
                 inputs=[],
-                outputs=[input_video, output_video, status_text, report_output, statistics_output]
+                outputs=[input_video, output_video, status_text, report_output, statistics_output, event_clips,
+                         job_state]
             )
 
             # 加载示例视频事件
@@ -483,8 +769,12 @@ class FatigueDetectionSystem:
 
 def main():
     """主函数"""
+    t = time.time()
+    # 模型在后台加载，界面先启动，加载完成前界面显示"模型加载中"
+    registry.preload(*myfatigue.MODELS)
     system = FatigueDetectionSystem()
     demo = system.create_interface()
+    print(f"界面已创建 ({time.time() - t:.1f}s)，模型在后台加载")
     
     # 启动界面
     demo.launch(
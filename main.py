@@ -3,6 +3,10 @@ import sys
 import cv2
 import time
 import myframe
+import myimage
+from mypipeline import CameraPipeline
+from mystate import FatigueEngine
+from myregistry import registry
 from PySide2 import QtWidgets
 from PySide2.QtWidgets import QMainWindow, QApplication
 from PySide2.QtCore import QTimer, QSize
@@ -26,10 +30,13 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.setupUi(self)
         self.f_type = 0
         self.cap = None  # 初始化摄像头对象为None
+        self.pipeline = None  # 采集/推理线程流水线
+        self.stopping_pipeline = None  # 已通知停止但线程尚未结束的流水线
         self.timer = QTimer()
         self.timer.timeout.connect(self.update_frame)
         self.timer.setInterval(16)
-        self.last_time = time.time()
+        self.LATENCY_LOG_INTERVAL = 5  # 延迟统计写入日志的间隔（秒）
+        self.last_latency_log = time.time()
         
         # 简化阈值设置
         self.EYE_THRESH = 0.3         # 眨眼阈值
@@ -47,24 +54,19 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         
         # 计数器重置时间
         self.RESET_INTERVAL = 300      # 5分钟重置一次计数
-        self.last_reset_time = time.time()
-        
-        # 状态变量
-        self.eye_closed_confirm = 0
-        self.eye_open_confirm = 0
-        self.last_eye_state = 'open'
-        self.COUNTER = 0
-        self.mCOUNTER = 0
-        
-        # 记录列表
-        self.blink_times = []
-        self.yawn_times = []
         
         # EAR历史记录
-        self.last_ear_values = []
         self.EAR_HISTORY_LENGTH = 5
         self.min_valid_ear = 0.2
         
+        # 疲劳状态机（EAR平滑、闭眼确认、眨眼/哈欠计数和时间窗口），与网页端共用
+        self.engine = FatigueEngine(
+            closed_eye_threshold=self.CLOSED_EYE_THRESH, mouth_threshold=self.MOUTH_THRESH,
+            min_valid_ear=self.min_valid_ear, smooth_frames=self.EAR_HISTORY_LENGTH,
+            confirm_frames=self.EYE_CONFIRM_FRAMES, min_blink_frames=self.MIN_BLINK_FRAMES,
+            max_blink_frames=self.MAX_BLINK_FRAMES, min_yawn_frames=self.MIN_YAWN_FRAMES,
+            yawn_window=self.YAWN_INTERVAL, max_yawn_count=self.MAX_YAWN_COUNT, reset_interval=self.RESET_INTERVAL)
+        
         # 初始化计数器和状态变量
         self.TOTAL = 0
         self.mTOTAL = 0
@@ -75,23 +77,11 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.last_yawn_check = time.time()
         self.last_log_time = time.time()
         
-        # 初始化眼睛状态确认计数器
-        self.eye_closed_confirm = 0
-        self.eye_open_confirm = 0
-        
-        # 以0.27为疲劳判定标准调整阈值
-        self.EYE_THRESH = 0.3         # 眨眼阈值
-        self.CLOSED_EYE_THRESH = 0.27  # 将0.27设为疲劳判定阈值
-        self.MIN_BLINK_FRAMES = 2      # 最少闭眼帧数
-        self.MAX_BLINK_FRAMES = 7      # 最大闭眼帧数
-        self.CLOSED_EYE_FRAMES = 8     # 持续闭眼判定帧数
-        self.EYE_CONFIRM_FRAMES = 2    # 状态确认帧数
         self.FATIGUE_INTERVAL = 20     # 疲劳检测时间窗口
         
         # 疲劳分数相关
         self.fatigue_score = 0.0
         self.fatigue_decay_rate = 0.05
-        self.min_valid_ear = 0.2       # 最小有效EAR值
         self.fatigue_threshold = 45     # 疲劳分数阈值
         
         # 更新状态阈值
@@ -102,9 +92,6 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             'closed': (0.2, '闭眼')         # <= 0.2 闭眼
         }
         
-        # 添加EAR历史记录
-        self.last_ear_values = []      # 初始化EAR历史记录列表
-        self.EAR_HISTORY_LENGTH = 5    # 设置历史记录长度
         self.consecutive_detections = 0 # 连续检测计数
         
         # 初始化标签
@@ -112,6 +99,21 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.actionOpen_camera.triggered.connect(self.CamConfig_init)
         self.setup_labels_style()
 
+        # 模型在后台加载，窗口先显示，加载完成后把各组件耗时写入日志
+        registry.preload(*myframe.MODELS)
+        self.log_event("模型加载中...")
+        self.model_timer = QTimer()
+        self.model_timer.timeout.connect(self.check_models)
+        self.model_timer.start(200)
+
+    def check_models(self):
+        """模型后台加载结束后记录各组件的加载和预热耗时"""
+        if not registry.wait(*myframe.MODELS, timeout=0):
+            return
+        self.model_timer.stop()
+        for name in myframe.MODELS:
+            self.log_event(registry.entry(name).format())
+
     def init_labels(self):
         self.label.setText("请打开摄像头")
         self.label_2.setText("疲劳检测：")
@@ -127,25 +129,6 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         # 设置标签样式
         self.label_10.setStyleSheet("QLabel { color: green; }")
 
-    def process_frame(self, frame):
-        current_time = time.time()
-        if current_time - self.last_time < 1/30:  # 限制帧率
-            return None
-        
-        self.last_time = current_time
-        
-        # 添加处理时间日志
-        start_process_time = time.time()
-        
-        frame = cv2.resize(frame, (640, 480))
-        
-        # 记录处理耗时
-        process_time = time.time() - start_process_time
-        if process_time > 0.1:  # 果处理时间超过100ms，记录日志
-            self.log_event(f"警告：帧处理耗时长 - {process_time:.3f}秒")
-        
-        return frame
-
     def showImage(self, img):
         """显示图像到QLabel"""
         try:
@@ -155,7 +138,8 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             elif img.ndim == 2:
                 rgb = cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
 
-            temp_image = QImage(rgb.flatten(), width, height, QImage.Format_RGB888)
+            # 直接引用连续的 RGB 缓冲区（按行跨度），fromImage 时才复制一次
+            temp_image = QImage(rgb.data, width, height, rgb.strides[0], QImage.Format_RGB888)
             temp_pixmap = QPixmap.fromImage(temp_image)
             
             # 获取label的大小
@@ -170,52 +154,50 @@ class MainWindow(QMainWindow, Ui_MainWindow):
     def closeEvent(self, event):
         """窗口关闭事件"""
         try:
-            if hasattr(self, 'cap') and self.cap and self.cap.isOpened():
-                self.cap.release()
             if hasattr(self, 'timer') and self.timer.isActive():
                 self.timer.stop()
+            if self.pipeline:
+                self.pipeline.stop()  # 摄像头由采集线程释放，超时未结束的线程为守护线程，随进程退出
+                self.pipeline = None
+            elif hasattr(self, 'cap') and self.cap and self.cap.isOpened():
+                self.cap.release()
             event.accept()
         except Exception as e:
             self.log_event(f"关闭窗口误: {str(e)}")
             event.accept()
 
     def update_frame(self):
-        if self.f_type == 1 and self.cap and self.cap.isOpened():
-            ret, frame = self.cap.read()
-            if ret:
-                try:
-                    frame = self.process_frame(frame)
-                    if frame is None:
-                        return
-                    
-                    # 面部特征检测
-                    frame, eye, mouth, labellist = myframe.process(frame)
-                    
-                    # 如果检测失败，重置计数器
-                    if eye is None or mouth is None:
-                        self.COUNTER = 0
-                        self.last_eye_state = 'open'
-                        self.label_9.setText("未能检测到面部特征")
-                        # 仍然显示原始帧
-                        show = cv2.resize(frame, (640, 480))
-                        self.showImage(show)
-                        return
-                    
-                    # 更新状态
-                    self.update_fatigue_status(eye, mouth)
-                    self.update_behavior_detection(labellist)
-                    
-                    # 显示帧
-                    show = cv2.resize(frame, (640, 480))
-                    self.showImage(show)
-                    
-                except Exception as e:
-                    self.log_event(f"处理帧错误: {str(e)}")
-                    self.COUNTER = 0
-                    self.last_eye_state = 'open'
-                    # 发生错误时显示原始帧
-                    show = cv2.resize(frame, (640, 480))
-                    self.showImage(show)
+        """渲染阶段（Qt线程）：取推理线程的最新结果刷新界面"""
+        if self.f_type != 1 or self.pipeline is None:
+            return
+        result = self.pipeline.poll()
+        if result is None:
+            return
+
+        t_render = time.perf_counter()
+        frame = result.frame
+        if result.error is not None:
+            self.log_event(f"处理帧错误: {str(result.error)}")
+            self.engine.interrupt()
+        elif result.eye is None or result.mouth is None:
+            # 如果检测失败，重置计数器
+            self.engine.interrupt()
+            self.label_9.setText("未能检测到面部特征")
+        else:
+            # 更新状态
+            self.update_fatigue_status(result.eye, result.mouth)
+            self.update_behavior_detection(result.labellist)
+
+        # 显示帧
+        show = myimage.fit(frame, (640, 480))  # 推理线程已缩放到 640x480 时不再复制
+        self.showImage(show)
+        self.pipeline.record_render(result, t_render, time.perf_counter())
+
+        # 定期把各阶段延迟写入日志面板
+        if time.time() - self.last_latency_log >= self.LATENCY_LOG_INTERVAL:
+            self.log_event(self.pipeline.report())
+            self.log_event(myimage.format_stats())
+            self.last_latency_log = time.time()
 
     def log_event(self, message):
         """添加日志到文本框"""
@@ -224,109 +206,45 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.textBrowser.append(log_message)
 
     def update_fatigue_status(self, eye, mouth):
-        current_time = time.time()
+        state = self.engine.update(eye, mouth)
         
-        # 定期重置计数器
-        if current_time - self.last_reset_time >= self.RESET_INTERVAL:
-            self.blink_times = []
-            self.yawn_times = []
-            self.last_reset_time = current_time
+        if state.reset:
             self.label_3.setText("眨眼次数：0")
             self.label_4.setText("哈欠次数：0")
             self.log_event("计数器已重置")
         
-        # 清理超出时间窗口的记录
-        self.blink_times = [t for t in self.blink_times if current_time - t <= self.RESET_INTERVAL]
-        self.yawn_times = [t for t in self.yawn_times if current_time - t <= self.YAWN_INTERVAL]
-        
-        if eye < self.min_valid_ear or eye == 0:
-            self.eye_closed_confirm = 0
-            self.eye_open_confirm = 0
-            self.COUNTER = 0
-            self.last_eye_state = 'open'
-            self.last_ear_values = []
+        if not state.valid:
             self.label_3.setText("眨眼次数：未检测")
             self.label_10.setText("未能检测到面部特征\n请调整面部角度")
             self.label_10.setStyleSheet("QLabel { color: orange; }")
             return
-            
-        # 更新EAR历史记录和计算平均值
-        self.last_ear_values.append(eye)
-        if len(self.last_ear_values) > self.EAR_HISTORY_LENGTH:
-            self.last_ear_values.pop(0)
-            
-        valid_ears = [e for e in self.last_ear_values if e >= self.min_valid_ear]
-        if not valid_ears:
-            return
-        avg_ear = sum(valid_ears) / len(valid_ears)
         
-        # 眼睛状态检测
-        if avg_ear <= self.CLOSED_EYE_THRESH:  # 疲劳状态
-            self.eye_closed_confirm += 1
-            self.eye_open_confirm = 0
-            
-            if self.eye_closed_confirm >= self.EYE_CONFIRM_FRAMES:
-                if self.last_eye_state == 'open':
-                    self.COUNTER = 1
-                    self.last_eye_state = 'closed'
-                    self.log_event(f"检测到疲劳状态 - EAR: {avg_ear:.3f}")
-                else:
-                    self.COUNTER += 1
-        else:  # EAR > 0.27，清醒状态
-            self.eye_open_confirm += 1
-            self.eye_closed_confirm = 0
-            
-            if self.eye_open_confirm >= self.EYE_CONFIRM_FRAMES:
-                if self.last_eye_state == 'closed':
-                    if self.MIN_BLINK_FRAMES <= self.COUNTER <= self.MAX_BLINK_FRAMES:
-                        self.blink_times.append(current_time)
-                        self.TOTAL += 1
-                        self.label_3.setText(f"眨眼次数：{len(self.blink_times)}")
-                self.COUNTER = 0
-                self.last_eye_state = 'open'
-        
-        # 哈欠检测
-        if mouth > self.MOUTH_THRESH:
-            self.mCOUNTER += 1
-        else:
-            if self.mCOUNTER >= self.MIN_YAWN_FRAMES:
-                self.yawn_times.append(current_time)
-                self.label_4.setText(f"哈欠次数：{len(self.yawn_times)}")
-                self.log_event(f"检测到哈欠 - MAR: {mouth:.3f}")
-            self.mCOUNTER = 0
-        
-        # 判断疲劳状态
-        is_fatigue = False
-        fatigue_signs = []
-        
-        # 基于EAR的疲劳判断
-        if avg_ear <= self.CLOSED_EYE_THRESH:
-            is_fatigue = True
-            fatigue_signs.append(f"EAR值过低({avg_ear:.3f})")
-        
-        # 基于哈欠的疲劳判断
-        recent_yawns = len(self.yawn_times)
-        if recent_yawns >= self.MAX_YAWN_COUNT:
-            is_fatigue = True
-            fatigue_signs.append(f"频繁哈欠({recent_yawns}次/{self.YAWN_INTERVAL}秒)")
+        if state.closed_started:
+            self.log_event(f"检测到疲劳状态 - EAR: {state.avg_ear:.3f}")
+        if state.blink:
+            self.TOTAL += 1
+            self.label_3.setText(f"眨眼次数：{state.blinks}")
+        if state.yawn:
+            self.label_4.setText(f"哈欠次数：{state.yawns}")
+            self.log_event(f"检测到哈欠 - MAR: {mouth:.3f}")
         
         # 更新调试信息
         debug_text = f"当前EAR: {eye:.3f}\n"
-        debug_text += f"平均EAR: {avg_ear:.3f}\n"
+        debug_text += f"平均EAR: {state.avg_ear:.3f}\n"
         debug_text += f"当前MAR: {mouth:.3f}\n"
-        debug_text += f"哈欠计数: {self.mCOUNTER}\n"
-        debug_text += f"状态: {'疲劳' if is_fatigue else '清醒'}"
+        debug_text += f"哈欠计数: {state.yawn_frames}\n"
+        debug_text += f"状态: {'疲劳' if state.fatigue else '清醒'}"
         self.label_9.setText(debug_text)
         
         # 更新UI显示
-        if is_fatigue:
+        if state.fatigue:
             status_text = "警告：检测到疲劳！\n"
-            status_text += "疲劳特征：\n" + "\n".join(fatigue_signs)
+            status_text += "疲劳特征：\n" + "\n".join(self.engine.fatigue_signs(state))
             status_text += "\n建议：请注意休息"
             self.label_10.setText(status_text)
             self.label_10.setStyleSheet("QLabel { color: red; font-weight: bold; }")
         else:
-            self.label_10.setText(f"当前状态：清醒\nEAR值：{avg_ear:.3f}")
+            self.label_10.setText(f"当前状态：清醒\nEAR值：{state.avg_ear:.3f}")
             self.label_10.setStyleSheet("QLabel { color: green; }")
 
     def update_behavior_detection(self, labellist):
@@ -364,20 +282,44 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
     def CamConfig_init(self):
         if self.f_type == 0:
+            if self.stopping_pipeline is not None and self.stopping_pipeline.alive():
+                self.log_event("上一次的摄像头线程尚未结束，请稍后再打开摄像头")
+                return
+            self.stopping_pipeline = None
             self.cap = cv2.VideoCapture(0)  # 打开摄像头
             if not self.cap.isOpened():
                 self.log_event("错误：无法打开摄像头")
                 return
             self.f_type = 1
+            if registry.retry(*myframe.MODELS):
+                # 打开摄像头时重新加载之前失败的模型，加载结束后再记录结果
+                self.log_event("重新加载失败的模型...")
+                self.model_timer.start(200)
+            if not registry.ready(*myframe.MODELS):
+                self.log_event("模型尚未加载完成，首帧将在加载完成后显示")
+            # 记录关键点和YOLO两个分支各自的耗时
+            self.pipeline = CameraPipeline(self.cap, myframe.process,
+                                           timings_fn=lambda: {f"分支-{k}": v for k, v in myframe.timings.items()
+                                                               if k != 'total'})
+            self.pipeline.start()
+            self.last_latency_log = time.time()
             self.timer.start()
             self.log_event("摄像头已打开")
         else:
             self.f_type = 0
             self.timer.stop()
-            if self.cap:
-                self.cap.release()  # 放摄像头
+            if self.pipeline:
+                self.log_event(self.pipeline.report())
+                # 不阻塞界面：超时仍未结束时记下，结束前不允许重新打开；摄像头由采集线程释放
+                if not self.pipeline.stop():
+                    self.stopping_pipeline = self.pipeline
+                self.pipeline = None
+            self.cap = None
             self.label.setText("请打开摄像头")
             self.log_event("摄像头已关闭")
+            stats = myframe.tracker.stats
+            self.log_event(f"人脸跟踪统计: 完整检测 {stats['detected_frames']} 帧, "
+                           f"跟踪 {stats['tracked_frames']} 帧, 漂移重检 {stats['redetect_on_drift']} 次")
 
     def setup_labels_style(self):
         # 设置标签自动换行和宽度
@@ -0,0 +1,220 @@
+"""Post-training INT8 quantization of the exported YOLOv5 ONNX model (ONNX Runtime static quantization)
+
+Calibration frames are letterboxed exactly like mydetect.predict() and fed through the FP32 model to collect
+activation ranges; the result is a QDQ model that mydetect's onnx/openvino backends pick up automatically
+(weights/best.int8.onnx, see mydetect.int8_weights). With --data the FP32 and INT8 models are evaluated on a
+labelled YOLO-format image folder using utils/metrics.py and the mAP delta is reported.
+
+Usage:
+    $ export PYTHONPATH="$PWD" && python models/export.py --weights ./weights/best.pt --grid --dynamic
+    $ export PYTHONPATH="$PWD" && python models/quantize.py --weights ./weights/best.onnx --calib video/1.mp4
+    $ export PYTHONPATH="$PWD" && python models/quantize.py --weights ./weights/best.onnx --calib data/images --data data/val/images
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.append('./')  # to run '$ python *.py' files in subdirectories
+
+import cv2
+import numpy as np
+import torch
+
+import mydetect
+from utils.datasets import img_formats, img2label_paths
+from utils.general import box_iou, non_max_suppression, scale_coords, xywh2xyxy
+from utils.metrics import ap_per_class
+
+
+def list_images(path):
+    return sorted(f for f in glob.glob(os.path.join(path, '**', '*.*'), recursive=True)
+                  if f.split('.')[-1].lower() in img_formats)
+
+
+def calibration_frames(source, n=200):
+    """Up to n BGR frames from an image folder or evenly spaced across a video"""
+    if os.path.isdir(source):
+        files = list_images(source)
+        files = [files[i] for i in np.linspace(0, len(files) - 1, min(n, len(files))).astype(int)] if files else []
+        return [cv2.imread(f) for f in files]
+    cap = cv2.VideoCapture(source)
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    frames = []
+    for i in np.linspace(0, max(total - 1, 0), n).astype(int):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, int(i))
+        ok, frame = cap.read()
+        if ok:
+            frames.append(frame)
+    cap.release()
+    return frames
+
+
+def model_input(path):
+    """(input name, letterbox size) of an exported ONNX model"""
+    import onnx
+    inp = onnx.load(path).graph.input[0]
+    dims = [d.dim_value for d in inp.type.tensor_type.shape.dim]
+    return inp.name, (dims[2] or mydetect.imgsz, dims[3] or mydetect.imgsz)
+
+
+def head_nodes(path):
+    """Detect() output convolutions (Conv -> Reshape); kept in float so box decoding is not quantized"""
+    import onnx
+    graph = onnx.load(path).graph
+    reshape_inputs = {n.input[0] for n in graph.node if n.op_type == 'Reshape'}
+    return [n.name for n in graph.node if n.op_type == 'Conv' and n.output[0] in reshape_inputs]
+
+
+def quantize(src, dst, frames, ops=('Conv',), per_channel=True, skip_head=True, method='minmax'):
+    """Static INT8 quantization of src (FP32 ONNX) calibrated on frames, saved to dst"""
+    import onnx
+    from onnxruntime.quantization import CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType, \
+        quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    name, size = model_input(src)
+
+    class FrameReader(CalibrationDataReader):
+        def __init__(self):
+            self.frames = iter(frames)
+
+        def get_next(self):
+            frame = next(self.frames, None)
+            if frame is None:
+                return None
+            return {name: np.divide(mydetect.preprocess(frame, size), 255.0, dtype=np.float32)}
+
+    # Per-channel QDQ needs opset >= 13 (DequantizeLinear axis); export.py writes opset 12
+    pre, converted = dst.replace('.onnx', '.pre.onnx'), dst.replace('.onnx', '.opset13.onnx')
+    model = onnx.load(src)
+    opset = next(o.version for o in model.opset_import if o.domain in ('', 'ai.onnx'))
+    if per_channel and opset < 13:
+        onnx.save(onnx.version_converter.convert_version(model, 13), converted)
+        src = converted
+
+    # Shape inference + graph cleanup recommended by onnxruntime before quantization
+    try:
+        quant_pre_process(src, pre, skip_symbolic_shape=True)
+    except Exception as e:
+        print('Pre-processing skipped: %s' % e)
+        pre = src
+
+    exclude = head_nodes(pre) if skip_head else []
+    methods = {'minmax': CalibrationMethod.MinMax, 'entropy': CalibrationMethod.Entropy,
+               'percentile': CalibrationMethod.Percentile}
+    quantize_static(pre, dst, FrameReader(), quant_format=QuantFormat.QDQ, op_types_to_quantize=list(ops),
+                    per_channel=per_channel, activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                    nodes_to_exclude=exclude, calibrate_method=methods[method])
+    for f in {pre, converted}:
+        if os.path.exists(f):
+            os.remove(f)
+
+    # Keep the class names written by export.py
+    names = {p.key: p.value for p in model.metadata_props}.get('names')
+    model = onnx.load(dst)
+    if names is not None and not any(p.key == 'names' for p in model.metadata_props):
+        meta = model.metadata_props.add()
+        meta.key, meta.value = 'names', names
+        onnx.save(model, dst)
+    return exclude
+
+
+def evaluate(path, data, conf_thres=0.001, iou_thres=0.6):
+    """mAP of an ONNX model on a YOLO-format image folder (labels in the sibling labels/ folder), as in yolov5 test.py"""
+    backend = mydetect.OnnxBackend(path)
+    size = mydetect._input_size(backend, None)
+    iouv = torch.linspace(0.5, 0.95, 10)  # iou vector for mAP@0.5:0.95
+    niou = iouv.numel()
+    files = list_images(data)
+    stats, seen, t = [], 0, 0.0
+    for file, label_file in zip(files, img2label_paths(files)):
+        im0 = cv2.imread(file)
+        h0, w0 = im0.shape[:2]
+        labels = np.loadtxt(label_file, ndmin=2).reshape(-1, 5) if os.path.exists(label_file) else np.zeros((0, 5))
+        labels = torch.from_numpy(labels).float()
+        img = mydetect.preprocess(im0, size)
+
+        t0 = time.perf_counter()
+        pred = non_max_suppression(backend(img), conf_thres, iou_thres)[0]
+        t += time.perf_counter() - t0
+        seen += 1
+
+        nl = len(labels)
+        tcls = labels[:, 0].tolist() if nl else []
+        if len(pred) == 0:
+            if nl:
+                stats.append((torch.zeros(0, niou, dtype=torch.bool), torch.Tensor(), torch.Tensor(), tcls))
+            continue
+
+        # Predictions and targets in original image coordinates
+        predn = pred.clone()
+        predn[:, :4] = scale_coords(img.shape[2:], predn[:, :4], (h0, w0))
+        correct = torch.zeros(pred.shape[0], niou, dtype=torch.bool)
+        if nl:
+            detected = []
+            tcls_tensor = labels[:, 0]
+            tbox = xywh2xyxy(labels[:, 1:5]) * torch.Tensor([w0, h0, w0, h0])
+            for cls in torch.unique(tcls_tensor):
+                ti = (cls == tcls_tensor).nonzero(as_tuple=False).view(-1)  # target indices
+                pi = (cls == pred[:, 5]).nonzero(as_tuple=False).view(-1)  # prediction indices
+                if pi.shape[0]:
+                    ious, i = box_iou(predn[pi, :4], tbox[ti]).max(1)  # best ious, indices
+                    detected_set = set()
+                    for j in (ious > iouv[0]).nonzero(as_tuple=False):
+                        d = ti[i[j]]  # detected target
+                        if d.item() not in detected_set:
+                            detected_set.add(d.item())
+                            detected.append(d)
+                            correct[pi[j]] = ious[j] > iouv  # iou_thres is 1xn
+                            if len(detected) == nl:  # all targets already located in image
+                                break
+        stats.append((correct, pred[:, 4], pred[:, 5], tcls))
+
+    result = {'images': seen, 'ms': t / max(seen, 1) * 1000, 'mp': 0.0, 'mr': 0.0, 'map50': 0.0, 'map': 0.0}
+    stats = [np.concatenate(x, 0) for x in zip(*stats)]
+    if len(stats) and stats[0].any():
+        p, r, ap, f1, ap_class = ap_per_class(*stats)
+        ap50, ap = ap[:, 0], ap.mean(1)  # AP@0.5, AP@0.5:0.95
+        result.update(mp=p.mean(), mr=r.mean(), map50=ap50.mean(), map=ap.mean())
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--weights', type=str, default='./weights/best.onnx', help='FP32 ONNX model from export.py --grid')
+    parser.add_argument('--output', type=str, default='', help='INT8 model path (default: *.int8.onnx)')
+    parser.add_argument('--calib', type=str, required=True, help='calibration video or image folder')
+    parser.add_argument('--calib-frames', type=int, default=200, help='number of calibration frames')
+    parser.add_argument('--method', type=str, default='minmax', help='minmax / entropy / percentile')
+    parser.add_argument('--ops', nargs='+', default=['Conv'], help='op types to quantize')
+    parser.add_argument('--per-tensor', action='store_true', help='per-tensor instead of per-channel weights')
+    parser.add_argument('--quantize-head', action='store_true', help='also quantize the Detect() output convolutions')
+    parser.add_argument('--data', type=str, default='', help='labelled image folder for the mAP comparison')
+    opt = parser.parse_args()
+    print(opt)
+    t = time.time()
+
+    output = opt.output or opt.weights.replace('.onnx', '.int8.onnx')
+    frames = calibration_frames(opt.calib, opt.calib_frames)
+    if not frames:
+        sys.exit('No calibration frames read from %s' % opt.calib)
+    print('\nCalibrating on %g frames...' % len(frames))
+    excluded = quantize(opt.weights, output, frames, opt.ops, not opt.per_tensor, not opt.quantize_head, opt.method)
+    print('INT8 export success, saved as %s (%.1f MB -> %.1f MB, %g head nodes kept in float)' % (
+        output, os.path.getsize(opt.weights) / 1E6, os.path.getsize(output) / 1E6, len(excluded)))
+
+    if opt.data:
+        print('\nEvaluating on %s...' % opt.data)
+        fp32, int8 = evaluate(opt.weights, opt.data), evaluate(output, opt.data)
+        print(('%10s' + '%12s' * 5) % ('', 'images', 'P', 'R', 'mAP@.5', 'mAP@.5:.95') + '%12s' % 'ms/img')
+        for name, r in (('FP32', fp32), ('INT8', int8)):
+            print(('%10s' + '%12g' + '%12.3g' * 4 + '%12.1f') % (
+                name, r['images'], r['mp'], r['mr'], r['map50'], r['map'], r['ms']))
+        print('%10s%12s%12.3g%12.3g%12.3g%12.3g%12.2fx' % (
+            'delta', '', int8['mp'] - fp32['mp'], int8['mr'] - fp32['mr'], int8['map50'] - fp32['map50'],
+            int8['map'] - fp32['map'], fp32['ms'] / max(int8['ms'], 1e-9)))
+
+    print('\nQuantization complete (%.2fs).' % (time.time() - t))
@@ -0,0 +1,231 @@
+# 视频离线分析结果
+# VideoAnalysis 保存一次视频检测任务的逐帧数据并生成报告和统计，Gradio 界面和命令行批处理共用；
+# analyse_file 为不绘制、不编码视频的完整分析流程（关键点提取 -> 时序逻辑重放 -> 逐帧数据）
+
+import cv2
+import numpy as np
+
+import myfatigue
+from mystate import EventDetector
+from mytelemetry import TelemetryStore, new_job_dir
+from myvideo import AdaptiveSampler, analyse_video
+
+# 视频检测默认参数（界面上可调整）
+EAR_THRESHOLD = 0.3          # 眼睛闭合阈值
+MAR_THRESHOLD = 0.5          # 降低打哈欠阈值，提高检测灵敏度
+FATIGUE_CONSEC_FRAMES = 15   # 疲劳确认帧数
+YAWN_CONSEC_FRAMES = 10      # 打哈欠确认帧数
+# EAR/MAR 平稳且远离阈值时抽帧分析，跳过的帧插值。结果是近似的，且抽帧位置依赖阈值，
+# 关键点缓存只能在阈值相同时复用，所以默认逐帧分析（逐帧结果修改阈值后也能直接复用）
+ADAPTIVE_SAMPLING = False
+
+DEFAULT_PARAMS = {
+    'ear_threshold': EAR_THRESHOLD,
+    'mar_threshold': MAR_THRESHOLD,
+    'fatigue_consec_frames': FATIGUE_CONSEC_FRAMES,
+    'yawn_consec_frames': YAWN_CONSEC_FRAMES,
+}
+
+
+def video_info(path):
+    """返回 (帧率, 宽, 高, 总帧数)，无法打开时返回 None；帧率读不到时按30处理"""
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        return None
+    try:
+        fps = int(cap.get(cv2.CAP_PROP_FPS)) or 30
+        return (fps, int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+    finally:
+        cap.release()
+
+
+def cache_keys(cache, path, sampler=None):
+    """关键点缓存键，优先使用的在前：逐帧结果适用于任何阈值；抽帧结果与阈值有关，单独缓存"""
+    face = myfatigue.get_face_detector().name
+    keys = [cache.key(path, face)]
+    if sampler is not None:
+        keys.append(cache.key(path, face, f"adaptive{sampler.max_step}-{sampler.margin}",
+                              sampler.ear_threshold, sampler.mar_threshold))
+    return keys
+
+
+class VideoAnalysis:
+    """一次视频检测任务的分析结果，每个任务单独创建，互不影响"""
+
+    def __init__(self, fps=30, capacity=0, path=None):
+        # 逐帧数据按列写入本任务的遥测目录（内存映射，path 为 None 时新建临时目录），报告和统计在列上向量化计算
+        self.telemetry = TelemetryStore(path or new_job_dir(), fps, capacity)
+        self.total_frames = 0
+        self.fatigue_frames = 0
+        self.yawn_frames = 0
+        self.last_fatigue_time = -1
+        self.last_yawn_time = -1
+        self.detector = None      # 本次使用的 EventDetector，统计信息中显示其阈值
+        self.from_cache = False   # 关键点是否来自缓存
+        self.sampling_rate = 1.0  # 实际做关键点检测的帧数占比
+
+    def record(self, frame_index, fps, ear, mar, state, found=True):
+        """记录一帧（帧按顺序写入，frame_index 即列中的位置）"""
+        self.telemetry.append(frame_index / fps, ear, mar, found, state)
+        self.total_frames = len(self.telemetry)
+
+    def record_series(self, series, fps, result):
+        """一次写入整段序列；result 为 EventDetector.replay() 的结果"""
+        self.telemetry.extend(np.arange(len(series)) / fps, series.ear, series.mar, series.found, result)
+        self.total_frames = len(self.telemetry)
+
+    def summarize_events(self):
+        """由逐帧数据汇总事件数和最后一次事件的帧序号"""
+        fatigue, yawn = self.telemetry.events('fatigue'), self.telemetry.events('yawn')
+        self.fatigue_frames, self.yawn_frames = len(fatigue), len(yawn)
+        self.last_fatigue_time = int(fatigue[-1]) if len(fatigue) else -1
+        self.last_yawn_time = int(yawn[-1]) if len(yawn) else -1
+
+    def generate_detection_report(self):
+        """生成详细的检测报告"""
+        if self.total_frames == 0:
+            return "暂无检测数据"
+        
+        report = "### 疲劳检测详细报告\n\n"
+        
+        # 按时间顺序显示重要事件
+        t = self.telemetry
+        fatigue_idx = t.events('fatigue')
+        yawn_idx = t.events('yawn')
+        fatigue_events = [f"{ts:.1f}s: 检测到疲劳 (眼睛比值:: {ear:.3f})"
+                          for ts, ear in zip(t['timestamp'][fatigue_idx[:10]], t['ear'][fatigue_idx[:10]])]
+        yawn_events = [f"{ts:.1f}s: 检测到打哈欠 (嘴巴比值: {mar:.3f})"
+                       for ts, mar in zip(t['timestamp'][yawn_idx[:10]], t['mar'][yawn_idx[:10]])]
+
+        if fatigue_events:
+            report += "### 疲劳事件记录\n"
+            for event in fatigue_events:  # 显示前10个事件
+                report += f"- {event}\n"
+            if len(fatigue_idx) > 10:
+                report += f"- ... 还有 {len(fatigue_idx) - 10} 个疲劳事件\n"
+            report += "\n"
+        
+        if yawn_events:
+            report += "### 打哈欠事件记录\n"
+            for event in yawn_events:  # 显示前10个事件
+                report += f"- {event}\n"
+            if len(yawn_idx) > 10:
+                report += f"- ... 还有 {len(yawn_idx) - 10} 个打哈欠事件\n"
+            report += "\n"
+        
+        if not fatigue_events and not yawn_events:
+            report += "### 检测结果\n"
+            report += "✅ **一切正常** - 未检测到明显的疲劳或打哈欠行为\n\n"
+            report += "### 检测过程\n"
+            total_duration = self.total_frames / t.fps
+            report += f"- **处理帧数**: {self.total_frames} 帧\n"
+            report += f"- **检测时长**: {total_duration:.1f} 秒\n"
+            report += f"- **检测状态**: 全程监控正常\n"
+            report += f"- **安全评级**: 驾驶状态良好\n\n"
+
+        return report
+    
+    def generate_statistics(self):
+        """生成统计信息"""
+        if self.total_frames == 0:
+            return "暂无统计数据"
+        
+        # 计算实际检测时长
+        t = self.telemetry
+        total_duration = self.total_frames / t.fps
+
+        # 计算事件统计
+        fatigue_events_count = int(np.count_nonzero(t['fatigue_event']))
+        yawn_events_count = int(np.count_nonzero(t['yawn_event']))
+
+        # 计算平均EAR和MAR（从所有检测到人脸的帧中计算）
+        found = t['found']
+        face_frames = int(np.count_nonzero(found))
+        avg_ear = float(t['ear'][found].mean()) if face_frames else 0
+        avg_mar = float(t['mar'][found].mean()) if face_frames else 0
+        # 闭眼帧占比、疲劳/打哈欠确认状态的持续时间
+        closed_ratio = (float(np.count_nonzero(found & (t['ear'] < self.detector.EAR_THRESHOLD))) / face_frames
+                        if face_frames else 0)
+        fatigue_seconds = np.count_nonzero(t['fatigue']) / t.fps
+        yawn_seconds = np.count_nonzero(t['yawn']) / t.fps
+
+        # 基于事件频率评估风险等级
+        total_events = fatigue_events_count + yawn_events_count
+        events_per_minute = (total_events * 60) / total_duration if total_duration > 0 else 0
+
+        if events_per_minute > 10:
+            risk_level = "🔴 **高风险** - 频繁疲劳，建议立即休息"
+        elif events_per_minute > 5:
+            risk_level = "🟡 **中风险** - 存在疲劳迹象，建议注意休息"
+        elif events_per_minute > 0:
+            risk_level = "🟢 **低风险** - 偶有疲劳，保持警惕"
+        else:
+            risk_level = "✅ **无风险** - 状态良好"
+
+        stats = f"""### 检测统计信息
+
+### 基本信息
+- **检测时长**: {total_duration:.1f} 秒
+- **总帧数**: {self.total_frames}
+- **疲劳事件数**: {fatigue_events_count} 次
+- **打哈欠事件数**: {yawn_events_count} 次
+
+### 风险评估
+- {risk_level}
+- **事件频率**: {events_per_minute:.1f} 次/分钟
+
+### 生理指标
+- **平均眼睛纵横比 (EAR)**: {avg_ear:.3f}
+- **平均嘴巴纵横比 (MAR)**: {avg_mar:.3f}
+- **闭眼帧占比**: {closed_ratio * 100:.1f}%
+- **疲劳/打哈欠状态持续**: {fatigue_seconds:.1f}s / {yawn_seconds:.1f}s
+- **人脸检出率**: {face_frames / self.total_frames * 100:.1f}%
+
+### 检测阈值
+- **疲劳检测阈值 (EAR)**: < {self.detector.EAR_THRESHOLD}
+- **打哈欠检测阈值 (MAR)**: > {self.detector.MAR_THRESHOLD}
+- **连续帧确认**: 疲劳{self.detector.FATIGUE_CONSEC_FRAMES}帧，打哈欠{self.detector.YAWN_CONSEC_FRAMES}帧
+- **关键点来源**: {"缓存" if self.from_cache else "本次提取"}
+- **关键点采样率**: {self.sampling_rate * 100:.1f}%
+"""
+
+        return stats
+
+
+def analyse_file(path, params=None, adaptive=ADAPTIVE_SAMPLING, telemetry_dir=None, cache=None, workers=1,
+                 progress=None):
+    """只分析不绘制：提取关键点（或读取缓存）、向量化重放时序逻辑、写入逐帧数据和关键点
+
+    params: EventDetector 的阈值参数，缺省项取 DEFAULT_PARAMS
+    telemetry_dir: 逐帧数据目录，为 None 时新建临时目录
+    cache: 可选的 LandmarkCache；workers: 提取关键点的进程数
+    返回 (VideoAnalysis, LandmarkSeries)
+    """
+    info = video_info(path)
+    if info is None:
+        raise IOError(f"无法打开视频文件: {path}")
+    fps, _, _, total_frames = info
+    detector = EventDetector(fps, min_interval_frames=fps * 1, **{**DEFAULT_PARAMS, **(params or {})})
+    analysis = VideoAnalysis(fps, capacity=total_frames, path=telemetry_dir)
+    analysis.detector = detector
+    sampler = AdaptiveSampler.for_detector(detector) if adaptive else None
+
+    series = None
+    keys = cache_keys(cache, path, sampler) if cache is not None else []
+    for key in keys:
+        series = cache.get(key)
+        if series is not None:
+            analysis.from_cache = True
+            break
+    if series is None:
+        series = analyse_video(path, workers, sampler=sampler, progress=progress)
+        if keys:
+            cache.put(keys[-1], series)
+    analysis.sampling_rate = series.sampling_rate
+
+    analysis.record_series(series, fps, detector.replay(series.ear, series.mar))
+    analysis.telemetry.save_landmarks(series.shapes)
+    analysis.telemetry.flush()
+    analysis.summarize_events()
+    return analysis, series
@@ -0,0 +1,125 @@
+# 关键点提取结果的磁盘缓存
+# 以视频内容哈希为键保存每帧的 EAR/MAR 和关键点，同一视频再次检测（包括修改阈值、连续帧数后）
+# 只需重放时序逻辑，不再做关键点提取；缓存目录按总大小做 LRU 淘汰
+
+import hashlib
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from myvideo import LandmarkSeries
+
+CACHE_DIR = os.environ.get('FATIGUE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'fatigue_cache'))
+CACHE_MAX_BYTES = int(os.environ.get('FATIGUE_CACHE_MAX_MB', 512)) * 1024 * 1024
+CACHE_VERSION = 1  # 关键点提取逻辑变化时递增，使旧缓存失效
+
+
+def video_hash(path, chunk_size=1 << 20):
+    """视频文件内容的哈希（与文件名、上传路径无关）"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class LandmarkCache:
+    """LandmarkSeries 的磁盘缓存，每个视频一个 .npz 文件，以修改时间作为最近使用时间"""
+
+    def __init__(self, root=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._hash_memo = {}  # (路径, 大小, 修改时间) -> 内容哈希，避免同一文件重复计算
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, path, *tags):
+        """缓存键：内容哈希 + 影响提取结果的配置（如人脸检测后端）"""
+        st = os.stat(path)
+        memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        digest = self._hash_memo.get(memo_key)
+        if digest is None:
+            digest = video_hash(path)
+            self._hash_memo[memo_key] = digest
+        return '_'.join([digest, *map(str, tags), f'v{CACHE_VERSION}'])
+
+    def _path(self, key):
+        return os.path.join(self.root, f'{key}.npz')
+
+    def get(self, key):
+        """返回缓存的 LandmarkSeries，不存在或文件损坏时返回 None"""
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                series = LandmarkSeries(data['ear'], data['mar'], data['found'],
+                                        data['shapes'].astype(np.int32),
+                                        data['sampled'] if 'sampled' in data else None)
+            os.utime(path)  # 更新最近使用时间
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception as e:
+            print(f"关键点缓存文件损坏，已删除: {path} ({e})")
+            self._remove(path)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return series
+
+    def put(self, key, series):
+        """写入缓存（先写临时文件再替换，避免并发任务读到写了一半的文件），然后按总大小淘汰"""
+        path = self._path(key)
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as f:
+            # 关键点坐标不超过 int16 范围，按 int16 存储以减小缓存体积
+            arrays = dict(ear=series.ear, mar=series.mar, found=series.found,
+                          shapes=series.shapes.astype(np.int16))
+            if series.sampled is not None:
+                arrays['sampled'] = series.sampled
+            np.savez(f, **arrays)
+        os.replace(tmp, path)
+        self.evict()
+
+    def evict(self):
+        """总大小超过上限时，从最久未使用的文件开始删除"""
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.root):
+                if not name.endswith('.npz'):
+                    continue
+                try:
+                    st = os.stat(os.path.join(self.root, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, name))
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self._remove(os.path.join(self.root, name))
+                total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def stats(self):
+        files, size = 0, 0
+        for entry in os.scandir(self.root):
+            if entry.name.endswith('.npz'):
+                try:
+                    size += entry.stat().st_size
+                    files += 1
+                except FileNotFoundError:
+                    pass
+        return {'files': files, 'bytes': size, 'hits': self.hits, 'misses': self.misses}
@@ -1,15 +1,19 @@
 # yolo检测的接口函数
 # 详细信息请参考 https://blog.csdn.net/qq_20241587/article/details/113349874?utm_medium=distribute.pc_relevant.none-task-blog-2%7Edefault%7EBlogCommendFromBaidu%7Edefault-6.control&depth_1-utm_source=distribute.pc_relevant.none-task-blog-2%7Edefault%7EBlogCommendFromBaidu%7Edefault-6.control
 
+import ast
+import os
+import threading
+
 import numpy as np
 import cv2
 import torch
-from numpy import random
 #import evaluator
 from models.experimental import attempt_load
-from utils.general import check_img_size, non_max_suppression, scale_coords, \
+from utils.general import check_img_size, batched_non_max_suppression, scale_coords, \
     set_logging
 from utils.torch_utils import select_device, time_synchronized
+from myregistry import registry
  
  
 def letterbox(img, new_shape=(640, 640), color=(114, 114, 114), auto=True, scaleFill=False, scaleup=True):
@@ -46,59 +50,299 @@ def letterbox(img, new_shape=(640, 640), color=(114, 114, 114), auto=True, scale
  
  
 weights = r'weights/best.pt'
+onnx_weights = r'weights/best.onnx'  # 由 models/export.py --grid 导出，包含解码层
+int8_weights = r'weights/best.int8.onnx'  # 由 models/quantize.py 生成的INT8模型，存在时 onnx/openvino 后端优先使用
+opt_int8 = os.environ.get('DETECT_INT8', '1') != '0'  # DETECT_INT8=0 时始终使用FP32模型
+# 推理后端：torch / onnx（ONNX Runtime）/ openvino，可通过环境变量 DETECT_BACKEND 选择
+opt_backend = os.environ.get('DETECT_BACKEND', 'torch')
+opt_threads = int(os.environ.get('DETECT_THREADS', 0))  # CPU推理线程数，0 为运行库默认
 # 优先使用GPU
 opt_device = '0' if torch.cuda.is_available() else 'cpu'  
 imgsz = 640
+opt_batch_size = 8  # predict_batch 默认批大小，可用 benchmark.py batch 选择
 opt_conf_thres = 0.6
 opt_iou_thres = 0.45
 
-# Initialize
-device = select_device(opt_device)
-half = device.type != 'cpu'  # 在GPU上使用半精度
-model = attempt_load(weights, map_location=device)
-imgsz = check_img_size(imgsz, s=model.stride.max())
-if half:
-    model.half()
-
-# Get names and colors
-names = model.module.names if hasattr(model, 'module') else model.names
-colors = [[random.randint(0, 255) for _ in range(3)] for _ in names]
-
-def predict(im0s):
-    if not hasattr(predict, 'img'):
-        predict.img = torch.zeros((1, 3, imgsz, imgsz), device=device)
-        _ = model(predict.img.half() if half else predict.img)
-
-    # 预处理
-    img = letterbox(im0s, new_shape=imgsz, auto=False)[0]
+
+def _static_size(shape):
+    """输入形状 (N, 3, H, W) 中 H、W 固定时返回 (H, W)，否则返回 None"""
+    h, w = shape[2], shape[3]
+    return (h, w) if isinstance(h, int) and isinstance(w, int) and h > 0 and w > 0 else None
+
+
+def onnx_path():
+    """onnx/openvino 后端使用的模型文件：有INT8量化模型时使用量化模型"""
+    return int8_weights if opt_int8 and os.path.exists(int8_weights) else onnx_weights
+
+
+def _normalized(img):
+    """uint8 输入归一化为 float32，Preprocessor 已归一化的输入直接使用"""
+    return img if img.dtype == np.float32 else np.divide(img, 255.0, dtype=np.float32)
+
+
+def _metadata_names(meta):
+    """export.py 在ONNX元数据中写入的类别名"""
+    return ast.literal_eval(meta['names']) if 'names' in meta else None
+
+
+def _torch_names():
+    """ONNX元数据中没有类别名时，从 .pt 权重中读取"""
+    model = attempt_load(weights, map_location=torch.device('cpu'))
+    return model.module.names if hasattr(model, 'module') else model.names
+
+
+class TorchBackend:
+    """PyTorch 模型（attempt_load），GPU 上使用半精度"""
+    name = 'torch'
+
+    def __init__(self, path=weights, device=opt_device, threads=opt_threads):
+        if threads > 0:
+            torch.set_num_threads(threads)
+        self.device = select_device(device)
+        self.half = self.device.type != 'cpu'  # 在GPU上使用半精度
+        self.model = attempt_load(path, map_location=self.device)
+        self.path = path
+        if self.half:
+            self.model.half()
+        self.names = self.model.module.names if hasattr(self.model, 'module') else self.model.names
+        self.stride = int(self.model.stride.max())
+        self.fixed_size = None
+        self.max_batch = None
+
+    def __call__(self, img):
+        """img: uint8 (N, 3, H, W) RGB 或已归一化的 float32，返回解码后的预测 (N, 锚框数, 5+类别数)"""
+        x = torch.from_numpy(img).to(self.device)  # CPU 上与 img 共享内存
+        if x.dtype == torch.uint8:
+            x = x.half() if self.half else x.float()
+            x /= 255.0
+        elif self.half:
+            x = x.half()
+        with torch.no_grad():
+            return self.model(x)[0]
+
+
+class OnnxBackend:
+    """ONNX Runtime CPU 推理"""
+    name = 'onnx'
+
+    def __init__(self, path=None, threads=opt_threads):
+        import onnxruntime as ort
+        path = path or onnx_path()
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"找不到ONNX模型: {path}，请先运行 models/export.py --grid 导出")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.path = path
+
+        inp, out = self.session.get_inputs()[0], self.session.get_outputs()[0]
+        if len(out.shape) != 3:
+            raise ValueError(f"ONNX模型输出未解码: {out.shape}，请使用 models/export.py --grid 重新导出")
+        self.input_name, self.output_name = inp.name, out.name
+        self.fixed_size = _static_size(inp.shape)
+        self.max_batch = inp.shape[0] if isinstance(inp.shape[0], int) else None
+        self.stride = 32
+        self.names = _metadata_names(self.session.get_modelmeta().custom_metadata_map) or _torch_names()
+
+    def __call__(self, img):
+        x = _normalized(img)
+        return torch.from_numpy(self.session.run([self.output_name], {self.input_name: x})[0])
+
+
+class OpenVinoBackend:
+    """OpenVINO CPU 推理，直接读取导出的ONNX模型"""
+    name = 'openvino'
+
+    def __init__(self, path=None, threads=opt_threads):
+        try:
+            from openvino import Core
+        except ImportError:
+            from openvino.runtime import Core
+        path = path or onnx_path()
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"找不到ONNX模型: {path}，请先运行 models/export.py --grid 导出")
+        core = Core()
+        config = {'PERFORMANCE_HINT': 'LATENCY'}
+        if threads > 0:
+            config['INFERENCE_NUM_THREADS'] = threads
+        self.compiled = core.compile_model(core.read_model(path), 'CPU', config)
+        self._local = threading.local()  # 推理请求不能被多个线程同时使用，每个线程各建一个
+        self.path = path
+        self.output = self.compiled.output(0)
+
+        shape = self.compiled.input(0).partial_shape
+        self.fixed_size = tuple(shape.to_shape())[2:] if shape.is_static else None
+        self.max_batch = shape[0].get_length() if shape[0].is_static else None
+        self.stride = 32
+        try:
+            import onnx
+            meta = {p.key: p.value for p in onnx.load(path).metadata_props}
+        except ImportError:
+            meta = {}
+        self.names = _metadata_names(meta) or _torch_names()
+
+    def _request(self):
+        request = getattr(self._local, 'request', None)
+        if request is None:
+            request = self._local.request = self.compiled.create_infer_request()
+        return request
+
+    def __call__(self, img):
+        x = _normalized(img)
+        out = self._request().infer({0: x})[self.output]
+        return torch.from_numpy(np.array(out))  # 复制一份，推理请求的输出缓冲会被下一次推理覆盖
+
+
+BACKENDS = {
+    'torch': TorchBackend,
+    'onnx': OnnxBackend,
+    'openvino': OpenVinoBackend,
+}
+
+
+def create_backend(name='torch', **kwargs):
+    """按名称创建推理后端：torch / onnx / openvino"""
+    if name not in BACKENDS:
+        raise ValueError(f"未知的推理后端: {name}，可选: {', '.join(BACKENDS)}")
+    return BACKENDS[name](**kwargs)
+
+
+def _load_backend():
+    backend = create_backend(opt_backend)
+    print(f"YOLO推理后端: {backend.name} ({backend.path})")
+    return backend
+
+def _warmup_backend(backend):
+    # 用整帧默认尺寸预热一次，同时分配 predict 的输入缓冲区
+    predict(np.zeros((480, 640, 3), dtype=np.uint8), backend=backend)
+
+# 模型在第一次使用时加载，入口程序可调用 registry.preload('yolo') 在后台提前加载
+registry.register('yolo', _load_backend, _warmup_backend, description='YOLO行为检测模型')
+
+def get_backend():
+    return registry.get('yolo')
+
+def _input_size(b, img_size):
+    """letterbox 尺寸：固定输入尺寸的导出模型忽略 img_size"""
+    if b.fixed_size is not None:
+        return b.fixed_size
+    size = imgsz if img_size is None else img_size
+    return check_img_size(size, s=b.stride)
+
+def preprocess(im0s, size):
+    """BGR 原图 -> letterbox 后的 uint8 (1, 3, H, W) RGB"""
+    img = letterbox(im0s, new_shape=size, auto=False)[0]
     img = img.transpose((2, 0, 1))[::-1]
-    img = np.ascontiguousarray(img)
-    img = torch.from_numpy(img).to(device)
-    img = img.half() if half else img.float()
-    img /= 255.0
-    if img.ndimension() == 3:
-        img = img.unsqueeze(0)
-
-    # 推理
-    with torch.no_grad():
-        pred = model(img)[0]
-        pred = non_max_suppression(pred, opt_conf_thres, opt_iou_thres)
-
-    # 处理结果
+    return np.ascontiguousarray(img)[None]
+
+def _postprocess(det, img_shape, im0s, names):
+    """单张图的NMS结果 -> [(label, conf, xyxy)]，坐标映射回原图"""
     ret = []
-    for i, det in enumerate(pred):
-        if len(det):
-            det[:, :4] = scale_coords(img.shape[2:], det[:, :4], im0s.shape).round()
-            for *xyxy, conf, cls in reversed(det[:5]):
-                try:
-                    cls_index = int(cls) % len(names)
-                    if conf > opt_conf_thres:
-                        label = f'{names[cls_index]}'
-                        ret.append((label, float(conf), xyxy))
-                except Exception as e:
-                    continue
+    if len(det):
+        det[:, :4] = scale_coords(img_shape, det[:, :4], im0s.shape).round()
+        for *xyxy, conf, cls in reversed(det[:5]):
+            try:
+                cls_index = int(cls) % len(names)
+                if conf > opt_conf_thres:
+                    label = f'{names[cls_index]}'
+                    ret.append((label, float(conf), xyxy))
+            except Exception as e:
+                continue
     return ret
 
+class Preprocessor:
+    """持久化的 letterbox 画布和 float32 输入张量，每帧复用同一块内存
+
+    原图直接缩放到画布中间的区域（边框只在原图尺寸变化时重新填充），BGR->RGB、HWC->CHW 和 /255
+    在一次 numpy 运算中完成并写入预分配的输入张量；与 preprocess() + 归一化的结果一致
+    """
+
+    def __init__(self, batch, h, w):
+        self.canvas = np.full((h, w, 3), 114, dtype=np.uint8)
+        self.input = np.zeros((batch, 3, h, w), dtype=np.float32)
+        self._shape = None  # 上一帧原图尺寸
+        self._roi = None    # 缩放后图像在画布中的区域
+
+    def _layout(self, shape):
+        """与 letterbox(auto=False) 相同的缩放尺寸和边距"""
+        h, w = self.canvas.shape[:2]
+        r = min(h / shape[0], w / shape[1])
+        nw, nh = int(round(shape[1] * r)), int(round(shape[0] * r))
+        top, left = int(round((h - nh) / 2 - 0.1)), int(round((w - nw) / 2 - 0.1))
+        self.canvas[:] = 114
+        self._roi = self.canvas[top:top + nh, left:left + nw]
+        self._shape = shape
+
+    def load(self, i, im0s):
+        """BGR 原图写入输入张量的第 i 项"""
+        if im0s.shape[:2] != self._shape:
+            self._layout(im0s.shape[:2])
+        roi = self._roi
+        if roi.shape[:2] == im0s.shape[:2]:
+            roi[:] = im0s
+        else:
+            cv2.resize(im0s, (roi.shape[1], roi.shape[0]), dst=roi, interpolation=cv2.INTER_LINEAR)
+        # 与 _normalized 和原来的 img /= 255.0 一样做除法（乘以倒数的结果并非逐位相同）
+        np.divide(self.canvas[:, :, ::-1].transpose(2, 0, 1), np.float32(255), out=self.input[i],
+                  casting='unsafe')
+        return self.input[i]
+
+_local = threading.local()  # 每个线程自己的预处理缓冲区
+_warmed = set()             # 已预热过的 (后端, 批大小, 尺寸)
+
+def _preprocessor(b, batch, h, w):
+    """预分配的 Preprocessor，按 (后端, 批大小, 尺寸) 复用；每种输入形状第一次使用时用全零输入预热一次"""
+    if not hasattr(_local, 'preprocessors'):
+        _local.preprocessors = {}
+    key = (id(b), batch, h, w)
+    pre = _local.preprocessors.get(key)
+    if pre is None:
+        pre = Preprocessor(batch, h, w)
+        if key not in _warmed:
+            b(pre.input)
+            _warmed.add(key)
+        _local.preprocessors[key] = pre
+    return pre
+
+def predict_batch(frames, img_size=None, batch_size=None, backend=None):
+    """多帧批量推理：每 batch_size 帧 letterbox 到同一个预分配的输入中，做一次前向和一次批量NMS
+
+    返回与 frames 一一对应的列表，每项与 predict() 的返回格式相同
+    """
+    b = get_backend() if backend is None else backend
+    size = _input_size(b, img_size)
+    h, w = (size, size) if isinstance(size, int) else size
+    batch_size = max(1, batch_size or opt_batch_size)
+    if b.max_batch is not None:
+        # 导出时固定了批大小的模型只能按该批大小推理，最后一批不足时用旧数据补齐
+        batch_size = b.max_batch
+
+    results = []
+    pre = _preprocessor(b, batch_size, h, w)
+    for start in range(0, len(frames), batch_size):
+        chunk = frames[start:start + batch_size]
+
+        # 预处理：缩放到画布后直接归一化写入输入张量
+        for i, im0s in enumerate(chunk):
+            pre.load(i, im0s)
+        img = pre.input if b.max_batch is not None else pre.input[:len(chunk)]
+
+        # 推理
+        pred = b(img)[:len(chunk)]
+        with torch.no_grad():
+            pred = batched_non_max_suppression(pred, opt_conf_thres, opt_iou_thres)
+
+        # 处理结果
+        results.extend(_postprocess(det, (h, w), im0s, b.names) for det, im0s in zip(pred, chunk))
+    return results
+
+def predict(im0s, img_size=None, backend=None):
+    """img_size: 可选的letterbox尺寸（需为32的倍数），默认使用 imgsz；backend 默认使用模块的推理后端"""
+    return predict_batch([im0s], img_size, batch_size=1, backend=backend)[0]
+
 def map_class_index(cls_index, num_classes=4):
     """将大数值的类别索引映射到有效范围内"""
     if isinstance(cls_index, torch.Tensor):
@@ -0,0 +1,113 @@
+# 人脸检测后端
+# 所有后端都实现 detect(frame_gray, frame=None, detections=None, pyramid=None)，
+# 返回原始图像坐标下的 (left, top, right, bottom) 列表，供 myfatigue 选择最大人脸；
+# pyramid 为当前帧的 myimage.FramePyramid，缩放等变换从中获取以便同一帧内复用
+
+import os
+
+import cv2
+import dlib
+import numpy as np
+
+
+class HogFaceDetector:
+    """dlib HOG 人脸检测，依次尝试多个缩放比例直到检测到人脸"""
+    name = 'hog'
+    uses_yolo = False
+
+    def __init__(self, scales=(0.5, 1.0, 1.5)):
+        self.scales = scales
+        self._detector = dlib.get_frontal_face_detector()
+
+    def detect(self, frame_gray, frame=None, detections=None, pyramid=None):
+        for scale in self.scales:
+            if pyramid is not None:
+                scaled_frame = pyramid.scaled(scale)
+            else:
+                scaled_frame = cv2.resize(frame_gray, None, fx=scale, fy=scale)
+            detected = self._detector(scaled_frame, 0)
+            if detected:
+                # 将检测结果转换回原始尺度
+                return [(rect.left()/scale, rect.top()/scale,
+                         rect.right()/scale, rect.bottom()/scale) for rect in detected]
+        return []
+
+
+class DnnFaceDetector:
+    """OpenCV DNN 的 ResNet-10 SSD 人脸检测（Caffe 模型，300x300 输入）"""
+    name = 'dnn'
+    uses_yolo = False
+
+    def __init__(self, prototxt=os.path.join('weights', 'deploy.prototxt'),
+                 model=os.path.join('weights', 'res10_300x300_ssd_iter_140000.caffemodel'),
+                 conf_threshold=0.5, input_size=300):
+        if not (os.path.exists(prototxt) and os.path.exists(model)):
+            raise FileNotFoundError(f"找不到 OpenCV DNN 人脸模型: {prototxt}, {model}")
+        self.net = cv2.dnn.readNetFromCaffe(prototxt, model)
+        self.conf_threshold = conf_threshold
+        self.input_size = input_size
+
+    def detect(self, frame_gray, frame=None, detections=None, pyramid=None):
+        if frame is None:
+            frame = pyramid.bgr if pyramid is not None else cv2.cvtColor(frame_gray, cv2.COLOR_GRAY2BGR)
+        h, w = frame.shape[:2]
+        blob = cv2.dnn.blobFromImage(frame, 1.0, (self.input_size, self.input_size),
+                                     (104.0, 177.0, 123.0))
+        self.net.setInput(blob)
+        out = self.net.forward()  # (1, 1, N, 7): [_, _, conf, x1, y1, x2, y2]，坐标为0~1
+        out = out[0, 0]
+        out = out[out[:, 2] > self.conf_threshold]
+        boxes = np.clip(out[:, 3:7], 0.0, 1.0) * [w, h, w, h]
+        return [tuple(b) for b in boxes if b[2] > b[0] and b[3] > b[1]]
+
+
+class YoloFaceDetector:
+    """由 mydetect 中行为检测 YOLO 模型的眼睛/嘴巴检测框推算人脸框
+
+    模型没有单独的人脸类别，这里把眼睛和嘴巴框的并集按人脸比例外扩到
+    与 dlib HOG 检测框相近的范围（眉毛到下巴），关键点模型就是在这种框上训练的。
+    传入 detections（mydetect.predict 的返回值）时直接复用，不再运行 YOLO。
+    """
+    name = 'yolo'
+    uses_yolo = True
+    EYE_LABELS = ('Closed eye', 'Opened eye')
+    MOUTH_LABELS = ('Yawn', 'No-yawn')
+
+    def __init__(self, expand_x=0.2, expand_top=0.35, expand_bottom=0.4):
+        self.expand_x = expand_x          # 左右外扩，相对部件框宽度
+        self.expand_top = expand_top      # 向上外扩（眉毛），相对部件框高度
+        self.expand_bottom = expand_bottom  # 向下外扩（下巴），相对部件框高度
+
+    def detect(self, frame_gray, frame=None, detections=None, pyramid=None):
+        if detections is None:
+            import mydetect
+            detections = mydetect.predict(frame if frame is not None
+                                          else cv2.cvtColor(frame_gray, cv2.COLOR_GRAY2BGR))
+
+        eyes = [list(map(float, xyxy)) for label, _, xyxy in detections if label in self.EYE_LABELS]
+        mouths = [list(map(float, xyxy)) for label, _, xyxy in detections if label in self.MOUTH_LABELS]
+        if not eyes or not mouths:
+            return []
+
+        parts = np.array(eyes + mouths)
+        left, top = parts[:, 0].min(), parts[:, 1].min()
+        right, bottom = parts[:, 2].max(), parts[:, 3].max()
+        bw, bh = right - left, bottom - top
+
+        h, w = frame_gray.shape[:2]
+        return [(max(0.0, left - bw * self.expand_x), max(0.0, top - bh * self.expand_top),
+                 min(float(w), right + bw * self.expand_x), min(float(h), bottom + bh * self.expand_bottom))]
+
+
+BACKENDS = {
+    'hog': HogFaceDetector,
+    'dnn': DnnFaceDetector,
+    'yolo': YoloFaceDetector,
+}
+
+
+def create_face_detector(name='hog', **kwargs):
+    """按名称创建人脸检测后端：hog / dnn / yolo"""
+    if name not in BACKENDS:
+        raise ValueError(f"未知的人脸检测后端: {name}，可选: {', '.join(BACKENDS)}")
+    return BACKENDS[name](**kwargs)
@@ -1,6 +1,5 @@
 # 疲劳检测，检测眼睛和嘴巴的开合程度
 
-from scipy.spatial import distance as dist
 from imutils.video import FileVideoStream
 from imutils.video import VideoStream
 from imutils import face_utils
@@ -12,132 +11,401 @@ import dlib
 import cv2
 import math
 import time
-from threading import Thread
+from threading import Thread, Lock
 import os
-import sys
+import myface
+import myimage
 
-# 初始化dlib的人脸检测器
-detector = dlib.get_frontal_face_detector()
+from myregistry import registry, ModelLoadError
 
-# 使用weights文件夹下的模型
-model_path = os.path.join('weights', 'shape_predictor_68_face_landmarks.dat')
-if not os.path.exists(model_path):
-    # 如果weights文件夹下没有，尝试在根目录查找
-    model_path = 'shape_predictor_68_face_landmarks.dat'
+# 人脸检测后端（hog / dnn / yolo），可通过环境变量 FACE_DETECTOR 按部署选择
+FACE_DETECTOR = os.environ.get('FACE_DETECTOR', 'hog')
+
+def _find_model_path():
+    # 使用weights文件夹下的模型
+    model_path = os.path.join('weights', 'shape_predictor_68_face_landmarks.dat')
     if not os.path.exists(model_path):
-        print("错误：找不到人脸关键点模型文件")
-        print("请确保以下任一路径存在模型文件：")
-        print("1. weights/shape_predictor_68_face_landmarks.dat")
-        print("2. shape_predictor_68_face_landmarks.dat")
-        sys.exit(1)
+        # 如果weights文件夹下没有，尝试在根目录查找
+        model_path = 'shape_predictor_68_face_landmarks.dat'
+        if not os.path.exists(model_path):
+            raise FileNotFoundError("找不到人脸关键点模型文件，请确保以下任一路径存在模型文件: "
+                                    "weights/shape_predictor_68_face_landmarks.dat 或 "
+                                    "shape_predictor_68_face_landmarks.dat")
+    return model_path
 
-try:
+def _load_predictor():
+    model_path = _find_model_path()
     predictor = dlib.shape_predictor(model_path)
     print(f"成功加载人脸关键点模型: {model_path}")
-except Exception as e:
-    print(f"加载模型出错: {e}")
-    sys.exit(1)
+    return predictor
+
+def _warmup_predictor(predictor):
+    predictor(np.zeros((64, 64), dtype=np.uint8), dlib.rectangle(0, 0, 63, 63))
+
+def _warmup_face_detector(detector):
+    if not detector.uses_yolo:
+        detector.detect(np.zeros((240, 320), dtype=np.uint8))
+
+# 模型在第一次使用时加载，入口程序可调用 registry.preload(*MODELS) 在后台提前加载
+registry.register('landmarks', _load_predictor, _warmup_predictor, description='人脸关键点模型')
+registry.register('face_detector', lambda: myface.create_face_detector(FACE_DETECTOR),
+                  _warmup_face_detector, description='人脸检测器')
+MODELS = ('landmarks', 'face_detector')
+
+def get_predictor():
+    return registry.get('landmarks')
+
+def get_face_detector():
+    return registry.get('face_detector')
+
+def set_face_detector(name, **kwargs):
+    """切换人脸检测后端"""
+    face_detector = myface.create_face_detector(name, **kwargs)
+    registry.set('face_detector', face_detector)
+    return face_detector
 
 # 定义眼睛和嘴巴的关键点索引
 (lStart, lEnd) = face_utils.FACIAL_LANDMARKS_IDXS["left_eye"]
 (rStart, rEnd) = face_utils.FACIAL_LANDMARKS_IDXS["right_eye"]
 (mStart, mEnd) = face_utils.FACIAL_LANDMARKS_IDXS["mouth"]
 
+def _euclidean(p, q):
+    dx = float(p[0]) - float(q[0])
+    dy = float(p[1]) - float(q[1])
+    return math.sqrt(dx * dx + dy * dy)
+
 def eye_aspect_ratio(eye):
     # 计算眼睛纵向的两组点的欧氏距离
-    A = dist.euclidean(eye[1], eye[5])
-    B = dist.euclidean(eye[2], eye[4])
+    A = _euclidean(eye[1], eye[5])
+    B = _euclidean(eye[2], eye[4])
     # 计算眼睛横向的欧氏距离
-    C = dist.euclidean(eye[0], eye[3])
+    C = _euclidean(eye[0], eye[3])
     # 计算眼睛的纵横比
     ear = (A + B) / (2.0 * C)
     return ear
 
 def mouth_aspect_ratio(mouth):
     # 计算嘴巴纵向的欧氏距离
-    A = dist.euclidean(mouth[2], mouth[10])
-    B = dist.euclidean(mouth[4], mouth[8])
+    A = _euclidean(mouth[2], mouth[10])
+    B = _euclidean(mouth[4], mouth[8])
     # 计算嘴巴横向的欧氏距离
-    C = dist.euclidean(mouth[0], mouth[6])
+    C = _euclidean(mouth[0], mouth[6])
     # 计算嘴巴的纵横比
     mar = (A + B) / (2.0 * C)
     return mar
 
-def detfatigue(frame):
-    # 预处理图像以提高检测率
-    frame_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    frame_gray = cv2.equalizeHist(frame_gray)  # 添加直方图均衡化
+
+# 向量化计算EAR/MAR所需的9组点对（68点模型中的绝对索引），
+# 顺序为 左眼A,B,C  右眼A,B,C  嘴巴A,B,C，与上面两个函数一一对应
+_RATIO_P = np.array([lStart + 1, lStart + 2, lStart, rStart + 1, rStart + 2, rStart,
+                     mStart + 2, mStart + 4, mStart])
+_RATIO_Q = np.array([lStart + 5, lStart + 4, lStart + 3, rStart + 5, rStart + 4, rStart + 3,
+                     mStart + 10, mStart + 8, mStart + 6])
+
+class RatioKernel:
+    """批量计算 EAR/MAR：输入 (N, 68, 2) 关键点数组，输出 (N,) 的 EAR 和 MAR 向量
+
+    按 chunk 帧分块计算，中间缓冲区在构造时分配并在每次调用中复用，
+    结果与逐帧调用 eye_aspect_ratio / mouth_aspect_ratio 完全一致。
+    缓冲区在调用之间共享，多线程调用时由锁串行化。
+    """
+
+    def __init__(self, chunk=16384):
+        self.chunk = chunk
+        self._gather = {}  # 按关键点数组的 dtype 缓存的取点缓冲区
+        self._diff = np.empty((chunk, 9, 2), dtype=np.float64)
+        self._dist = np.empty((chunk, 9), dtype=np.float64)
+        self._tmp = np.empty(chunk, dtype=np.float64)
+        self._lock = Lock()
+
+    def __call__(self, shapes, found=None, ear=None, mar=None):
+        """shapes: (N, 68, 2)；found: 可选 (N,) bool，为 False 的帧输出 0
+
+        ear/mar 可传入预分配的 (N,) float64 数组。返回 (ear, mar, valid)，
+        valid 为 found 中横向距离不为0（比值有定义）的帧。
+        """
+        n = len(shapes)
+        ear = np.empty(n, dtype=np.float64) if ear is None else ear
+        mar = np.empty(n, dtype=np.float64) if mar is None else mar
+        valid = np.ones(n, dtype=bool) if found is None else np.array(found, dtype=bool)
+
+        with self._lock:
+            self._compute(shapes, ear, mar, valid)
+        return ear, mar, valid
+
+    def _gather_buffers(self, dtype):
+        if dtype not in self._gather:
+            self._gather[dtype] = (np.empty((self.chunk, 9, 2), dtype=dtype),
+                                   np.empty((self.chunk, 9, 2), dtype=dtype))
+        return self._gather[dtype]
+
+    def _compute(self, shapes, ear, mar, valid):
+        n = len(shapes)
+        for s in range(0, n, self.chunk):
+            e = min(s + self.chunk, n)
+            m = e - s
+            p, q = self._gather_buffers(shapes.dtype)
+            p, q, diff, d, tmp = p[:m], q[:m], self._diff[:m], self._dist[:m], self._tmp[:m]
+            np.take(shapes[s:e], _RATIO_P, axis=1, out=p, mode='clip')
+            np.take(shapes[s:e], _RATIO_Q, axis=1, out=q, mode='clip')
+            np.subtract(p, q, out=diff)
+            np.multiply(diff, diff, out=diff)
+            np.add(diff[..., 0], diff[..., 1], out=d)
+            np.sqrt(d, out=d)
+
+            # 横向距离为0时比值无定义，按未检测到人脸处理
+            v = valid[s:e]
+            v &= (d[:, 2] > 0) & (d[:, 5] > 0) & (d[:, 8] > 0)
+            d[~v, 2::3] = 1.0
+
+            # EAR = (左眼(A+B)/(2C) + 右眼(A+B)/(2C)) / 2，运算顺序与标量版本相同
+            out = ear[s:e]
+            np.add(d[:, 0], d[:, 1], out=out)
+            np.multiply(d[:, 2], 2.0, out=tmp)
+            np.divide(out, tmp, out=out)
+            np.add(d[:, 3], d[:, 4], out=tmp)
+            np.multiply(d[:, 5], 2.0, out=d[:, 5])
+            np.divide(tmp, d[:, 5], out=tmp)
+            np.add(out, tmp, out=out)
+            np.divide(out, 2.0, out=out)
+
+            # MAR = (A+B)/(2C)
+            out = mar[s:e]
+            np.add(d[:, 6], d[:, 7], out=out)
+            np.multiply(d[:, 8], 2.0, out=d[:, 8])
+            np.divide(out, d[:, 8], out=out)
+
+            ear[s:e][~v] = 0.0
+            mar[s:e][~v] = 0.0
+
+# 默认的批量计算实例
+aspect_ratios = RatioKernel()
+
+def detect_faces(frame_gray, frame=None, detections=None, pyramid=None):
+    """用当前后端检测人脸，返回原始尺度下的 (left, top, right, bottom) 列表
+
+    frame: 原始BGR图像（dnn/yolo 后端使用）
+    detections: 已有的 mydetect.predict 结果，yolo 后端直接复用
+    pyramid: 当前帧的 myimage.FramePyramid，多尺度检测的缩放图从中获取
+    """
+    return get_face_detector().detect(frame_gray, frame, detections, pyramid=pyramid)
+
+def face_to_rect(face, frame_shape, pad=0.1):
+    """把人脸框四周各扩大 pad 比例，并裁剪到图像范围内，得到 dlib.rectangle"""
+    left, top, right, bottom = map(int, face)
+
+    # 扩大检测区域
+    padding_h = int((bottom - top) * pad)  # 垂直方向增加10%
+    padding_w = int((right - left) * pad)  # 水平方向增加10%
+
+    # 确保扩展后的坐标不超出图像范围
+    height, width = frame_shape[:2]
+    return dlib.rectangle(
+        max(0, left - padding_w),
+        max(0, top - padding_h),
+        min(width, right + padding_w),
+        min(height, bottom + padding_h)
+    )
+
+def fatigue_ratios(shape):
+    """根据68个关键点计算 (EAR, MAR)"""
+    # 获取眼睛和嘴巴坐标
+    leftEye = shape[lStart:lEnd]
+    rightEye = shape[rStart:rEnd]
+    mouth = shape[mStart:mEnd]
+
+    # 计算眼睛和嘴巴的纵横比
+    leftEAR = eye_aspect_ratio(leftEye)
+    rightEAR = eye_aspect_ratio(rightEye)
+    eyear = (leftEAR + rightEAR) / 2.0
+    mouthar = mouth_aspect_ratio(mouth)
+    return eyear, mouthar
+
+def draw_landmarks(frame, shape, eyear, mouthar):
+    """在画面上绘制关键点、眼睛嘴巴轮廓以及 EAR/MAR 数值"""
+    leftEye = shape[lStart:lEnd]
+    rightEye = shape[rStart:rEnd]
+    mouth = shape[mStart:mEnd]
+
+    # 绘制面部特征点和轮廓
+    for (x, y) in shape:
+        cv2.circle(frame, (x, y), 2, (0, 255, 0), -1)
+
+    # 绘制眼睛和嘴巴轮廓
+    leftEyeHull = cv2.convexHull(leftEye)
+    rightEyeHull = cv2.convexHull(rightEye)
+    mouthHull = cv2.convexHull(mouth)
+
+    cv2.drawContours(frame, [leftEyeHull], -1, (0, 255, 0), 1)
+    cv2.drawContours(frame, [rightEyeHull], -1, (0, 255, 0), 1)
+    cv2.drawContours(frame, [mouthHull], -1, (0, 255, 0), 1)
+
+    # 在画面上显示当前的EAR和MAR值
+    cv2.putText(frame, f"EAR: {eyear:.2f}", (300, 30),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+    cv2.putText(frame, f"MAR: {mouthar:.2f}", (300, 60),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+    return frame
+
+def analyse(frame, detections=None):
+    """只做检测不绘制，返回 (shape, EAR, MAR)；未检测到人脸时 shape 为 None
+
+    frame 可以是 BGR 图像或 myimage.FramePyramid
+    """
+    # 预处理图像以提高检测率（灰度化 + 直方图均衡化，同一帧只计算一次）
+    pyramid = myimage.as_pyramid(frame)
+    frame = pyramid.bgr
+    frame_gray = pyramid.equalized()
     
     # 尝试多个尺度进行人脸检测
-    faces = []
-    scales = [0.5, 1.0, 1.5]  # 多尺度检测
-    for scale in scales:
-        scaled_frame = cv2.resize(frame_gray, None, fx=scale, fy=scale)
-        detected = detector(scaled_frame, 0)
-        if detected:
-            # 将检测结果转换回原始尺度
-            faces = [(rect.left()/scale, rect.top()/scale, 
-                     rect.right()/scale, rect.bottom()/scale) for rect in detected]
-            break
-    
-    eyear = 0.0
-    mouthar = 0.0
-    
-    if faces:  # 如果检测到人脸
-        # 使用最大的人脸
+    faces = detect_faces(frame_gray, frame, detections, pyramid)
+    if not faces:
+        return None, 0.0, 0.0
+
+    # 使用最大的人脸
+    face_rect = max(faces, key=lambda r: (r[2]-r[0])*(r[3]-r[1]))
+    rect = face_to_rect(face_rect, frame.shape)
+
+    predictor = get_predictor()  # 模型加载失败时抛出 ModelLoadError，不当作单帧检测失败
+    try:
+        # 使用改进的关键点检测
+        shape = predictor(frame_gray, rect)
+        shape = face_utils.shape_to_np(shape)
+
+        # 计算眼睛和嘴巴的纵横比
+        eyear, mouthar = fatigue_ratios(shape)
+    except Exception as e:
+        print(f"关键点检测失败: {str(e)}")
+        return None, 0.0, 0.0
+
+    return shape, eyear, mouthar
+
+def detfatigue(frame, detections=None):
+    shape, eyear, mouthar = analyse(frame, detections)
+    if shape is not None:
+        # 绘制面部特征点和轮廓
+        draw_landmarks(frame, shape, eyear, mouthar)
+    return frame, eyear, mouthar
+
+
+def landmark_box(shape):
+    """68个关键点的外接矩形 (left, top, right, bottom)"""
+    x0, y0 = shape.min(axis=0)
+    x1, y1 = shape.max(axis=0)
+    return float(x0), float(y0), float(x1), float(y1)
+
+def box_iou(a, b):
+    """两个 (left, top, right, bottom) 矩形的交并比"""
+    iw = min(a[2], b[2]) - max(a[0], b[0])
+    ih = min(a[3], b[3]) - max(a[1], b[1])
+    if iw <= 0 or ih <= 0:
+        return 0.0
+    inter = iw * ih
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+class FaceTracker:
+    """带状态的人脸跟踪器，用法与 detfatigue 相同
+
+    只在关键帧（每 redetect_interval 帧）运行完整的多尺度人脸检测，
+    中间帧直接用上一帧关键点的外接矩形作为 predictor 的输入区域。
+    当新旧关键点框的交并比低于 drift_threshold，或关键点形状退化
+    （眼睛/嘴巴宽度为0、人脸框过小）时，立即在当前帧重新检测。
+    """
+
+    def __init__(self, redetect_interval=10, drift_threshold=0.5, min_face_size=40):
+        self.redetect_interval = redetect_interval  # 强制重新检测的间隔帧数
+        self.drift_threshold = drift_threshold      # 关键点框交并比下限
+        self.min_face_size = min_face_size          # 关键点框最小边长（像素）
+        self.reset()
+
+    def reset(self):
+        """清除跟踪状态和统计计数"""
+        self.last_box = None          # 上一帧关键点外接矩形
+        self.frames_since_detect = 0
+        self.detected_frames = 0      # 运行了完整检测的帧数
+        self.tracked_frames = 0       # 由上一帧关键点跟踪得到的帧数
+        self.redetect_on_drift = 0    # 因漂移/质量下降触发的重新检测次数
+
+    @property
+    def stats(self):
+        """跟踪/检测帧数统计"""
+        total = self.detected_frames + self.tracked_frames
+        return {
+            'detected_frames': self.detected_frames,
+            'tracked_frames': self.tracked_frames,
+            'redetect_on_drift': self.redetect_on_drift,
+            'tracked_ratio': self.tracked_frames / total if total else 0.0,
+        }
+
+    def _shape_ok(self, shape, box):
+        """关键点质量检查"""
+        if box[2] - box[0] < self.min_face_size or box[3] - box[1] < self.min_face_size:
+            return False
+        eye_w = min(abs(shape[lStart][0] - shape[lStart + 3][0]),
+                    abs(shape[rStart][0] - shape[rStart + 3][0]))
+        mouth_w = abs(shape[mStart][0] - shape[mStart + 6][0])
+        return eye_w > 0 and mouth_w > 0
+
+    def _locate(self, frame_gray, frame, detections=None, offset=(0, 0), pyramid=None):
+        """返回当前帧的关键点，未找到人脸时返回 None
+
+        frame 可以是原图中的一块裁剪区域，offset 为其左上角在原图中的坐标；
+        last_box 始终保存原图坐标，返回的关键点为 frame 内的坐标。
+        """
+        frame_shape = frame.shape
+        ox, oy = offset
+        if self.last_box is not None and self.frames_since_detect < self.redetect_interval:
+            last = (self.last_box[0] - ox, self.last_box[1] - oy,
+                    self.last_box[2] - ox, self.last_box[3] - oy)
+            rect = face_to_rect(last, frame_shape)
+            shape = face_utils.shape_to_np(get_predictor()(frame_gray, rect))
+            box = landmark_box(shape)
+            if self._shape_ok(shape, box) and box_iou(box, last) >= self.drift_threshold:
+                self.last_box = (box[0] + ox, box[1] + oy, box[2] + ox, box[3] + oy)
+                self.frames_since_detect += 1
+                self.tracked_frames += 1
+                return shape
+            self.redetect_on_drift += 1
+
+        # 关键帧：完整的多尺度人脸检测
+        self.detected_frames += 1
+        self.frames_since_detect = 1
+        faces = detect_faces(frame_gray, frame, detections, pyramid)
+        if not faces:
+            self.last_box = None
+            return None
         face_rect = max(faces, key=lambda r: (r[2]-r[0])*(r[3]-r[1]))
-        left, top, right, bottom = map(int, face_rect)
-        
-        # 扩大检测区域
-        padding_h = int((bottom - top) * 0.1)  # 垂直方向增加10%
-        padding_w = int((right - left) * 0.1)  # 水平方向增加10%
-        
-        # 确保扩展后的坐标不超出图像范围
-        height, width = frame.shape[:2]
-        rect = dlib.rectangle(
-            max(0, left - padding_w),
-            max(0, top - padding_h),
-            min(width, right + padding_w),
-            min(height, bottom + padding_h)
-        )
-        
+        shape = face_utils.shape_to_np(get_predictor()(frame_gray, face_to_rect(face_rect, frame_shape)))
+        box = landmark_box(shape)
+        self.last_box = (box[0] + ox, box[1] + oy, box[2] + ox, box[3] + oy)
+        return shape
+
+    def analyse(self, frame, detections=None, offset=(0, 0)):
+        """只做检测不绘制，返回 (shape, EAR, MAR)；未检测到人脸时 shape 为 None
+
+        frame 可以是 BGR 图像或 myimage.FramePyramid
+        """
+        pyramid = myimage.as_pyramid(frame)
+        frame = pyramid.bgr
+        frame_gray = pyramid.equalized()
+
         try:
-            # 使用改进的关键点检测
-            shape = predictor(frame_gray, rect)
-            shape = face_utils.shape_to_np(shape)
-            
-            # 获取眼睛和嘴巴坐标
-            leftEye = shape[lStart:lEnd]
-            rightEye = shape[rStart:rEnd]
-            mouth = shape[mStart:mEnd]
-            
-            # 计算眼睛和嘴巴的纵横比
-            leftEAR = eye_aspect_ratio(leftEye)
-            rightEAR = eye_aspect_ratio(rightEye)
-            eyear = (leftEAR + rightEAR) / 2.0
-            mouthar = mouth_aspect_ratio(mouth)
-            
-            # 绘制面部特征点和轮廓
-            for (x, y) in shape:
-                cv2.circle(frame, (x, y), 2, (0, 255, 0), -1)
-            
-            # 绘制眼睛和嘴巴轮廓
-            leftEyeHull = cv2.convexHull(leftEye)
-            rightEyeHull = cv2.convexHull(rightEye)
-            mouthHull = cv2.convexHull(mouth)
-            
-            cv2.drawContours(frame, [leftEyeHull], -1, (0, 255, 0), 1)
-            cv2.drawContours(frame, [rightEyeHull], -1, (0, 255, 0), 1)
-            cv2.drawContours(frame, [mouthHull], -1, (0, 255, 0), 1)
-            
-            # 在画面上显示当前的EAR和MAR值
-            cv2.putText(frame, f"EAR: {eyear:.2f}", (300, 30),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-            cv2.putText(frame, f"MAR: {mouthar:.2f}", (300, 60),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-                        
+            shape = self._locate(frame_gray, frame, detections, offset, pyramid)
+            if shape is None:
+                return None, 0.0, 0.0
+            eyear, mouthar = fatigue_ratios(shape)
+        except ModelLoadError:
+            raise
         except Exception as e:
             print(f"关键点检测失败: {str(e)}")
-            return frame, 0.0, 0.0
-    
-    return frame, eyear, mouthar
\ No newline at end of file
+            self.last_box = None
+            return None, 0.0, 0.0
+        return shape, eyear, mouthar
+
+    def detfatigue(self, frame, detections=None):
+        shape, eyear, mouthar = self.analyse(frame, detections)
+        if shape is not None:
+            draw_landmarks(frame, shape, eyear, mouthar)
+        return frame, eyear, mouthar
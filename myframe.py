@@ -3,21 +3,110 @@
 import cv2
 import mydetect     #yolo检测
 import myfatigue    #疲劳检测
+import myimage      #单帧图像缓存
 import time
+from concurrent.futures import ThreadPoolExecutor
 
-cap = cv2.VideoCapture(0)
+# 摄像头模式用到的模型，入口程序可调用 registry.preload(*MODELS) 在后台提前加载
+MODELS = myfatigue.MODELS + ('yolo',)
+
+# 摄像头模式下使用人脸跟踪，关键帧之间跳过完整的人脸检测
+USE_FACE_TRACKING = True
+tracker = myfatigue.FaceTracker(redetect_interval=10, drift_threshold=0.5)
+
+# 关键点检测和YOLO检测并行运行（两者的主要耗时都在释放GIL的原生代码中），
+# 设为 False 时退回串行执行
+CONCURRENT = True
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='yolo')
+
+# 人脸区域(ROI)模式：检测到人脸后，下一帧只在人脸周围的裁剪窗口内做灰度化、
+# 直方图均衡化、关键点检测，YOLO也在该窗口上以较小的letterbox尺寸运行
+ROI_MODE = True
+ROI_PAD = 0.6        # 窗口在关键点外接矩形基础上向四周扩展的比例
+ROI_IMGSZ = 320      # 窗口内YOLO推理的letterbox尺寸
+ROI_MIN_SIZE = 96    # 窗口最小边长，过小时退回整帧
+_roi_box = None      # 上一帧关键点外接矩形（整帧坐标）
+
+# 最近一帧各分支耗时（秒）
+timings = {'fatigue': 0.0, 'yolo': 0.0, 'total': 0.0}
+
+def _timed(fn, *args):
+    t = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - t
+
+def _analyse_fatigue(frame, detections=None, offset=(0, 0)):
+    if USE_FACE_TRACKING:
+        return tracker.analyse(frame, detections, offset)
+    return myfatigue.analyse(frame, detections)
+
+def _roi_window(frame_shape):
+    """根据上一帧的人脸位置计算裁剪窗口 (x0, y0, x1, y1)，没有可用窗口时返回 None"""
+    if not ROI_MODE or _roi_box is None:
+        return None
+    left, top, right, bottom = _roi_box
+    pad_w = (right - left) * ROI_PAD
+    pad_h = (bottom - top) * ROI_PAD
+    height, width = frame_shape[:2]
+    x0, y0 = max(0, int(left - pad_w)), max(0, int(top - pad_h))
+    x1, y1 = min(width, int(right + pad_w)), min(height, int(bottom + pad_h))
+    if x1 - x0 < ROI_MIN_SIZE or y1 - y0 < ROI_MIN_SIZE:
+        return None
+    return x0, y0, x1, y1
+
+def _analyse(view, offset, img_size):
+    """在 view（整帧或ROI窗口的 FramePyramid）上运行关键点检测和YOLO，返回窗口内的坐标"""
+    image = view.bgr
+    if myfatigue.get_face_detector().uses_yolo:
+        # 人脸框由YOLO结果推算：先运行YOLO，再把检测结果交给关键点检测复用
+        action, t_yolo = _timed(mydetect.predict, image, img_size)
+        (shape, eye, mouth), t_fatigue = _timed(_analyse_fatigue, view, action, offset)
+    elif CONCURRENT:
+        # YOLO在线程池中运行，疲劳检测在当前线程运行，两者都只读取图像
+        yolo_future = _executor.submit(_timed, mydetect.predict, image, img_size)
+        (shape, eye, mouth), t_fatigue = _timed(_analyse_fatigue, view, None, offset)
+        action, t_yolo = yolo_future.result()
+    else:
+        # 疲劳检测
+        (shape, eye, mouth), t_fatigue = _timed(_analyse_fatigue, view, None, offset)
+
+        # YOLO检测
+        action, t_yolo = _timed(mydetect.predict, image, img_size)
+    return shape, eye, mouth, action, t_fatigue, t_yolo
 
 def process(frame):
-    frame = cv2.resize(frame, (640, 480))
+    global _roi_box
+    # 缩放（已是 640x480 时不复制）后，灰度图、均衡化图和多尺度缩放图在本帧内按需计算一次
+    pyramid = myimage.FramePyramid(frame, (640, 480))
+    frame = pyramid.bgr
     ret = []
     labellist = []
-    tstart = time.time()
+    tstart = time.perf_counter()
+
+    # 选择整帧或人脸窗口
+    window = _roi_window(frame.shape)
+    if window is None:
+        x0, y0 = 0, 0
+        view, img_size = pyramid, None
+    else:
+        x0, y0, x1, y1 = window
+        view, img_size = pyramid.crop(x0, y0, x1, y1), ROI_IMGSZ
 
-    # 疲劳检测
-    frame, eye, mouth = myfatigue.detfatigue(frame)
-    
-    # YOLO检测
-    action = mydetect.predict(frame)
+    shape, eye, mouth, action, t_fatigue, t_yolo = _analyse(view, (x0, y0), img_size)
+
+    # 窗口坐标映射回整帧
+    if shape is not None:
+        shape = shape + (x0, y0)
+        _roi_box = myfatigue.landmark_box(shape)
+    else:
+        _roi_box = None
+    if window is not None:
+        action = [(label, prob, [xyxy[0] + x0, xyxy[1] + y0, xyxy[2] + x0, xyxy[3] + y0])
+                  for label, prob, xyxy in action]
+
+    # 所有分支完成后再统一在整帧上绘制
+    if shape is not None:
+        myfatigue.draw_landmarks(frame, shape, eye, mouth)
 
     # 处理检测结果
     for label, prob, xyxy in action:
@@ -27,5 +116,9 @@ def process(frame):
         cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 1)
         cv2.putText(frame, text, (left, top-5), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 1)
 
+    timings['fatigue'] = t_fatigue
+    timings['yolo'] = t_yolo
+    timings['total'] = time.perf_counter() - tstart
+
     # 返回处理结果
-    return frame, eye, mouth, labellist
\ No newline at end of file
+    return frame, eye, mouth, labellist
@@ -0,0 +1,127 @@
+# 单帧图像缓存
+# 同一帧的灰度图、直方图均衡化图、各缩放比例和 RGB 版本在第一次使用时计算并保存，之后直接返回同一数组，
+# 每种变换每帧最多计算一次；尺寸不变的缩放、从整帧灰度图裁剪窗口等不需要计算的情况直接返回视图。
+# 模块级计数器记录实际计算和节省的变换次数
+
+import threading
+from collections import Counter
+
+import cv2
+
+_lock = threading.Lock()
+_computed = Counter()  # 实际执行的变换次数
+_saved = Counter()     # 复用缓存或直接返回视图而省去的变换次数
+
+
+def _count(counter, kind):
+    with _lock:
+        counter[kind] += 1
+
+
+def stats():
+    """按变换类型统计的计算/节省次数"""
+    with _lock:
+        return {'computed': dict(_computed), 'saved': dict(_saved),
+                'total_computed': sum(_computed.values()), 'total_saved': sum(_saved.values())}
+
+
+def reset_stats():
+    with _lock:
+        _computed.clear()
+        _saved.clear()
+
+
+def format_stats():
+    """日志面板用的统计文本"""
+    s = stats()
+    detail = ", ".join(f"{kind} {n}" for kind, n in sorted(s['saved'].items()))
+    return f"图像变换: 计算 {s['total_computed']} 次, 节省 {s['total_saved']} 次" + (f" ({detail})" if detail else "")
+
+
+def fit(image, size):
+    """缩放到 size=(宽, 高)，尺寸已一致时直接返回原数组"""
+    size = tuple(size)
+    if image.shape[1::-1] == size:
+        _count(_saved, 'resize')
+        return image
+    _count(_computed, 'resize')
+    return cv2.resize(image, size)
+
+
+class FramePyramid:
+    """一帧 BGR 图像及其按需计算的派生图像
+
+    frame: BGR 图像；给出 size=(宽, 高) 时先缩放到该尺寸
+    各方法返回的数组在本帧内共享，调用方不应修改（在 bgr 上绘制后调用 invalidate()）。
+    不是线程安全的：同一帧的派生图像只应在一个线程中获取，其他线程只读取 bgr。
+    """
+
+    def __init__(self, frame, size=None, parent=None, window=None):
+        self.bgr = fit(frame, size) if size is not None else frame
+        self.parent = parent  # crop() 得到的窗口所属的整帧
+        self.window = window  # 窗口在整帧中的 (x0, y0, x1, y1)
+        self._cache = {}
+
+    @property
+    def shape(self):
+        return self.bgr.shape
+
+    def _cached(self, key, kind, compute):
+        value = self._cache.get(key)
+        if value is not None:
+            _count(_saved, kind)
+            return value
+        value = compute()
+        _count(_computed, kind)
+        self._cache[key] = value
+        return value
+
+    def gray(self):
+        """灰度图；窗口所属整帧的灰度图已计算时直接裁剪（逐像素变换，结果相同）"""
+        if 'gray' not in self._cache and self.parent is not None and 'gray' in self.parent._cache:
+            x0, y0, x1, y1 = self.window
+            self._cache['gray'] = self.parent._cache['gray'][y0:y1, x0:x1]
+            _count(_saved, 'gray')
+            return self._cache['gray']
+        return self._cached('gray', 'gray', lambda: cv2.cvtColor(self.bgr, cv2.COLOR_BGR2GRAY))
+
+    def equalized(self):
+        """直方图均衡化后的灰度图（依赖整幅图像的直方图，窗口不能从整帧结果裁剪）"""
+        return self._cached('equalized', 'equalize', lambda: cv2.equalizeHist(self.gray()))
+
+    def scaled(self, scale, source='equalized'):
+        """按比例缩放的 gray / equalized / bgr 图像，比例为1时直接返回原图"""
+        if source == 'bgr':
+            image = self.bgr
+        else:
+            image = self._cache.get(source)  # 取缩放的源图本身不计入节省次数
+            image = getattr(self, source)() if image is None else image
+        if scale == 1:
+            _count(_saved, 'scale')
+            return image
+        return self._cached(('scaled', source, scale), 'scale',
+                            lambda: cv2.resize(image, None, fx=scale, fy=scale))
+
+    def resized(self, size):
+        """缩放到 size=(宽, 高) 的 BGR 图像"""
+        size = tuple(size)
+        if self.bgr.shape[1::-1] == size:
+            _count(_saved, 'resize')
+            return self.bgr
+        return self._cached(('resized', size), 'resize', lambda: cv2.resize(self.bgr, size))
+
+    def rgb(self):
+        return self._cached('rgb', 'rgb', lambda: cv2.cvtColor(self.bgr, cv2.COLOR_BGR2RGB))
+
+    def crop(self, x0, y0, x1, y1):
+        """窗口 [x0, x1) x [y0, y1) 的视图，灰度图可复用整帧的结果"""
+        return FramePyramid(self.bgr[y0:y1, x0:x1], parent=self, window=(x0, y0, x1, y1))
+
+    def invalidate(self):
+        """bgr 被修改（例如绘制标注）后清除派生图像"""
+        self._cache.clear()
+
+
+def as_pyramid(frame):
+    """ndarray 包装为 FramePyramid，已经是 FramePyramid 时原样返回"""
+    return frame if isinstance(frame, FramePyramid) else FramePyramid(frame)
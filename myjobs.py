@@ -0,0 +1,133 @@
+# 视频检测任务调度
+# 每个上传的视频是一个独立的 Job，分析状态只保存在任务自己的对象里；
+# JobScheduler 用固定数量的工作线程执行任务，等待队列有上限，并按历史处理速度估计排队等待时间
+
+import itertools
+import threading
+import time
+from collections import deque
+
+
+class QueueFullError(RuntimeError):
+    """等待队列已满"""
+
+
+class Job:
+    """一个检测任务，fn(job, *args) 在工作线程中执行，可通过 report_progress 上报进度"""
+    PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+
+    def __init__(self, job_id, fn, args, total_frames=1):
+        self.id = job_id
+        self.fn = fn
+        self.args = args
+        self.total_frames = max(int(total_frames), 1)
+        self.state = Job.PENDING
+        self.progress = 0.0        # 0~1
+        self.progress_desc = ""
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._finished = threading.Event()
+
+    def report_progress(self, ratio, desc=""):
+        self.progress = min(max(float(ratio), 0.0), 1.0)
+        self.progress_desc = desc
+
+    def wait(self, timeout=None):
+        """等待任务结束，超时返回 False"""
+        return self._finished.wait(timeout)
+
+    @property
+    def queue_time(self):
+        """排队等待时长（秒）"""
+        return (self.started_at or time.time()) - self.submitted_at
+
+
+class JobScheduler:
+    """固定大小的工作线程池 + 有上限的先进先出等待队列"""
+
+    def __init__(self, workers=1, queue_depth=8, frame_time=0.05):
+        self.workers = max(1, workers)
+        self.queue_depth = queue_depth
+        self.frame_time = frame_time  # 每帧处理耗时的滑动平均（秒），用于估计等待时间
+        self._pending = deque()
+        self._running = []
+        self._cond = threading.Condition()
+        self._ids = itertools.count(1)
+        self.completed = 0
+        self.rejected = 0
+        self._threads = [threading.Thread(target=self._worker, daemon=True, name=f'job-worker-{i}')
+                         for i in range(self.workers)]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, fn, *args, total_frames=1):
+        """提交任务，队列已满时抛出 QueueFullError"""
+        with self._cond:
+            if len(self._pending) >= self.queue_depth:
+                self.rejected += 1
+                raise QueueFullError(f"任务队列已满（{self.queue_depth}），请稍后再试")
+            job = Job(next(self._ids), fn, args, total_frames)
+            self._pending.append(job)
+            self._cond.notify()
+            return job
+
+    def position(self, job):
+        """排队位置，从1开始；已开始或结束的任务返回 0"""
+        with self._cond:
+            try:
+                return self._pending.index(job) + 1
+            except ValueError:
+                return 0
+
+    def eta(self, job):
+        """预计还需等待多少秒开始处理：前面所有任务的剩余帧数按当前处理速度均摊到各工作线程"""
+        with self._cond:
+            if job not in self._pending:
+                return 0.0
+            ahead = sum(j.total_frames * (1.0 - j.progress) for j in self._running)
+            for j in self._pending:
+                if j is job:
+                    break
+                ahead += j.total_frames
+            return ahead * self.frame_time / self.workers
+
+    def stats(self):
+        with self._cond:
+            return {
+                'workers': self.workers,
+                'running': len(self._running),
+                'pending': len(self._pending),
+                'queue_depth': self.queue_depth,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'frame_time_ms': self.frame_time * 1000.0,
+            }
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending)
+                job = self._pending.popleft()
+                self._running.append(job)
+                job.state = Job.RUNNING
+                job.started_at = time.time()
+
+            try:
+                job.result = job.fn(job, *job.args)
+                job.state = Job.DONE
+            except Exception as e:
+                job.error = e
+                job.state = Job.FAILED
+            job.finished_at = time.time()
+
+            with self._cond:
+                self._running.remove(job)
+                self.completed += 1
+                if job.state == Job.DONE:
+                    # 用完成任务的实际速度更新每帧耗时估计
+                    per_frame = (job.finished_at - job.started_at) / job.total_frames
+                    self.frame_time = 0.7 * self.frame_time + 0.3 * per_frame
+            job._finished.set()
@@ -0,0 +1,200 @@
+# 摄像头实时处理流水线：采集线程 -> 推理线程 -> Qt 主线程渲染
+# 各阶段之间用丢弃最旧数据的有界队列连接，慢帧不会阻塞界面也不会让摄像头缓冲堆积
+
+import threading
+import time
+from collections import deque, namedtuple
+
+import numpy as np
+
+STOP_TIMEOUT = 0.5  # stop() 等待线程结束的最长时间（秒），避免阻塞 Qt 主线程
+
+# 推理结果，时间戳均为 time.perf_counter()
+FrameResult = namedtuple('FrameResult', [
+    'frame', 'eye', 'mouth', 'labellist', 'error',
+    't_capture', 't_infer_start', 't_infer_end',
+])
+
+
+class DropOldestQueue:
+    """有界队列，满时丢弃最旧的元素，记录丢弃数量"""
+
+    def __init__(self, maxsize=1):
+        self._items = deque(maxlen=maxsize)
+        self._cond = threading.Condition()
+        self.dropped = 0
+
+    def put(self, item):
+        with self._cond:
+            if len(self._items) == self._items.maxlen:
+                self.dropped += 1
+            self._items.append(item)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """取出最旧的元素，超时返回 None"""
+        with self._cond:
+            if not self._items and not self._cond.wait_for(lambda: self._items, timeout):
+                return None
+            return self._items.popleft()
+
+    def get_nowait(self):
+        with self._cond:
+            return self._items.popleft() if self._items else None
+
+    def get_latest(self):
+        """取出最新的元素并丢弃其余积压的元素（计入丢弃数量），队列为空时返回 None"""
+        with self._cond:
+            if not self._items:
+                return None
+            self.dropped += len(self._items) - 1
+            item = self._items.pop()
+            self._items.clear()
+            return item
+
+    def clear(self):
+        with self._cond:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+class LatencyStats:
+    """各阶段耗时的滑动窗口统计（毫秒）"""
+
+    def __init__(self, window=120):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            if stage not in self._samples:
+                self._samples[stage] = deque(maxlen=self.window)
+            self._samples[stage].append(seconds * 1000.0)
+
+    def summary(self):
+        """返回 {stage: (平均值, p95, 最大值)}"""
+        with self._lock:
+            samples = {k: np.asarray(v) for k, v in self._samples.items() if v}
+        return {k: (v.mean(), np.percentile(v, 95), v.max()) for k, v in samples.items()}
+
+    def format(self):
+        return ", ".join(f"{stage} {avg:.0f}/{p95:.0f}/{mx:.0f}ms"
+                         for stage, (avg, p95, mx) in self.summary().items())
+
+
+class CaptureThread(threading.Thread):
+    """持续读取摄像头，只保留最新一帧；循环结束时由本线程释放摄像头，避免在 read() 期间被其他线程释放"""
+
+    def __init__(self, cap, out_queue):
+        super().__init__(daemon=True)
+        self.cap = cap
+        self.out_queue = out_queue
+        self.stop_event = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                ret, frame = self.cap.read()
+                if not ret:
+                    time.sleep(0.01)
+                    continue
+                self.out_queue.put((frame, time.perf_counter()))
+        finally:
+            self.cap.release()
+
+    def stop(self):
+        self.stop_event.set()
+
+
+class InferenceWorker(threading.Thread):
+    """从采集队列取最新帧，调用 process_fn(frame) -> (frame, eye, mouth, labellist)
+
+    timings_fn: 可选，返回 {分支名: 秒} 的函数，每帧推理后记入统计
+    """
+
+    def __init__(self, process_fn, in_queue, out_queue, stats, timings_fn=None):
+        super().__init__(daemon=True)
+        self.process_fn = process_fn
+        self.timings_fn = timings_fn
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.stats = stats
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            item = self.in_queue.get(timeout=0.1)
+            if item is None:
+                continue
+            frame, t_capture = item
+            t_start = time.perf_counter()
+            self.stats.add('采集等待', t_start - t_capture)
+            try:
+                frame, eye, mouth, labellist = self.process_fn(frame)
+                error = None
+            except Exception as e:
+                eye = mouth = None
+                labellist = []
+                error = e
+            t_end = time.perf_counter()
+            self.stats.add('推理', t_end - t_start)
+            if self.timings_fn is not None and error is None:
+                for stage, seconds in self.timings_fn().items():
+                    self.stats.add(stage, seconds)
+            self.out_queue.put(FrameResult(frame, eye, mouth, labellist, error,
+                                           t_capture, t_start, t_end))
+
+    def stop(self):
+        self.stop_event.set()
+
+
+class CameraPipeline:
+    """组装采集线程和推理线程，Qt 线程通过 poll() 取结果渲染"""
+
+    def __init__(self, cap, process_fn, result_queue_size=2, timings_fn=None):
+        self.cap = cap
+        self.stats = LatencyStats()
+        self.frame_queue = DropOldestQueue(maxsize=1)
+        self.result_queue = DropOldestQueue(maxsize=result_queue_size)
+        self.capture = CaptureThread(cap, self.frame_queue)
+        self.worker = InferenceWorker(process_fn, self.frame_queue, self.result_queue, self.stats,
+                                      timings_fn=timings_fn)
+
+    def start(self):
+        self.capture.start()
+        self.worker.start()
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """通知两个线程停止，最多等待 timeout 秒；返回两个线程是否都已结束
+
+        摄像头由采集线程自己释放。超时（读帧或推理卡住）时线程仍在后台收尾，
+        alive() 为 False 之前不应启动新的流水线，否则会与旧线程同时读取摄像头或调用 process_fn
+        """
+        self.capture.stop()
+        self.worker.stop()
+        deadline = time.monotonic() + timeout
+        for thread in (self.capture, self.worker):
+            thread.join(max(deadline - time.monotonic(), 0))
+        return not self.alive()
+
+    def alive(self):
+        """采集线程或推理线程是否仍在运行"""
+        return self.capture.is_alive() or self.worker.is_alive()
+
+    def poll(self):
+        """取出最新的推理结果，丢弃积压的旧结果；没有新结果时返回 None"""
+        return self.result_queue.get_latest()
+
+    def record_render(self, result, t_render_start, t_render_end):
+        """记录渲染阶段耗时和采集到上屏的端到端延迟"""
+        self.stats.add('显示等待', t_render_start - result.t_infer_end)
+        self.stats.add('渲染', t_render_end - t_render_start)
+        self.stats.add('端到端', t_render_end - result.t_capture)
+
+    def report(self):
+        """日志面板用的统计文本：平均/p95/最大耗时和丢帧数"""
+        return (f"延迟统计(平均/p95/最大): {self.stats.format()}; "
+                f"丢帧: 采集 {self.frame_queue.dropped}, 结果 {self.result_queue.dropped}")
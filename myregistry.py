@@ -0,0 +1,149 @@
+# 模型注册表
+# 各模块在导入时只登记加载函数，模型在第一次使用时加载，入口程序也可以调用 preload()
+# 在后台线程提前加载和预热；每个组件记录加载/预热耗时和状态，界面据此显示"模型加载中"
+
+import threading
+import time
+
+IDLE, LOADING, READY, FAILED = 'idle', 'loading', 'ready', 'failed'
+STATE_TEXT = {IDLE: '未加载', LOADING: '加载中', READY: '已就绪', FAILED: '加载失败'}
+
+
+class ModelLoadError(RuntimeError):
+    """模型加载失败"""
+
+
+class ModelEntry:
+    """一个模型组件：loader() 返回模型对象，warmup(model) 可选，用于第一次推理前的预热"""
+
+    def __init__(self, name, loader, warmup=None, description=''):
+        self.name = name
+        self.description = description or name
+        self.loader = loader
+        self.warmup = warmup
+        self.state = IDLE
+        self.value = None
+        self.error = None
+        self.load_time = None
+        self.warmup_time = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def load(self):
+        """加载并预热（已加载或正在被其他线程加载时直接等待结果）"""
+        with self._lock:
+            if self.state in (READY, FAILED):
+                return
+            self.state = LOADING
+            t = time.perf_counter()
+            try:
+                value = self.loader()
+                self.load_time = time.perf_counter() - t
+                if self.warmup is not None:
+                    t = time.perf_counter()
+                    self.warmup(value)
+                    self.warmup_time = time.perf_counter() - t
+                self.value = value
+                self.state = READY
+            except Exception as e:
+                self.error = e
+                self.state = FAILED
+                print(f"{self.description}加载失败: {e}")
+            self._done.set()
+
+    def get(self):
+        if self.state != READY:
+            self.load()
+        if self.state == FAILED:
+            raise ModelLoadError(f"{self.description}加载失败: {self.error}")
+        return self.value
+
+    def set(self, value):
+        """直接替换模型对象（例如切换后端）"""
+        with self._lock:
+            self.value = value
+            self.error = None
+            self.state = READY
+            self._done.set()
+
+    def reset(self):
+        """回到未加载状态，下次使用时重新加载"""
+        with self._lock:
+            self.value = None
+            self.error = None
+            self.state = IDLE
+            self.load_time = self.warmup_time = None
+            self._done.clear()
+
+    def format(self):
+        text = f"{self.description}: {STATE_TEXT[self.state]}"
+        if self.state == READY and self.load_time is not None:
+            text += f" (加载 {self.load_time:.1f}s"
+            text += f", 预热 {self.warmup_time:.1f}s)" if self.warmup_time is not None else ")"
+        elif self.state == FAILED:
+            text += f" ({self.error})"
+        return text
+
+
+class ModelRegistry:
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, loader, warmup=None, description=''):
+        """登记模型加载函数，重复登记同名组件时保留已有的"""
+        with self._lock:
+            if name not in self._entries:
+                self._entries[name] = ModelEntry(name, loader, warmup, description)
+            return self._entries[name]
+
+    def entry(self, name):
+        return self._entries[name]
+
+    def get(self, name):
+        """返回模型对象，未加载时在当前线程加载（阻塞）"""
+        return self._entries[name].get()
+
+    def set(self, name, value):
+        self._entries[name].set(value)
+
+    def preload(self, *names):
+        """在后台线程加载并预热指定组件（默认全部），每个组件一个线程，立即返回"""
+        for name in names or list(self._entries):
+            entry = self._entries[name]
+            if entry.state == IDLE:
+                threading.Thread(target=entry.load, daemon=True, name=f'load-{name}').start()
+
+    def retry(self, *names):
+        """把加载失败的组件（默认全部）恢复为未加载并在后台重新加载，返回重试的组件名"""
+        failed = [n for n in names or list(self._entries) if self._entries[n].state == FAILED]
+        for name in failed:
+            self._entries[name].reset()
+        if failed:
+            self.preload(*failed)
+        return failed
+
+    def failed(self, *names):
+        return any(self._entries[n].state == FAILED for n in names or self._entries)
+
+    def ready(self, *names):
+        return all(self._entries[n].state == READY for n in names or self._entries)
+
+    def wait(self, *names, timeout=None):
+        """等待指定组件加载结束（成功或失败），超时返回 False"""
+        deadline = None if timeout is None else time.time() + timeout
+        for name in names or list(self._entries):
+            remaining = None if deadline is None else max(0.0, deadline - time.time())
+            if not self._entries[name]._done.wait(remaining):
+                return False
+        return True
+
+    def timings(self):
+        """{组件: (加载秒数, 预热秒数)}，未加载的组件为 None"""
+        return {n: (e.load_time, e.warmup_time) for n, e in self._entries.items()}
+
+    def format_status(self):
+        return "\n".join(e.format() for e in self._entries.values())
+
+
+registry = ModelRegistry()
@@ -0,0 +1,403 @@
+# 疲劳判定的流式状态机，Qt 桌面端和 Gradio 网页端共用
+# EventDetector：连续帧确认 + 同类事件最小间隔（离线视频检测和实时流）
+# FatigueEngine：EAR 平滑、闭眼确认、眨眼/哈欠计数和时间窗口（桌面端的疲劳状态面板）
+# 两套规则有意分开：EventDetector 的阈值由网页端参数设置，事件结果写入报告、遥测和关键点缓存的重放；
+# FatigueEngine 沿用桌面端原有的判定（阈值和含义都不同），合并会改变任一前端已有的检测结果
+# 两者每帧 update() 都是 O(1)；replay() 接受整段 EAR/MAR 数组，向量化重放录制的序列
+
+import time
+from collections import deque, namedtuple
+
+import numpy as np
+
+FrameState = namedtuple('FrameState', [
+    'fatigue_count', 'yawn_count',          # 当前连续帧计数
+    'fatigue_confirmed', 'yawn_confirmed',  # 连续帧数达到确认要求
+    'fatigue_logged', 'yawn_logged',        # 本帧记录了新的事件
+    'status_text',
+])
+
+EngineState = namedtuple('EngineState', [
+    'valid',                    # EAR 有效（检测到面部特征）
+    'ear', 'avg_ear', 'mar',    # 当前值和平滑后的 EAR
+    'eye_closed',               # 闭眼状态（经过连续帧确认）
+    'closed_started',           # 本帧进入闭眼状态
+    'closed_frames',            # 本次闭眼已持续的帧数
+    'yawn_frames',              # 当前张嘴持续的帧数
+    'blink', 'yawn',            # 本帧记录了一次眨眼/哈欠
+    'blinks', 'yawns',          # 时间窗口内的眨眼/哈欠次数
+    'fatigue',                  # 疲劳（平滑 EAR 过低或窗口内哈欠过多）
+    'reset',                    # 本帧定期重置了计数
+])
+
+
+def status_text(fatigue_logged, yawn_logged):
+    """与 EventDetector.update() 相同的状态文字"""
+    if fatigue_logged and yawn_logged:
+        return "检测到疲劳 - 眼睛闭合 | 检测到打哈欠"
+    if fatigue_logged:
+        return "检测到疲劳 - 眼睛闭合"
+    if yawn_logged:
+        return "检测到打哈欠"
+    return "正常状态"
+
+
+def state_at(result, index):
+    """由 EventDetector.replay() 的结果取出第 index 帧的 FrameState"""
+    fatigue_logged, yawn_logged = bool(result['fatigue_logged'][index]), bool(result['yawn_logged'][index])
+    return FrameState(int(result['fatigue_count'][index]), int(result['yawn_count'][index]),
+                      bool(result['fatigue_confirmed'][index]), bool(result['yawn_confirmed'][index]),
+                      fatigue_logged, yawn_logged, status_text(fatigue_logged, yawn_logged))
+
+
+def run_lengths(cond):
+    """每个位置上 cond 连续为 True 的长度（为 False 的位置为 0）"""
+    cond = np.asarray(cond, dtype=bool)
+    index = np.arange(len(cond))
+    last_false = np.maximum.accumulate(np.where(cond, -1, index))
+    return index - last_false
+
+
+def _spaced_events(candidates, min_interval):
+    """从候选帧中依次选出事件：第一个候选帧，以及此后与上一个事件相隔至少 min_interval 的候选帧"""
+    if min_interval <= 1 or len(candidates) == 0:
+        return candidates
+    events = []
+    i = 0
+    while i < len(candidates):
+        events.append(candidates[i])
+        i = np.searchsorted(candidates, candidates[i] + min_interval)
+    return np.asarray(events, dtype=candidates.dtype)
+
+
+class RingBuffer:
+    """定长环形缓冲区，维护元素和，均值 O(1)"""
+
+    def __init__(self, capacity):
+        self.data = np.zeros(capacity, dtype=np.float64)
+        self.clear()
+
+    def clear(self):
+        self.pos = 0
+        self.count = 0
+        self.total = 0.0
+
+    def push(self, value):
+        if self.count == len(self.data):
+            self.total -= self.data[self.pos]
+        else:
+            self.count += 1
+        self.data[self.pos] = value
+        self.total += value
+        self.pos = (self.pos + 1) % len(self.data)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def __len__(self):
+        return self.count
+
+
+class EventWindow:
+    """按时间排序的事件时间戳，只保留最近 window 秒内的（过期记录从队首弹出，均摊 O(1)）"""
+
+    def __init__(self, window):
+        self.window = window
+        self.times = deque()
+
+    def add(self, t):
+        self.times.append(t)
+
+    def expire(self, now):
+        while self.times and self.times[0] < now - self.window:
+            self.times.popleft()
+
+    def clear(self):
+        self.times.clear()
+
+    def __len__(self):
+        return len(self.times)
+
+
+class EventDetector:
+    """疲劳/打哈欠的时序判定逻辑，逐帧输入 EAR/MAR"""
+
+    def __init__(self, fps, ear_threshold=0.3, mar_threshold=0.5,
+                 fatigue_consec_frames=15, yawn_consec_frames=10, min_interval_frames=None):
+        self.EAR_THRESHOLD = ear_threshold                  # 眼睛闭合阈值
+        self.MAR_THRESHOLD = mar_threshold                  # 打哈欠阈值
+        self.FATIGUE_CONSEC_FRAMES = fatigue_consec_frames  # 疲劳确认帧数
+        self.YAWN_CONSEC_FRAMES = yawn_consec_frames        # 打哈欠确认帧数
+        # 同类事件的最小间隔，默认1秒
+        self.MIN_INTERVAL_FRAMES = fps * 1 if min_interval_frames is None else min_interval_frames
+        self.reset()
+
+    def reset(self):
+        self.fatigue_frame_count = 0
+        self.yawn_frame_count = 0
+        self.fatigue_events = 0
+        self.yawn_events = 0
+        self.last_fatigue_time = -1
+        self.last_yawn_time = -1
+
+    def update(self, frame_index, ear, mar):
+        """输入一帧的 EAR/MAR，返回该帧的 FrameState"""
+        current_fatigue = ear < self.EAR_THRESHOLD and ear > 0
+        current_yawn = mar > self.MAR_THRESHOLD and mar > 0
+
+        # 疲劳状态检测（需要连续帧确认）
+        if current_fatigue:
+            self.fatigue_frame_count += 1
+        else:
+            self.fatigue_frame_count = 0
+
+        # 打哈欠检测（需要连续帧确认）
+        if current_yawn:
+            self.yawn_frame_count += 1
+        else:
+            self.yawn_frame_count = 0
+
+        is_fatigue_confirmed = self.fatigue_frame_count >= self.FATIGUE_CONSEC_FRAMES
+        is_yawn_confirmed = self.yawn_frame_count >= self.YAWN_CONSEC_FRAMES
+
+        fatigue_logged = False
+        yawn_logged = False
+
+        if is_fatigue_confirmed:
+            # 检查是否需要记录新的疲劳事件
+            if self.last_fatigue_time == -1 or (frame_index - self.last_fatigue_time) >= self.MIN_INTERVAL_FRAMES:
+                self.fatigue_events += 1
+                self.last_fatigue_time = frame_index
+                fatigue_logged = True
+
+        if is_yawn_confirmed:
+            # 检查是否需要记录新的打哈欠事件
+            if self.last_yawn_time == -1 or (frame_index - self.last_yawn_time) >= self.MIN_INTERVAL_FRAMES:
+                self.yawn_events += 1
+                self.last_yawn_time = frame_index
+                yawn_logged = True
+
+        return FrameState(self.fatigue_frame_count, self.yawn_frame_count,
+                          is_fatigue_confirmed, is_yawn_confirmed,
+                          fatigue_logged, yawn_logged, status_text(fatigue_logged, yawn_logged))
+
+    def replay(self, ear, mar):
+        """对整段 EAR/MAR（帧序号 0..N-1）向量化重放，结果与从 reset() 开始逐帧 update() 相同，不改变当前状态
+
+        返回 FrameState 各字段（status_text 除外）对应的数组字典
+        """
+        ear, mar = np.asarray(ear, dtype=np.float64), np.asarray(mar, dtype=np.float64)
+        fatigue_count = run_lengths((ear < self.EAR_THRESHOLD) & (ear > 0))
+        yawn_count = run_lengths((mar > self.MAR_THRESHOLD) & (mar > 0))
+        fatigue_confirmed = fatigue_count >= self.FATIGUE_CONSEC_FRAMES
+        yawn_confirmed = yawn_count >= self.YAWN_CONSEC_FRAMES
+        fatigue_logged = np.zeros(len(ear), dtype=bool)
+        yawn_logged = np.zeros(len(ear), dtype=bool)
+        fatigue_logged[_spaced_events(np.flatnonzero(fatigue_confirmed), self.MIN_INTERVAL_FRAMES)] = True
+        yawn_logged[_spaced_events(np.flatnonzero(yawn_confirmed), self.MIN_INTERVAL_FRAMES)] = True
+        return {'fatigue_count': fatigue_count, 'yawn_count': yawn_count,
+                'fatigue_confirmed': fatigue_confirmed, 'yawn_confirmed': yawn_confirmed,
+                'fatigue_logged': fatigue_logged, 'yawn_logged': yawn_logged}
+
+
+class FatigueEngine:
+    """流式疲劳状态机：EAR 平滑、闭眼连续帧确认、眨眼/哈欠计数和时间窗口，每帧 O(1)
+
+    update() 的时间 t 默认取 time.time()；replay() 用于录制的序列，时间默认按 fps 由帧序号换算
+    """
+
+    def __init__(self, fps=30, closed_eye_threshold=0.27, mouth_threshold=0.6, min_valid_ear=0.2,
+                 smooth_frames=5, confirm_frames=2, min_blink_frames=2, max_blink_frames=7,
+                 min_yawn_frames=15, yawn_window=60, max_yawn_count=3, reset_interval=300, start_time=None):
+        self.fps = fps
+        self.CLOSED_EYE_THRESH = closed_eye_threshold  # 疲劳判定阈值（平滑后的EAR）
+        self.MOUTH_THRESH = mouth_threshold            # 哈欠阈值
+        self.MIN_VALID_EAR = min_valid_ear             # 最小有效EAR值，低于该值视为未检测到面部特征
+        self.EAR_HISTORY_LENGTH = smooth_frames        # EAR平滑帧数
+        self.EYE_CONFIRM_FRAMES = confirm_frames       # 睁眼/闭眼状态确认帧数
+        self.MIN_BLINK_FRAMES = min_blink_frames       # 最少闭眼帧数
+        self.MAX_BLINK_FRAMES = max_blink_frames       # 最大闭眼帧数
+        self.MIN_YAWN_FRAMES = min_yawn_frames         # 最少哈欠帧数
+        self.YAWN_INTERVAL = yawn_window               # 哈欠检测时间窗口（秒）
+        self.MAX_YAWN_COUNT = max_yawn_count           # 时间窗口内的哈欠次数阈值
+        self.RESET_INTERVAL = reset_interval           # 定期重置计数的间隔（秒），也是眨眼计数的时间窗口
+        self.ears = RingBuffer(smooth_frames)
+        self.blinks = EventWindow(reset_interval)
+        self.yawns = EventWindow(yawn_window)
+        self.reset(start_time)
+
+    def reset(self, start_time=None):
+        self.ears.clear()
+        self.blinks.clear()
+        self.yawns.clear()
+        self.closed_confirm = 0
+        self.open_confirm = 0
+        self.eye_closed = False
+        self.closed_frames = 0
+        self.yawn_frames = 0
+        self.total_blinks = 0
+        self.total_yawns = 0
+        self.last_reset_time = time.time() if start_time is None else start_time
+
+    def interrupt(self):
+        """画面处理出错或未检测到人脸：结束当前闭眼计数（保留平滑历史和计数窗口）"""
+        self.closed_frames = 0
+        self.eye_closed = False
+
+    def update(self, ear, mar, t=None):
+        """输入一帧的 EAR/MAR，返回 EngineState"""
+        t = time.time() if t is None else t
+
+        # 定期重置计数器
+        reset = t >= self.last_reset_time + self.RESET_INTERVAL
+        if reset:
+            self.blinks.clear()
+            self.yawns.clear()
+            self.last_reset_time = t
+
+        # 清理超出时间窗口的记录
+        self.blinks.expire(t)
+        self.yawns.expire(t)
+
+        if ear < self.MIN_VALID_EAR or ear == 0:
+            self.closed_confirm = 0
+            self.open_confirm = 0
+            self.closed_frames = 0
+            self.eye_closed = False
+            self.ears.clear()
+            return EngineState(False, ear, 0.0, mar, False, False, 0, self.yawn_frames, False, False,
+                               len(self.blinks), len(self.yawns), False, reset)
+
+        # 更新EAR历史记录和计算平均值
+        self.ears.push(ear)
+        avg_ear = self.ears.mean()
+
+        # 眼睛状态检测
+        closed_started = blink = False
+        if avg_ear <= self.CLOSED_EYE_THRESH:
+            self.closed_confirm += 1
+            self.open_confirm = 0
+            if self.closed_confirm >= self.EYE_CONFIRM_FRAMES:
+                if not self.eye_closed:
+                    self.closed_frames = 1
+                    self.eye_closed = True
+                    closed_started = True
+                else:
+                    self.closed_frames += 1
+        else:
+            self.open_confirm += 1
+            self.closed_confirm = 0
+            if self.open_confirm >= self.EYE_CONFIRM_FRAMES:
+                if self.eye_closed and self.MIN_BLINK_FRAMES <= self.closed_frames <= self.MAX_BLINK_FRAMES:
+                    self.blinks.add(t)
+                    self.total_blinks += 1
+                    blink = True
+                self.closed_frames = 0
+                self.eye_closed = False
+
+        # 哈欠检测
+        yawn = False
+        if mar > self.MOUTH_THRESH:
+            self.yawn_frames += 1
+        else:
+            if self.yawn_frames >= self.MIN_YAWN_FRAMES:
+                self.yawns.add(t)
+                self.total_yawns += 1
+                yawn = True
+            self.yawn_frames = 0
+
+        fatigue = avg_ear <= self.CLOSED_EYE_THRESH or len(self.yawns) >= self.MAX_YAWN_COUNT
+        return EngineState(True, ear, avg_ear, mar, self.eye_closed, closed_started, self.closed_frames,
+                           self.yawn_frames, blink, yawn, len(self.blinks), len(self.yawns), fatigue, reset)
+
+    def fatigue_signs(self, state):
+        """疲劳特征的文字说明"""
+        signs = []
+        if state.valid and state.avg_ear <= self.CLOSED_EYE_THRESH:
+            signs.append(f"EAR值过低({state.avg_ear:.3f})")
+        if state.yawns >= self.MAX_YAWN_COUNT:
+            signs.append(f"频繁哈欠({state.yawns}次/{self.YAWN_INTERVAL}秒)")
+        return signs
+
+    def replay(self, ear, mar, times=None):
+        """对整段 EAR/MAR 向量化重放，结果与从 reset(times[0]) 开始逐帧 update() 相同，不改变当前状态
+
+        平滑、连续帧计数和时间窗口计数都在数组上计算，只有睁眼/闭眼状态按游程（而不是按帧）推进；
+        返回 EngineState 各字段对应的数组字典
+        """
+        ear, mar = np.asarray(ear, dtype=np.float64), np.asarray(mar, dtype=np.float64)
+        n = len(ear)
+        times = np.arange(n) / self.fps if times is None else np.asarray(times, dtype=np.float64)
+        index = np.arange(n)
+        valid = (ear >= self.MIN_VALID_EAR) & (ear != 0)
+
+        # 平滑：无效帧清空历史，窗口为本段内最近 EAR_HISTORY_LENGTH 个有效值
+        segment_start = np.maximum.accumulate(np.where(valid, -1, index)) + 1
+        window_start = np.maximum(segment_start, index - self.EAR_HISTORY_LENGTH + 1)
+        csum = np.concatenate(([0.0], np.cumsum(np.where(valid, ear, 0.0))))
+        avg_ear = np.where(valid, (csum[index + 1] - csum[window_start]) / np.maximum(index + 1 - window_start, 1), 0.0)
+        closed = valid & (avg_ear <= self.CLOSED_EYE_THRESH)
+
+        # 睁眼/闭眼状态：按 无效/闭眼/睁眼 的游程推进
+        label = np.where(valid, np.where(closed, 1, 2), 0)
+        starts = np.flatnonzero(np.diff(label, prepend=-1))
+        ends = np.append(starts[1:], n)
+        eye_closed = np.zeros(n, dtype=bool)
+        closed_frames = np.zeros(n, dtype=np.int64)
+        closed_started = np.zeros(n, dtype=bool)
+        blink = np.zeros(n, dtype=bool)
+        state, counter, c = False, 0, self.EYE_CONFIRM_FRAMES
+        for s, e in zip(starts, ends):
+            kind = label[s]
+            if kind == 0:
+                state, counter = False, 0
+                continue
+            eye_closed[s:e], closed_frames[s:e] = state, counter
+            k = s + max(c, 1) - 1  # 本游程中达到确认帧数的位置
+            if k >= e:
+                continue
+            if kind == 1:
+                base = counter + 1 if state else 1
+                closed_started[k] = not state
+                closed_frames[k:e] = base + np.arange(e - k)
+                eye_closed[k:e] = True
+                state, counter = True, base + e - 1 - k
+            else:
+                blink[k] = state and self.MIN_BLINK_FRAMES <= counter <= self.MAX_BLINK_FRAMES
+                eye_closed[k:e], closed_frames[k:e] = False, 0
+                state, counter = False, 0
+
+        # 哈欠：张嘴帧数只在有效帧上累计，无效帧不打断
+        vi = np.flatnonzero(valid)
+        mouth_open = mar[vi] > self.MOUTH_THRESH
+        run = run_lengths(mouth_open)
+        yawn = np.zeros(n, dtype=bool)
+        yawn[vi[1:][~mouth_open[1:] & (run[:-1] >= self.MIN_YAWN_FRAMES)]] = True
+        yawn_frames = np.zeros(n, dtype=np.int64)
+        yawn_frames[vi] = run
+        last_valid = np.maximum.accumulate(np.where(valid, index, -1))  # 无效帧保持上一有效帧的值
+        yawn_frames = np.where(last_valid >= 0, yawn_frames[np.maximum(last_valid, 0)], 0)
+
+        # 定期重置的位置（只有重置次数次循环）
+        resets = np.zeros(n, dtype=bool)
+        last, i = times[0] if n else 0.0, 0
+        while n:
+            i = int(np.searchsorted(times, last + self.RESET_INTERVAL, side='left'))
+            if i >= n:
+                break
+            resets[i] = True
+            last = times[i]
+        reset_index = np.maximum.accumulate(np.where(resets, index, 0))
+
+        def window_counts(events, window):
+            csum = np.concatenate(([0], np.cumsum(events)))
+            lo = np.maximum(reset_index, np.searchsorted(times, times - window, side='left'))
+            return csum[index + 1] - csum[lo]
+
+        blinks = window_counts(blink, self.RESET_INTERVAL)
+        yawns = window_counts(yawn, self.YAWN_INTERVAL)
+        fatigue = valid & ((avg_ear <= self.CLOSED_EYE_THRESH) | (yawns >= self.MAX_YAWN_COUNT))
+        return {'valid': valid, 'ear': ear, 'avg_ear': avg_ear, 'mar': mar, 'eye_closed': eye_closed,
+                'closed_started': closed_started, 'closed_frames': closed_frames, 'yawn_frames': yawn_frames,
+                'blink': blink, 'yawn': yawn, 'blinks': blinks, 'yawns': yawns, 'fatigue': fatigue,
+                'reset': resets}
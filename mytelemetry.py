@@ -0,0 +1,146 @@
+# 逐帧遥测数据
+# 每帧的时间戳、EAR/MAR、是否检测到人脸和疲劳/打哈欠状态按列保存，
+# 每列是预先分配的内存映射 .npy 文件，长视频也不会占用额外内存；统计和报告直接在列上做向量化计算。
+# 每帧的68个关键点也可以保存在同一目录（shapes.npy），之后按需渲染标注视频时不必重新提取
+
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+TELEMETRY_DIR = os.environ.get('FATIGUE_TELEMETRY_DIR', os.path.join(tempfile.gettempdir(), 'fatigue_telemetry'))
+TELEMETRY_KEEP = 50  # 最多保留最近多少个任务的遥测目录
+
+COLUMNS = {
+    'timestamp': np.float64,      # 秒
+    'ear': np.float64,
+    'mar': np.float64,
+    'found': np.bool_,            # 是否检测到人脸
+    'fatigue': np.bool_,          # 疲劳已确认（连续帧数达到要求）
+    'yawn': np.bool_,             # 打哈欠已确认
+    'fatigue_event': np.bool_,    # 本帧记录了新的疲劳事件
+    'yawn_event': np.bool_,       # 本帧记录了新的打哈欠事件
+}
+
+
+def new_job_dir(prefix='job'):
+    """创建新的任务遥测目录，并清理超出保留数量的旧目录"""
+    os.makedirs(TELEMETRY_DIR, exist_ok=True)
+    old = sorted((e for e in os.scandir(TELEMETRY_DIR) if e.is_dir()), key=lambda e: e.stat().st_mtime)
+    for entry in old[:max(0, len(old) - TELEMETRY_KEEP + 1)]:
+        shutil.rmtree(entry.path, ignore_errors=True)
+    return tempfile.mkdtemp(prefix=f'{prefix}_{int(time.time())}_', dir=TELEMETRY_DIR)
+
+
+class TelemetryStore:
+    """按列保存的逐帧数据，列为内存映射的 .npy 文件，容量不足时按倍数扩容"""
+
+    def __init__(self, path, fps, capacity=0, mode='w+'):
+        self.path = path
+        self.fps = fps
+        self.n = 0
+        self.columns = {}
+        if mode == 'r':
+            with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+            self.fps, self.n = meta['fps'], meta['frames']
+            for name in COLUMNS:
+                self.columns[name] = np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+        else:
+            os.makedirs(path, exist_ok=True)
+            self._allocate(max(int(capacity), 1024))
+
+    @classmethod
+    def open(cls, path):
+        """只读打开已保存的遥测目录"""
+        return cls(path, fps=None, mode='r')
+
+    def _allocate(self, capacity):
+        for name, dtype in COLUMNS.items():
+            file = os.path.join(self.path, f'{name}.npy')
+            old = self.columns.get(name)
+            if old is not None:
+                # 扩容：旧数据读入内存后重建更大的文件
+                data = np.array(old[:self.n])
+                del self.columns[name], old
+            column = np.lib.format.open_memmap(file, mode='w+', dtype=dtype, shape=(capacity,))
+            if self.n:
+                column[:self.n] = data
+            self.columns[name] = column
+        self.capacity = capacity
+
+    def append(self, timestamp, ear, mar, found, state=None):
+        """写入一帧；state 为 mystate.FrameState"""
+        if self.n >= self.capacity:
+            self._allocate(self.capacity * 2)
+        i = self.n
+        c = self.columns
+        c['timestamp'][i] = timestamp
+        c['ear'][i] = ear
+        c['mar'][i] = mar
+        c['found'][i] = found
+        if state is not None:
+            c['fatigue'][i] = state.fatigue_confirmed
+            c['yawn'][i] = state.yawn_confirmed
+            c['fatigue_event'][i] = state.fatigue_logged
+            c['yawn_event'][i] = state.yawn_logged
+        self.n += 1
+
+    def extend(self, timestamps, ear, mar, found, states=None):
+        """批量写入多帧；states 为 EventDetector.replay() 的结果"""
+        n = len(timestamps)
+        if self.n + n > self.capacity:
+            self._allocate(max(self.capacity * 2, self.n + n))
+        rows = slice(self.n, self.n + n)
+        c = self.columns
+        c['timestamp'][rows] = timestamps
+        c['ear'][rows] = ear
+        c['mar'][rows] = mar
+        c['found'][rows] = found
+        if states is not None:
+            c['fatigue'][rows] = states['fatigue_confirmed']
+            c['yawn'][rows] = states['yawn_confirmed']
+            c['fatigue_event'][rows] = states['fatigue_logged']
+            c['yawn_event'][rows] = states['yawn_logged']
+        self.n += n
+
+    def save_landmarks(self, shapes):
+        """保存每帧的关键点 (N, 68, 2)"""
+        np.save(os.path.join(self.path, 'shapes.npy'), np.asarray(shapes, dtype=np.int32))
+
+    def landmarks(self):
+        """已保存的关键点（内存映射），没有保存时返回 None"""
+        file = os.path.join(self.path, 'shapes.npy')
+        return np.load(file, mmap_mode='r') if os.path.exists(file) else None
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, name):
+        """已写入部分的列（内存映射视图）"""
+        return self.columns[name][:self.n]
+
+    def flush(self):
+        for column in self.columns.values():
+            if isinstance(column, np.memmap):
+                column.flush()
+        with open(os.path.join(self.path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'fps': self.fps, 'frames': self.n, 'columns': list(COLUMNS)}, f)
+
+    def events(self, kind):
+        """'fatigue' / 'yawn' 事件所在的帧序号"""
+        return np.flatnonzero(self[f'{kind}_event'])
+
+    def export_parquet(self, file=None):
+        """导出为 Parquet 文件（需要安装 pyarrow），返回文件路径"""
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("导出 Parquet 需要安装 pyarrow: pip install pyarrow")
+        file = file or os.path.join(self.path, 'telemetry.parquet')
+        pq.write_table(pa.table({name: np.asarray(self[name]) for name in COLUMNS}), file)
+        return file
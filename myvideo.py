@@ -0,0 +1,523 @@
+# 离线视频分析引擎
+# 关键点提取在进程池中按帧区间并行执行，结果按帧序拼接成 EAR/MAR 序列后，
+# 再由 EventDetector（mystate.py）运行连续帧计数、最小间隔等时序逻辑
+
+import math
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+import myfatigue
+from mystate import EventDetector, FrameState, state_at  # noqa: F401  兼容原来从 myvideo 导入
+
+# 少于该帧数的视频直接串行处理，进程池启动和模型加载的开销不划算
+MIN_PARALLEL_FRAMES = 600
+# 每个任务区间的最小帧数，区间太短时每次 seek 的解码开销占比过高
+MIN_CHUNK_FRAMES = 150
+# 解码/编码线程与分析阶段之间的队列长度
+PIPELINE_QUEUE_SIZE = 8
+# 自适应抽帧：最大分析间隔（帧），以及相对阈值的安全距离
+SAMPLE_MAX_STEP = 8
+SAMPLE_MARGIN = 0.15
+# 按需渲染事件片段时，事件前后各保留的秒数
+EVENT_PAD_BEFORE = 2.0
+EVENT_PAD_AFTER = 3.0
+
+
+def draw_overlay(frame, state, detector, frame_index, total_frames, fps, current_time=None):
+    """在画面上绘制状态文字、连续帧计数和时间戳
+
+    total_frames 为 None 时（实时流）只显示帧序号；current_time 默认按 fps 由帧序号换算
+    """
+    height = frame.shape[0]
+    if state.fatigue_confirmed:
+        cv2.putText(frame, "FATIGUE DETECTED!", (10, 100),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 3)
+    if state.yawn_confirmed:
+        cv2.putText(frame, "YAWNING DETECTED!", (10, 140),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 165, 255), 3)
+    if state.status_text == "正常状态":
+        cv2.putText(frame, "NORMAL", (10, 100),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 3)
+
+    # 显示连续帧计数（用于调试）
+    if state.fatigue_count > 0:
+        cv2.putText(frame, f"Fatigue frames: {state.fatigue_count}/{detector.FATIGUE_CONSEC_FRAMES}",
+                    (10, 180), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 0), 1)
+    if state.yawn_count > 0:
+        cv2.putText(frame, f"Yawn frames: {state.yawn_count}/{detector.YAWN_CONSEC_FRAMES}",
+                    (10, 200), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 0), 1)
+
+    # 添加时间戳
+    if current_time is None:
+        current_time = frame_index / fps
+    frame_text = f"{frame_index}" if total_frames is None else f"{frame_index}/{total_frames}"
+    timestamp_text = f"Time: {current_time:.1f}s Frame: {frame_text}"
+    cv2.putText(frame, timestamp_text, (10, height-20),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+    return frame
+
+
+class LandmarkSeries:
+    """按帧序排列的关键点提取结果"""
+
+    def __init__(self, ear, mar, found, shapes, sampled=None):
+        self.ear = ear          # (N,) float64
+        self.mar = mar          # (N,) float64
+        self.found = found      # (N,) bool，是否检测到人脸
+        self.shapes = shapes    # (N, 68, 2) int32，未检测到人脸的帧为0
+        self.sampled = sampled  # (N,) bool，实际做了关键点检测的帧（其余为插值），None 表示逐帧分析
+
+    def __len__(self):
+        return len(self.ear)
+
+    @property
+    def sampling_rate(self):
+        """实际分析的帧数占比"""
+        return 1.0 if self.sampled is None or len(self.sampled) == 0 else float(self.sampled.mean())
+
+    def shape(self, index):
+        """第 index 帧的关键点，未检测到人脸时返回 None"""
+        return self.shapes[index] if self.found[index] else None
+
+    @classmethod
+    def from_shapes(cls, shapes, found, sampled=None):
+        """由关键点数组一次性向量化计算整段的 EAR/MAR"""
+        ear, mar, valid = myfatigue.aspect_ratios(shapes, found)
+        return cls(ear, mar, valid, shapes, sampled)
+
+
+class AdaptiveSampler:
+    """自适应抽帧：EAR/MAR 平稳且远离阈值时逐步拉大分析间隔（最多 max_step 帧），
+    接近阈值、变化较快或人脸出现/消失时退回逐帧分析，跳过的帧由前后两个采样帧的关键点线性插值
+
+    max_step 不超过疲劳/打哈欠的确认帧数，所以持续到确认帧数的闭眼或哈欠一定会落到某个采样帧上；
+    采样帧接近阈值时，上一个采样帧之后跳过的帧全部补做关键点检测，事件判定与逐帧分析基本一致
+    """
+
+    def __init__(self, ear_threshold=0.3, mar_threshold=0.5, max_step=SAMPLE_MAX_STEP, margin=SAMPLE_MARGIN):
+        self.ear_threshold = ear_threshold
+        self.mar_threshold = mar_threshold
+        self.max_step = max(1, max_step)
+        self.margin = margin  # 相对阈值的安全距离，同时作为相邻采样帧间允许的变化量
+
+    @classmethod
+    def for_detector(cls, detector, max_step=SAMPLE_MAX_STEP, margin=SAMPLE_MARGIN):
+        """按 EventDetector 的阈值和确认帧数创建"""
+        max_step = min(max_step, detector.FATIGUE_CONSEC_FRAMES, detector.YAWN_CONSEC_FRAMES)
+        return cls(detector.EAR_THRESHOLD, detector.MAR_THRESHOLD, max_step, margin)
+
+    def near(self, shape, ear, mar):
+        """检测到人脸且 EAR/MAR 接近或越过阈值"""
+        return shape is not None and (ear < self.ear_threshold * (1 + self.margin) or
+                                      mar > self.mar_threshold * (1 - self.margin))
+
+    def stable(self, a, b):
+        """两个采样帧 (位置, shape, ear, mar) 之间是否可以插值"""
+        _, shape_a, ear_a, mar_a = a
+        _, shape_b, ear_b, mar_b = b
+        if (shape_a is None) != (shape_b is None):
+            return False
+        if shape_a is None:
+            return True
+        return (not self.near(shape_a, ear_a, mar_a) and not self.near(shape_b, ear_b, mar_b) and
+                abs(ear_a - ear_b) <= self.ear_threshold * self.margin and
+                abs(mar_a - mar_b) <= self.mar_threshold * self.margin)
+
+    def next_step(self, step, stable):
+        return min(step * 2, self.max_step) if stable else 1
+
+
+def replay_events(series, detector):
+    """对已提取的 EAR/MAR 序列重放时序逻辑（向量化），返回 (疲劳事件帧列表, 打哈欠事件帧列表)"""
+    result = detector.replay(series.ear, series.mar)
+    return np.flatnonzero(result['fatigue_logged']).tolist(), np.flatnonzero(result['yawn_logged']).tolist()
+
+
+def compare_series(reference, series, detector, tolerance=2):
+    """抽帧结果与逐帧结果对比：EAR/MAR 平均绝对误差、人脸检出一致率，
+    以及重放时序逻辑后的事件数和相差不超过 tolerance 帧的事件匹配率"""
+    n = min(len(reference), len(series))
+    both = reference.found[:n] & series.found[:n]
+
+    def matched(a, b):
+        return sum(any(abs(i - j) <= tolerance for j in b) for i in a)
+
+    ref_fatigue, ref_yawn = replay_events(reference, detector)
+    fatigue, yawn = replay_events(series, detector)
+    ref_events = len(ref_fatigue) + len(ref_yawn)
+    return {
+        'sampling_rate': series.sampling_rate,
+        'ear_mae': float(np.abs(reference.ear[:n] - series.ear[:n])[both].mean()) if both.any() else 0.0,
+        'mar_mae': float(np.abs(reference.mar[:n] - series.mar[:n])[both].mean()) if both.any() else 0.0,
+        'found_agreement': float((reference.found[:n] == series.found[:n]).mean()) if n else 1.0,
+        'fatigue_events': (len(ref_fatigue), len(fatigue)),
+        'yawn_events': (len(ref_yawn), len(yawn)),
+        'event_recall': (matched(ref_fatigue, fatigue) + matched(ref_yawn, yawn)) / ref_events if ref_events else 1.0,
+    }
+
+
+class FramePool:
+    """预分配的帧缓冲区，解码线程从中取空闲缓冲区，编码完成后归还"""
+
+    def __init__(self, count, shape, dtype=np.uint8):
+        self.free = queue.Queue()
+        for _ in range(count):
+            self.free.put(np.empty(shape, dtype=dtype))
+
+
+class VideoPipeline:
+    """解码线程 -> 调用线程中的分析/绘制 -> 编码线程
+
+    阶段之间用有界队列连接，帧缓冲区在三个阶段之间循环复用，不为每帧分配新图像；
+    结束后 report() 给出各阶段耗时和队列平均占用
+    """
+
+    def __init__(self, cap, writer, queue_size=PIPELINE_QUEUE_SIZE):
+        self.cap = cap
+        self.writer = writer
+        self.queue_size = queue_size
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        # 两个队列各自装满，再加上解码、分析、编码中各一帧
+        self.pool = FramePool(2 * queue_size + 3, (height, width, 3))
+        self.decoded = queue.Queue(queue_size)
+        self.encoded = queue.Queue(queue_size)
+        self.stop_event = threading.Event()
+        self.errors = []
+        self.times = {'解码': 0.0, '分析': 0.0, '编码': 0.0}
+        self.occupancy = {'解码→分析': [], '分析→编码': []}
+        self.frames = 0
+        self.wall_time = 0.0
+
+    def _put(self, q, item):
+        while not self.stop_event.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        """取出一项，收到结束标记或流水线被中止时返回 None"""
+        while not self.stop_event.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+
+    def _decode(self):
+        index = 0
+        try:
+            while True:
+                buf = self._get(self.pool.free)
+                if buf is None:
+                    break
+                t = time.perf_counter()
+                ret, frame = self.cap.read(buf)
+                self.times['解码'] += time.perf_counter() - t
+                if not ret:
+                    self.pool.free.put(buf)
+                    break
+                if frame is not buf:
+                    # 尺寸与缓冲区不一致时 OpenCV 会新分配图像，缓冲区直接归还
+                    self.pool.free.put(buf)
+                    buf = None
+                if not self._put(self.decoded, (index, frame, buf)):
+                    break
+                index += 1
+        except Exception as e:
+            self.errors.append(e)
+        finally:
+            self._put(self.decoded, None)  # 结束标记
+
+    def _encode(self):
+        try:
+            while True:
+                item = self._get(self.encoded)
+                if item is None:
+                    break
+                frame, buf = item
+                t = time.perf_counter()
+                self.writer.write(frame)
+                self.times['编码'] += time.perf_counter() - t
+                if buf is not None:
+                    self.pool.free.put(buf)
+        except Exception as e:
+            self.errors.append(e)
+            self.stop_event.set()
+
+    def run(self, process_fn):
+        """process_fn(index, frame) -> 要写入的帧（可直接在 frame 上绘制后返回）"""
+        t0 = time.perf_counter()
+        decoder = threading.Thread(target=self._decode, daemon=True, name='video-decode')
+        encoder = threading.Thread(target=self._encode, daemon=True, name='video-encode')
+        decoder.start()
+        encoder.start()
+        try:
+            while True:
+                self.occupancy['解码→分析'].append(self.decoded.qsize())
+                self.occupancy['分析→编码'].append(self.encoded.qsize())
+                item = self._get(self.decoded)
+                if item is None:
+                    break
+                index, frame, buf = item
+                t = time.perf_counter()
+                out = process_fn(index, frame)
+                self.times['分析'] += time.perf_counter() - t
+                self.frames += 1
+                if not self._put(self.encoded, (out, buf)):
+                    break
+            self._put(self.encoded, None)
+            encoder.join()
+        finally:
+            # 分析阶段出错时中止另外两个线程
+            self.stop_event.set()
+            decoder.join()
+            encoder.join()
+            self.wall_time = time.perf_counter() - t0
+        if self.errors:
+            raise self.errors[0]
+        return self
+
+    def report(self):
+        stages = ", ".join(f"{k} {v:.1f}s" for k, v in self.times.items())
+        queues = ", ".join(f"{k} {np.mean(v) if v else 0:.1f}/{self.queue_size}"
+                           for k, v in self.occupancy.items())
+        fps = self.frames / self.wall_time if self.wall_time > 0 else 0.0
+        return (f"流水线: {self.frames} 帧, 总耗时 {self.wall_time:.1f}s ({fps:.1f} fps); "
+                f"各阶段耗时: {stages}; 队列平均占用: {queues}")
+
+
+def _open_at(path, start):
+    """打开视频并定位到第 start 帧"""
+    cap = cv2.VideoCapture(path)
+    if start > 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+        if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) != start:
+            # 部分编码格式不支持精确定位，退回到从头逐帧跳过
+            cap.release()
+            cap = cv2.VideoCapture(path)
+            for _ in range(start):
+                if not cap.grab():
+                    break
+    return cap
+
+
+def _init_worker():
+    # 每个进程单线程运行 OpenCV，避免与进程池争抢 CPU
+    cv2.setNumThreads(1)
+
+
+def _sample_frames(cap, start, end, sampler, shapes, sampled):
+    """按 sampler 抽帧分析，结果写入 shapes/sampled 列表（shape 为 None 表示未检测到人脸）"""
+    pending = []  # 上一个采样帧之后跳过的 (位置, 帧)
+    last = None   # 上一个采样帧的 (位置, shape, ear, mar)
+    step = 1
+    index = start
+    while end is None or index < end:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        pos = index - start
+        index += 1
+        shapes.append(None)
+        sampled.append(False)
+        if last is not None and pos - last[0] < step:
+            pending.append((pos, frame))
+            continue
+
+        shape, ear, mar = myfatigue.analyse(frame)
+        current = (pos, shape, ear, mar)
+        shapes[pos], sampled[pos] = shape, True
+        stable = last is not None and sampler.stable(last, current)
+        if stable and shape is not None:
+            # 前后采样帧都平稳且远离阈值：跳过的帧按关键点线性插值
+            for p, _ in pending:
+                w = (p - last[0]) / (pos - last[0])
+                shapes[p] = np.rint(last[1] + (shape - last[1]) * w).astype(np.int32)
+        elif not stable:
+            # 接近阈值或有变化：跳过的帧全部补做分析
+            for p, f in pending:
+                shapes[p] = myfatigue.analyse(f)[0]
+                sampled[p] = True
+        pending = []
+        last = current
+        step = sampler.next_step(step, stable)
+
+    # 结尾跳过的帧没有后一个采样帧可以插值，补做分析
+    for p, f in pending:
+        shapes[p] = myfatigue.analyse(f)[0]
+        sampled[p] = True
+
+
+def _extract_shapes(path, start, end=None, sampler=None):
+    """提取 [start, end) 区间每帧的关键点，返回 (shapes, found, sampled)；end 为 None 时读到视频结尾
+
+    sampler: 可选的 AdaptiveSampler，为 None 时逐帧分析
+    """
+    cap = _open_at(path, start)
+    shapes, sampled = [], []
+    index = start
+    try:
+        if sampler is not None:
+            _sample_frames(cap, start, end, sampler, shapes, sampled)
+        else:
+            while end is None or index < end:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                shapes.append(myfatigue.analyse(frame)[0])
+                sampled.append(True)
+                index += 1
+    finally:
+        cap.release()
+
+    found = np.asarray([shape is not None for shape in shapes], dtype=bool)
+    shapes = [shape if shape is not None else np.zeros((68, 2), dtype=np.int32) for shape in shapes]
+    return (np.asarray(shapes, dtype=np.int32).reshape(-1, 68, 2), found,
+            np.asarray(sampled, dtype=bool))
+
+
+def extract_range(path, start, end=None, sampler=None):
+    """提取 [start, end) 区间每帧的关键点和 EAR/MAR"""
+    shapes, found, sampled = _extract_shapes(path, start, end, sampler)
+    return LandmarkSeries.from_shapes(shapes, found, sampled if sampler is not None else None)
+
+
+def split_ranges(total_frames, workers):
+    """把 [0, total_frames) 切成若干区间，最后一个区间读到视频结尾"""
+    n_chunks = max(1, min(workers * 4, total_frames // MIN_CHUNK_FRAMES))
+    size = math.ceil(total_frames / n_chunks)
+    ranges = [(start, start + size) for start in range(0, total_frames, size)]
+    ranges[-1] = (ranges[-1][0], None)
+    return ranges
+
+
+def analyse_video(path, workers=None, progress=None, sampler=None):
+    """多进程提取整段视频的关键点，返回按帧序拼接的 LandmarkSeries
+
+    progress: 可选回调 progress(done_chunks, total_chunks)
+    sampler: 可选的 AdaptiveSampler，各区间分别自适应抽帧
+    """
+    workers = workers or os.cpu_count() or 1
+    cap = cv2.VideoCapture(path)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    if workers <= 1 or total_frames < MIN_PARALLEL_FRAMES:
+        return extract_range(path, 0, sampler=sampler)
+
+    t = time.time()
+    ranges = split_ranges(total_frames, workers)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = [pool.submit(_extract_shapes, path, start, end, sampler) for start, end in ranges]
+        parts = []
+        for i, future in enumerate(futures):
+            parts.append(future.result())
+            if progress is not None:
+                progress(i + 1, len(futures))
+    # 定位不准或帧数估计偏大时区间会少帧，拼接后帧序错位；此时退回单进程从头顺序提取
+    short = [(start, end, len(part[0])) for (start, end), part in zip(ranges[:-1], parts)
+             if len(part[0]) != end - start]
+    if short:
+        start, end, got = short[0]
+        print(f"区间 [{start}, {end}) 只读到 {got} 帧，改为单进程顺序提取关键点")
+        return extract_range(path, 0, sampler=sampler)
+    # 拼接后对整段一次性向量化计算 EAR/MAR
+    series = LandmarkSeries.from_shapes(np.concatenate([p[0] for p in parts]),
+                                        np.concatenate([p[1] for p in parts]),
+                                        np.concatenate([p[2] for p in parts]) if sampler is not None else None)
+    dt = time.time() - t
+    print(f"关键点提取完成: {len(series)} 帧, {workers} 进程, {dt:.1f}s ({len(series) / max(dt, 1e-6):.1f} fps), "
+          f"采样率 {series.sampling_rate * 100:.1f}%")
+    return series
+
+
+def open_writer(path, fps, size):
+    """创建输出视频，依次尝试 H264 / XVID / MP4V 编码器，都不可用时返回 None"""
+    for codec in ('H264', 'XVID', 'mp4v'):
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*codec), fps, size)
+        if writer.isOpened():
+            return writer
+        writer.release()
+    return None
+
+
+def merge_ranges(ranges, total_frames):
+    """把 [起始帧, 结束帧) 区间裁剪到 [0, total_frames) 内，按起点排序并合并重叠或相邻的区间"""
+    merged = []
+    for start, end in sorted((max(0, int(s)), min(total_frames, int(e))) for s, e in ranges):
+        if start >= end:
+            continue
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(r) for r in merged]
+
+
+def event_windows(events, fps, total_frames, before=EVENT_PAD_BEFORE, after=EVENT_PAD_AFTER, merge=True):
+    """事件帧前后各扩展 before/after 秒得到的帧区间；merge=False 时每个事件一个区间（不合并，仅裁剪）"""
+    windows = [(i - round(before * fps), i + round(after * fps) + 1) for i in events]
+    if merge:
+        return merge_ranges(windows, total_frames)
+    return [(max(0, int(s)), min(total_frames, int(e))) for s, e in windows]
+
+
+def render_ranges(path, series, detector, ranges, writer, total_frames=None, fps=30, progress=None,
+                  clips=(), open_clip=None):
+    """只解码 ranges 中的帧区间，用已保存的关键点和重放的时序状态绘制标注后写入 writer
+
+    series: 整段视频的 LandmarkSeries；ranges: [起始帧, 结束帧) 列表（应已合并）
+    progress: 可选回调 progress(done_frames, total_frames)
+    clips: 可选的 (起始帧, 结束帧, 输出路径) 列表，区间须落在 ranges 内；每帧只绘制一次，
+           同时写入 writer 和覆盖该帧的各个片段，片段的 writer 由 open_clip(路径) 在用到时才创建
+    返回写入 writer 的帧数
+    """
+    result = detector.replay(series.ear, series.mar)
+    total_frames = total_frames or len(series)
+    todo = sum(end - start for start, end in ranges)
+    pending = sorted(clips)  # 尚未开始的片段
+    active = []              # [结束帧, writer]
+    written = 0
+    try:
+        for start, end in ranges:
+            cap = _open_at(path, start)
+            try:
+                for index in range(start, min(end, len(series))):
+                    ret, frame = cap.read()
+                    if not ret:
+                        break
+                    shape = series.shape(index)
+                    if shape is not None:
+                        myfatigue.draw_landmarks(frame, shape, series.ear[index], series.mar[index])
+                    draw_overlay(frame, state_at(result, index), detector, index, total_frames, fps)
+                    writer.write(frame)
+                    written += 1
+
+                    while pending and pending[0][0] <= index:
+                        clip_start, clip_end, clip_path = pending.pop(0)
+                        if clip_end > index:
+                            active.append([clip_end, open_clip(clip_path)])
+                    for clip in active:
+                        clip[1].write(frame)
+                    for clip in [c for c in active if c[0] <= index + 1]:
+                        clip[1].release()
+                        active.remove(clip)
+
+                    if progress is not None and written % 10 == 0:
+                        progress(written, todo)
+            finally:
+                cap.release()
+    finally:
+        for _, clip_writer in active:
+            clip_writer.release()
+    return written
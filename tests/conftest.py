@@ -0,0 +1,27 @@
+"""测试公用设置：把仓库根目录加入 sys.path，测试可以直接导入顶层模块；以及公用的模拟数据"""
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+
+def synthetic_predictions(batch, anchors=25200, nc=4, objects=20, seed=0):
+    """模拟YOLO解码输出 (batch, anchors, 5+nc)：框聚集在若干目标附近，并包含完全重复的框和相同的分数"""
+    import torch
+
+    g = torch.Generator().manual_seed(seed)
+    pred = torch.zeros(batch, anchors, 5 + nc)
+    centers = torch.rand(batch, objects, 2, generator=g) * 600 + 20
+    sizes = torch.rand(batch, objects, 2, generator=g) * 150 + 10
+    obj = torch.randint(0, objects, (batch, anchors), generator=g)
+    pick = lambda t: torch.gather(t, 1, obj[..., None].expand(-1, -1, 2))
+    pred[..., 0:2] = pick(centers) + torch.randn(batch, anchors, 2, generator=g) * 4
+    pred[..., 2:4] = pick(sizes) * (1 + torch.randn(batch, anchors, 2, generator=g) * 0.1)
+    pred[..., 4] = torch.sigmoid(torch.randn(batch, anchors, generator=g) * 2 - 6)  # 大多数锚框没有目标
+    pred[..., 5:] = torch.rand(batch, anchors, nc, generator=g)
+    pred[:, 1::97] = pred[:, ::97][:, :pred[:, 1::97].shape[1]]  # 重复的框
+    pred[..., 4:] = (pred[..., 4:] * 256).round() / 256  # 量化分数，制造相同分数
+    return pred
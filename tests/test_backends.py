@@ -0,0 +1,101 @@
+"""YOLO推理后端一致性：ONNX Runtime / OpenVINO 与 PyTorch 在固定输入上的 predict() 结果和原始输出
+
+缺少推理库或模型文件时跳过；耗时对比见 benchmark.py detect
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from conftest import ROOT
+
+torch = pytest.importorskip('torch')
+cv2 = pytest.importorskip('cv2')
+
+CONF_THRES = 0.001    # 降低置信度阈值，让固定输入上也有足够多的框参与比较
+SCORE_TOL = 1e-3      # 置信度/原始分数的最大差
+RAW_BOX_TOL = 0.05    # 原始输出框坐标（输入像素）的最大差
+BOX_TOL = 0.5         # predict() 映射回原图后的框坐标最大差（像素）
+
+
+def _box_diff(a, b):
+    return float(np.abs(np.asarray(a, dtype=float) - np.asarray(b, dtype=float)).max())
+
+
+def fixed_frames(n=4):
+    """仓库中的示例视频存在时取其前 n 帧，否则生成固定的合成画面"""
+    cap = cv2.VideoCapture(str(ROOT / 'video' / '1.mp4'))
+    frames = []
+    while cap.isOpened() and len(frames) < n:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    rng = np.random.default_rng(0)
+    while len(frames) < n:
+        frame = np.full((480, 640, 3), rng.integers(40, 200, 3), dtype=np.uint8)
+        for _ in range(6):
+            center = tuple(int(v) for v in rng.integers(60, 420, 2))
+            axes = tuple(int(v) for v in rng.integers(15, 80, 2))
+            cv2.ellipse(frame, center, axes, 0, 0, 360, tuple(int(v) for v in rng.integers(0, 255, 3)), -1)
+        frames.append(cv2.GaussianBlur(frame, (5, 5), 0))
+    return frames
+
+
+@pytest.fixture(scope='module')
+def mydetect():
+    for name in ('best.pt', 'best.onnx'):
+        if not (ROOT / 'weights' / name).exists():
+            pytest.skip(f"缺少模型文件 weights/{name}")
+    cwd = os.getcwd()
+    os.chdir(ROOT)  # 模型路径相对于仓库根目录
+    try:
+        import mydetect
+        yield mydetect
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture(scope='module')
+def reference(mydetect):
+    return mydetect.TorchBackend(device='cpu')
+
+
+@pytest.fixture(params=['onnx', 'openvino'])
+def backend(request, mydetect, monkeypatch):
+    pytest.importorskip({'onnx': 'onnxruntime', 'openvino': 'openvino'}[request.param])
+    monkeypatch.setattr(mydetect, 'opt_int8', False)  # 与 FP32 的 PyTorch 模型比较
+    monkeypatch.setattr(mydetect, 'opt_conf_thres', CONF_THRES)
+    return mydetect.create_backend(request.param)
+
+
+def test_raw_outputs_match(mydetect, reference, backend):
+    size = mydetect._input_size(backend, None)
+    for frame in fixed_frames():
+        img = mydetect.preprocess(frame, size)
+        ref = reference(img).float().cpu().numpy()
+        out = backend(img).float().cpu().numpy()
+        assert out.shape == ref.shape
+        assert np.abs(ref[..., :4] - out[..., :4]).max() < RAW_BOX_TOL
+        assert np.abs(ref[..., 4:] - out[..., 4:]).max() < SCORE_TOL
+
+
+def test_predict_matches(mydetect, reference, backend):
+    # 固定输入尺寸的导出模型按其尺寸推理，参考后端也使用同一尺寸
+    size = backend.fixed_size[0] if backend.fixed_size is not None else None
+    detections = 0
+    for frame in fixed_frames():
+        ref = mydetect.predict(frame, size, reference)
+        out = mydetect.predict(frame, size, backend)
+        assert len(out) == len(ref)
+        # 分数几乎相同的框排序可能不同，按标签和位置配对后比较
+        for label, conf_r, box_r in ref:
+            same = [(conf, box) for l, conf, box in out if l == label]
+            assert same, f"{label} 只出现在 PyTorch 结果中"
+            conf_o, box_o = min(same, key=lambda c: _box_diff(box_r, c[1]))
+            assert _box_diff(box_r, box_o) < BOX_TOL
+            assert abs(conf_r - conf_o) < SCORE_TOL
+        detections += len(ref)
+    assert detections > 0, "固定输入上没有检测结果，无法比较"
@@ -0,0 +1,76 @@
+"""关键点缓存复用：逐帧提取的关键点在修改阈值后重新检测时直接复用，不再重新提取"""
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+pytest.importorskip('dlib')
+cv2 = pytest.importorskip('cv2')
+
+import myanalysis  # noqa: E402
+from mycache import LandmarkCache  # noqa: E402
+from myvideo import LandmarkSeries  # noqa: E402
+
+FRAMES = 12
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = str(tmp_path / 'clip.avi')
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 30, (64, 48))
+    for i in range(FRAMES):
+        writer.write(np.full((48, 64, 3), i * 10, dtype=np.uint8))
+    writer.release()
+    return path
+
+
+@pytest.fixture
+def extractions(monkeypatch):
+    """替换关键点提取，记录每次调用的 sampler"""
+    calls = []
+
+    def fake_analyse_video(path, workers=None, progress=None, sampler=None):
+        calls.append(sampler)
+        rng = np.random.default_rng(0)
+        shapes = rng.integers(100, 200, (FRAMES, 68, 2)).astype(np.int32)
+        return LandmarkSeries.from_shapes(shapes, np.ones(FRAMES, dtype=bool))
+
+    monkeypatch.setattr(myanalysis, 'analyse_video', fake_analyse_video)
+    monkeypatch.setattr(myanalysis.myfatigue, 'get_face_detector', lambda: SimpleNamespace(name='test'))
+    return calls
+
+
+def analyse(video, tmp_path, cache, run, **kwargs):
+    return myanalysis.analyse_file(video, cache=cache, telemetry_dir=str(tmp_path / f'telemetry{run}'), **kwargs)
+
+
+def test_default_is_full_rate(video, tmp_path, extractions):
+    analysis, _ = analyse(video, tmp_path, None, 0)
+    assert extractions == [None]
+    assert analysis.sampling_rate == 1.0
+
+
+def test_full_rate_extraction_reused_after_threshold_change(video, tmp_path, extractions):
+    cache = LandmarkCache(root=str(tmp_path / 'cache'))
+    first, series = analyse(video, tmp_path, cache, 1, params={'ear_threshold': 0.3, 'mar_threshold': 0.5})
+    assert len(extractions) == 1 and not first.from_cache
+
+    second, cached = analyse(video, tmp_path, cache, 2, params={'ear_threshold': 0.25, 'mar_threshold': 0.7,
+                                                                'fatigue_consec_frames': 3})
+    assert len(extractions) == 1 and second.from_cache
+    assert second.detector.EAR_THRESHOLD == 0.25
+    np.testing.assert_array_equal(cached.shapes, series.shapes)
+
+    # 开启自适应抽帧时优先使用已有的逐帧结果
+    third, _ = analyse(video, tmp_path, cache, 3, adaptive=True)
+    assert len(extractions) == 1 and third.from_cache
+
+
+def test_adaptive_extraction_keyed_on_thresholds(video, tmp_path, extractions):
+    cache = LandmarkCache(root=str(tmp_path / 'cache'))
+    analyse(video, tmp_path, cache, 1, adaptive=True)
+    analyse(video, tmp_path, cache, 2, adaptive=True)
+    assert len(extractions) == 1
+    analyse(video, tmp_path, cache, 3, adaptive=True, params={'ear_threshold': 0.25})
+    assert len(extractions) == 2 and extractions[-1] is not None
@@ -0,0 +1,90 @@
+"""batched_non_max_suppression 与逐图 non_max_suppression 的一致性：每张图像的检测结果必须逐项完全相等
+
+Usage:
+    $ python -m pytest tests/test_nms.py -q
+"""
+
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from conftest import synthetic_predictions  # noqa: E402
+from utils.general import batched_non_max_suppression, non_max_suppression  # noqa: E402
+
+MAX_BATCHED = 5000  # 与 batched_non_max_suppression 中的 max_batched 相同
+
+
+def assert_same(pred, conf, classes=None, agnostic=False, iou=0.45):
+    ref = non_max_suppression(pred.clone(), conf, iou, classes, agnostic)
+    out = batched_non_max_suppression(pred.clone(), conf, iou, classes, agnostic)
+    assert len(out) == len(ref) == pred.shape[0]
+    for i, (a, b) in enumerate(zip(ref, out)):
+        assert torch.equal(a, b), f"image {i}: {a.shape[0]} vs {b.shape[0]} detections"
+
+
+@pytest.mark.parametrize('batch', [1, 2, 8])
+@pytest.mark.parametrize('conf', [0.001, 0.25, 0.6])
+@pytest.mark.parametrize('agnostic, classes', [(False, None), (True, None), (False, [0, 2])],
+                         ids=['per-class', 'agnostic', 'classes'])
+@pytest.mark.parametrize('seed', [0, 1])
+def test_parity_grid(batch, conf, agnostic, classes, seed):
+    assert_same(synthetic_predictions(batch, seed=seed), conf, classes, agnostic)
+
+
+def test_single_image_delegates():
+    pred = synthetic_predictions(1, seed=3)
+    ref = non_max_suppression(pred.clone(), 0.25)
+    out = batched_non_max_suppression(pred.clone(), 0.25)
+    assert len(out) == 1 and torch.equal(ref[0], out[0])
+
+
+def test_batched_path():
+    # 候选框总数低于 max_batched，走单次批量 nms() 调用
+    pred = synthetic_predictions(8, seed=4)
+    assert 0 < int((pred[..., 4] > 0.25).sum()) < MAX_BATCHED
+    assert_same(pred, 0.25)
+
+
+def test_max_batched_fallback():
+    # 候选框总数超过 max_batched，退回逐图 nms()
+    pred = synthetic_predictions(4, seed=5)
+    assert int((pred[..., 4] > 0.001).sum()) > MAX_BATCHED
+    assert_same(pred, 0.001)
+    assert_same(pred, 0.001, agnostic=True)
+    assert_same(pred, 0.001, classes=[1])
+
+
+def test_no_candidates():
+    pred = synthetic_predictions(4, seed=6)
+    pred[..., 4] = 0
+    out = batched_non_max_suppression(pred, 0.25)
+    assert len(out) == 4 and all(o.shape == (0, 6) for o in out)
+    assert_same(pred, 0.25)
+
+
+def test_empty_images_in_batch():
+    # 部分图像没有候选框时，其余图像的结果不受影响
+    pred = synthetic_predictions(4, seed=7)
+    pred[1::2, :, 4] = 0
+    assert_same(pred, 0.25)
+    assert_same(pred, 0.25, agnostic=True)
+
+
+@pytest.mark.parametrize('agnostic', [False, True])
+def test_negative_coordinates(agnostic):
+    # 框坐标为负（中心靠近图像左上角边缘）时，各图像的偏移不能让不同图像的框重叠
+    pred = synthetic_predictions(4, seed=8)
+    pred[..., 0:2] -= 700
+    assert (pred[..., 0:2] < 0).all()
+    assert_same(pred, 0.25, agnostic=agnostic)
+
+
+def test_negative_coordinates_cross_image():
+    # 两张图像的框完全相同：若偏移后重叠，第二张图像的框会被第一张的抑制
+    pred = torch.zeros(2, 3, 6)
+    pred[:, :, :4] = torch.tensor([[-50., -40., 20., 20.], [-400., -300., 30., 30.], [-5., -5., 4., 4.]])
+    pred[:, :, 4] = torch.tensor([0.9, 0.8, 0.7])
+    pred[:, :, 5] = 1.0
+    out = batched_non_max_suppression(pred.clone(), 0.25, 0.45, agnostic=True)
+    assert [o.shape[0] for o in out] == [3, 3]
+    assert_same(pred, 0.25, agnostic=True)
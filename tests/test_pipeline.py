@@ -0,0 +1,78 @@
+"""摄像头流水线的停止和结果队列：stop() 不无限阻塞、摄像头由采集线程释放、丢帧计数准确
+
+Usage:
+    $ python -m pytest tests/test_pipeline.py -q
+"""
+
+import threading
+import time
+
+import numpy as np
+
+from mypipeline import CameraPipeline, DropOldestQueue
+
+
+class FakeCamera:
+    """模拟摄像头：记录释放时所在的线程，read_delay 模拟卡住的读帧"""
+
+    def __init__(self, read_delay=0.0):
+        self.read_delay = read_delay
+        self.released_by = None
+
+    def read(self):
+        time.sleep(self.read_delay)
+        return True, np.zeros((4, 4, 3), dtype=np.uint8)
+
+    def release(self):
+        self.released_by = threading.current_thread()
+
+
+def test_get_latest_counts_dropped():
+    q = DropOldestQueue(maxsize=3)
+    assert q.get_latest() is None
+    for i in range(5):
+        q.put(i)
+    assert q.dropped == 2
+    assert q.get_latest() == 4
+    assert q.dropped == 4 and len(q) == 0
+
+
+def test_stop_releases_camera_in_capture_thread():
+    cam = FakeCamera(read_delay=0.001)
+    pipeline = CameraPipeline(cam, lambda frame: (frame, 0.3, 0.3, []))
+    pipeline.start()
+    time.sleep(0.05)
+    assert pipeline.stop(timeout=2)
+    assert not pipeline.alive()
+    assert cam.released_by is pipeline.capture
+
+
+def test_stop_times_out_without_blocking():
+    cam = FakeCamera(read_delay=0.001)
+    blocked, unblock = threading.Event(), threading.Event()
+
+    def process(frame):
+        blocked.set()
+        unblock.wait(5)
+        return frame, 0.3, 0.3, []
+
+    pipeline = CameraPipeline(cam, process)
+    pipeline.start()
+    assert blocked.wait(2)
+    t = time.monotonic()
+    assert not pipeline.stop(timeout=0.1)
+    assert time.monotonic() - t < 1
+    assert pipeline.alive()
+    unblock.set()
+    pipeline.worker.join(2)
+    assert not pipeline.alive()
+    assert cam.released_by is pipeline.capture
+
+
+def test_poll_returns_latest():
+    pipeline = CameraPipeline(FakeCamera(), lambda frame: (frame, 0.3, 0.3, []), result_queue_size=4)
+    for i in range(3):
+        pipeline.result_queue.put(i)
+    assert pipeline.poll() == 2
+    assert pipeline.poll() is None
+    assert pipeline.result_queue.dropped == 2
@@ -0,0 +1,37 @@
+"""模型注册表：加载失败的组件可以重试，重试只影响失败的组件"""
+
+import pytest
+
+from myregistry import FAILED, READY, ModelLoadError, ModelRegistry
+
+
+def test_retry_failed_entry():
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise OSError("weights missing")
+        return 'model'
+
+    registry = ModelRegistry()
+    registry.register('flaky', flaky)
+    registry.register('ok', lambda: 'ok')
+    registry.preload()
+    assert registry.wait(timeout=5)
+    assert registry.entry('flaky').state == FAILED and registry.failed()
+    with pytest.raises(ModelLoadError):
+        registry.get('flaky')
+
+    assert registry.retry() == ['flaky']
+    assert registry.wait('flaky', timeout=5)
+    assert registry.entry('flaky').state == READY and registry.ready() and not registry.failed()
+    assert registry.get('flaky') == 'model' and len(attempts) == 2
+    assert registry.retry() == []
+
+
+def test_retry_ignores_other_states():
+    registry = ModelRegistry()
+    registry.register('idle', lambda: 'idle')
+    assert registry.retry('idle') == []
+    assert registry.entry('idle').state != FAILED
@@ -0,0 +1,170 @@
+"""FatigueEngine / EventDetector 的 replay() 与从 reset() 开始逐帧 update() 的结果必须逐帧一致
+
+Usage:
+    $ python -m pytest tests/test_state.py -q
+"""
+
+import numpy as np
+import pytest
+
+from mystate import EventDetector, FatigueEngine
+
+FPS = 30
+
+
+def random_series(n, seed=0, fps=FPS):
+    """模拟的 EAR/MAR 序列：睁眼噪声、眨眼和闭眼、打哈欠，以及未检测到人脸的帧"""
+    rng = np.random.default_rng(seed)
+    ear = np.clip(rng.normal(0.31, 0.03, n), 0.21, None)
+    for s in rng.integers(0, n, n // (fps * 3)):
+        ear[s:s + rng.integers(2, fps)] = rng.uniform(0.21, 0.26)
+    ear[rng.random(n) < 0.02] = 0.0
+    mar = np.clip(rng.normal(0.3, 0.05, n), 0, None)
+    for s in rng.integers(0, n, n // (fps * 10)):
+        mar[s:s + rng.integers(5, fps * 2)] = rng.uniform(0.55, 0.9)
+    return ear, mar
+
+
+def assert_engine_replay(engine, ear, mar, times=None):
+    ear, mar = np.asarray(ear, dtype=np.float64), np.asarray(mar, dtype=np.float64)
+    times = np.arange(len(ear)) / engine.fps if times is None else np.asarray(times, dtype=np.float64)
+    engine.reset(times[0])
+    states = [engine.update(e, m, t) for e, m, t in zip(ear.tolist(), mar.tolist(), times.tolist())]
+    replay = engine.replay(ear, mar, times)
+    assert set(replay) == set(states[0]._fields)
+    for field, values in replay.items():
+        expected = np.array([getattr(s, field) for s in states])
+        if values.dtype.kind == 'f':
+            np.testing.assert_allclose(values, expected, rtol=0, atol=1e-12, err_msg=field)
+        else:
+            np.testing.assert_array_equal(values, expected, err_msg=field)
+    return replay
+
+
+def assert_detector_replay(detector, ear, mar):
+    detector.reset()
+    states = [detector.update(i, e, m) for i, (e, m) in enumerate(zip(np.asarray(ear).tolist(), np.asarray(mar).tolist()))]
+    replay = detector.replay(ear, mar)
+    assert set(replay) == set(states[0]._fields) - {'status_text'}
+    for field, values in replay.items():
+        np.testing.assert_array_equal(values, np.array([getattr(s, field) for s in states]), err_msg=field)
+    return replay
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_engine_random(seed):
+    ear, mar = random_series(3000, seed)
+    assert_engine_replay(FatigueEngine(FPS, reset_interval=20, yawn_window=10), ear, mar)
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_detector_random(seed):
+    ear, mar = random_series(3000, seed)
+    assert_detector_replay(EventDetector(FPS), ear, mar)
+
+
+def test_replay_keeps_state():
+    ear, mar = random_series(300)
+    engine = FatigueEngine(FPS, start_time=0.0)
+    for i in range(10):
+        engine.update(0.22, 0.8, i / FPS)
+    before = (engine.closed_frames, engine.yawn_frames, len(engine.ears), engine.last_reset_time)
+    engine.replay(ear, mar)
+    assert (engine.closed_frames, engine.yawn_frames, len(engine.ears), engine.last_reset_time) == before
+
+
+@pytest.mark.parametrize('invalid', [0.0, 0.1, 0.19])
+def test_engine_invalid_segments(invalid):
+    # 无效 EAR（为 0 或低于 MIN_VALID_EAR）出现在开头、闭眼过程中、张嘴过程中和结尾
+    ear = np.full(200, 0.3)
+    mar = np.full(200, 0.3)
+    ear[:3] = invalid
+    ear[20:30] = 0.22
+    ear[24:26] = invalid                     # 闭眼中途丢失人脸
+    ear[40:44] = 0.22                        # 丢失前后都是闭眼
+    ear[44] = invalid
+    ear[45:48] = 0.22
+    mar[60:100] = 0.8
+    ear[70:75] = invalid                     # 张嘴中途丢失人脸，哈欠帧数不中断
+    ear[99:101] = invalid                    # 闭嘴发生在无效帧上
+    ear[150:] = np.where(np.arange(50) % 3, 0.22, invalid)
+    replay = assert_engine_replay(FatigueEngine(FPS, min_yawn_frames=10), ear, mar)
+    assert not replay['valid'][[0, 24, 44, 70, 99]].any()
+    assert replay['yawn'].any()
+
+
+def test_engine_all_invalid():
+    ear = np.zeros(50)
+    replay = assert_engine_replay(FatigueEngine(FPS), ear, np.full(50, 0.8))
+    assert not replay['valid'].any() and not replay['fatigue'].any()
+
+
+@pytest.mark.parametrize('reset_interval', [1, 2.5, 7])
+def test_engine_resets(reset_interval):
+    # 时间取整数秒，重置正好落在 t == last + RESET_INTERVAL 上，且时间有跳变
+    ear, mar = random_series(400, seed=7, fps=4)
+    times = np.cumsum(np.random.default_rng(7).choice([0.5, 1.0, 2.5], 400))
+    replay = assert_engine_replay(FatigueEngine(4, reset_interval=reset_interval, yawn_window=3,
+                                                min_yawn_frames=2, min_blink_frames=1), ear, mar, times)
+    assert replay['reset'].sum() > 1
+
+
+def test_engine_window_edges():
+    # 哈欠记录在 t=10，窗口 5 秒：t=15 时仍计入（t0 < now - window 才过期），t=15.5 时过期
+    times = np.array([0, 5, 8, 9, 10, 12, 15, 15.5, 16], dtype=np.float64)
+    ear = np.full(len(times), 0.3)
+    mar = np.array([0.3, 0.3, 0.8, 0.8, 0.3, 0.3, 0.3, 0.3, 0.3])
+    replay = assert_engine_replay(FatigueEngine(2, min_yawn_frames=2, yawn_window=5, reset_interval=100),
+                                  ear, mar, times)
+    assert replay['yawns'].tolist() == [0, 0, 0, 0, 1, 1, 1, 0, 0]
+
+
+@pytest.mark.parametrize('window, reset_interval', [(1, 100), (3, 100), (2, 2), (5, 3)])
+def test_engine_window_edges_random(window, reset_interval):
+    rng = np.random.default_rng(window)
+    n = 600
+    times = np.cumsum(rng.choice([0.5, 1.0], n))
+    ear = rng.choice([0.0, 0.22, 0.3], n, p=[0.05, 0.35, 0.6])
+    mar = rng.choice([0.3, 0.8], n, p=[0.5, 0.5])
+    assert_engine_replay(FatigueEngine(2, smooth_frames=1, confirm_frames=1, min_blink_frames=1,
+                                       min_yawn_frames=1, yawn_window=window, reset_interval=reset_interval,
+                                       max_yawn_count=2), ear, mar, times)
+
+
+@pytest.mark.parametrize('smooth_frames', [1, 2, 4, 5])
+@pytest.mark.parametrize('confirm_frames', [0, 1, 2, 3])
+def test_engine_smoothing_threshold_boundary(smooth_frames, confirm_frames):
+    # 取值都是二进制精确的小数，平滑后的 EAR 经常正好等于阈值（<= 判定为闭眼）
+    rng = np.random.default_rng(smooth_frames * 10 + confirm_frames)
+    ear = rng.choice([0.0, 0.25, 0.3125, 0.375], 2000, p=[0.03, 0.32, 0.33, 0.32])
+    mar = rng.choice([0.5, 0.625, 0.75], 2000)
+    replay = assert_engine_replay(FatigueEngine(FPS, closed_eye_threshold=0.3125, mouth_threshold=0.625,
+                                                smooth_frames=smooth_frames, confirm_frames=confirm_frames,
+                                                min_yawn_frames=2, reset_interval=10, yawn_window=5),
+                                  ear, mar)
+    assert (replay['valid'] & (replay['avg_ear'] == 0.3125)).any()
+
+
+def test_engine_threshold_exact():
+    engine = FatigueEngine(FPS, closed_eye_threshold=0.25, smooth_frames=1, confirm_frames=1)
+    replay = assert_engine_replay(engine, [0.25, 0.25, 0.26, 0.25], [0.6, 0.6, 0.6, 0.6])
+    assert replay['eye_closed'].tolist() == [True, True, False, True]
+    assert replay['yawn_frames'].tolist() == [0, 0, 0, 0]  # MAR 等于阈值不算张嘴
+
+
+@pytest.mark.parametrize('min_interval', [0, 1, 3, 15])
+@pytest.mark.parametrize('consec', [1, 3])
+def test_detector_boundaries(min_interval, consec):
+    # EAR/MAR 正好等于阈值、连续帧数正好达到确认帧数、事件间隔正好等于最小间隔
+    rng = np.random.default_rng(min_interval * 10 + consec)
+    ear = rng.choice([0.0, 0.25, 0.3, 0.35], 1000)
+    mar = rng.choice([0.0, 0.4, 0.5, 0.6], 1000)
+    detector = EventDetector(FPS, 0.3, 0.5, consec, consec, min_interval)
+    assert_detector_replay(detector, ear, mar)
+    assert_detector_replay(detector, np.full(50, 0.25), np.full(50, 0.6))
+
+
+def test_detector_interval_exact():
+    detector = EventDetector(FPS, fatigue_consec_frames=2, min_interval_frames=3)
+    replay = assert_detector_replay(detector, np.full(10, 0.2), np.zeros(10))
+    assert np.flatnonzero(replay['fatigue_logged']).tolist() == [1, 4, 7]
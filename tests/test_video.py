@@ -0,0 +1,69 @@
+"""多进程分段提取关键点与单进程 extract_range(path, 0) 的一致性，以及区间少帧时退回顺序提取"""
+
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+pytest.importorskip('dlib')
+cv2 = pytest.importorskip('cv2')
+
+import myvideo  # noqa: E402
+
+FRAMES = 90
+
+
+def fake_analyse(frame):
+    """由画面亮度确定的关键点，亮度过低视为未检测到人脸"""
+    base = int(round(float(frame.mean())))
+    if base < 30:
+        return None, 0.0, 0.0
+    shape = np.arange(136, dtype=np.int32).reshape(68, 2) * (1 + base % 7) + base
+    return shape, 0.0, 0.0
+
+
+@pytest.fixture
+def video(tmp_path, monkeypatch):
+    path = str(tmp_path / 'clip.avi')
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 30, (64, 48))
+    for i in range(FRAMES):
+        writer.write(np.full((48, 64, 3), 10 + (i * 37) % 230, dtype=np.uint8))
+    writer.release()
+    monkeypatch.setattr(myvideo.myfatigue, 'analyse', fake_analyse)
+    monkeypatch.setattr(myvideo, 'MIN_PARALLEL_FRAMES', 0)
+    monkeypatch.setattr(myvideo, 'MIN_CHUNK_FRAMES', 10)
+    return path
+
+
+def assert_same_series(a, b):
+    assert len(a) == len(b) == FRAMES
+    np.testing.assert_array_equal(a.found, b.found)
+    np.testing.assert_array_equal(a.shapes, b.shapes)
+    np.testing.assert_array_equal(a.ear, b.ear)
+    np.testing.assert_array_equal(a.mar, b.mar)
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                    reason='替换的 analyse 只有 fork 启动的子进程能继承')
+def test_parallel_matches_serial(video):
+    assert len(myvideo.split_ranges(FRAMES, 3)) > 1
+    assert_same_series(myvideo.analyse_video(video, workers=3), myvideo.extract_range(video, 0))
+
+
+def test_short_chunk_falls_back_to_serial(video, monkeypatch, capsys):
+    extract = myvideo._extract_shapes
+
+    def truncated(path, start, end=None, sampler=None):
+        # 模拟定位不准：中间区间少读一帧
+        shapes, found, sampled = extract(path, start, end, sampler)
+        if start > 0 and end is not None:
+            return shapes[:-1], found[:-1], sampled[:-1]
+        return shapes, found, sampled
+
+    monkeypatch.setattr(myvideo, '_extract_shapes', truncated)
+    monkeypatch.setattr(myvideo, 'ProcessPoolExecutor', ThreadPoolExecutor)
+    series = myvideo.analyse_video(video, workers=3)
+    assert '单进程顺序提取' in capsys.readouterr().out
+    monkeypatch.setattr(myvideo, '_extract_shapes', extract)
+    assert_same_series(series, myvideo.extract_range(video, 0))
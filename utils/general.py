@@ -427,6 +427,90 @@ def non_max_suppression(prediction, conf_thres=0.25, iou_thres=0.45, classes=Non
     return output
 
 
+def batched_non_max_suppression(prediction, conf_thres=0.25, iou_thres=0.45, classes=None, agnostic=False,
+                                labels=()):
+    """Vectorized non_max_suppression(): all images go through a single torchvision.ops.nms() call
+
+    Candidate filtering, confidence and label expansion run on the whole batch; boxes keep the class offset of
+    non_max_suppression() and get an additional per-image offset, so each image gets exactly the detections of
+    the legacy function. The wall-clock time limit is not needed.
+
+    Returns:
+         list of detections, one per image, with shape: nx6 (x1, y1, x2, y2, conf, cls)
+    """
+    if labels or prediction.shape[0] == 1:  # autolabelling, or nothing to batch
+        return non_max_suppression(prediction, conf_thres, iou_thres, classes, agnostic, labels)
+
+    bs, nc = prediction.shape[0], prediction.shape[2] - 5  # batch size, number of classes
+    max_wh = 4096  # (pixels) maximum box width and height
+    max_det = 300  # maximum number of detections per image
+    max_nms = 30000  # maximum number of boxes per image into NMS
+    max_batched = 5000  # maximum number of boxes (whole batch) for the single batched NMS call
+    multi_label = nc > 1  # multiple labels per box
+    few_classes = nc <= 8  # low class count fast path (single label per box is the common case)
+
+    # Candidates of all images at once
+    xi, ai = (prediction[..., 4] > conf_thres).nonzero(as_tuple=True)  # image index, anchor index
+    x = prediction[xi, ai]
+    if not x.shape[0]:
+        return [torch.zeros((0, 6), device=prediction.device)] * bs
+    x[:, 5:] *= x[:, 4:5]  # conf = obj_conf * cls_conf
+    box = xywh2xyxy(x[:, :4])
+
+    # Detections matrix nx6 (xyxy, conf, cls), rows in the same order as the per-image implementation
+    cls_conf = x[:, 5:]
+    if multi_label:
+        above = cls_conf > conf_thres
+        if few_classes and not (above.sum(1) > 1).any():  # at most one label per box: no index expansion
+            conf, j = cls_conf.max(1, keepdim=True)
+            keep = above.any(1)
+            x = torch.cat((box, conf, j.float()), 1)[keep]
+            xi = xi[keep]
+        else:
+            i, j = above.nonzero(as_tuple=False).T
+            x = torch.cat((box[i], cls_conf[i, j, None], j[:, None].float()), 1)
+            xi = xi[i]
+    else:  # best class only
+        conf, j = cls_conf.max(1, keepdim=True)
+        keep = conf.view(-1) > conf_thres
+        x = torch.cat((box, conf, j.float()), 1)[keep]
+        xi = xi[keep]
+
+    # Filter by class
+    if classes is not None:
+        keep = (x[:, 5:6] == torch.tensor(classes, device=x.device)).any(1)
+        x, xi = x[keep], xi[keep]
+    if not x.shape[0]:
+        return [torch.zeros((0, 6), device=prediction.device)] * bs
+
+    c = x[:, 5:6] * (0 if agnostic else max_wh)  # classes
+    boxes, scores = x[:, :4] + c, x[:, 4]  # boxes (offset by class), scores
+    if x.shape[0] > max_batched:
+        # Very many candidates (e.g. conf_thres=0.001 for mAP): NMS cost grows with the square of the box
+        # count, so run it per image as non_max_suppression() does, capping each image to max_nms boxes
+        output = []
+        for b in range(bs):
+            k = (xi == b).nonzero(as_tuple=False).view(-1)
+            if k.shape[0] > max_nms:  # excess boxes
+                k = k[scores[k].argsort(descending=True)[:max_nms]]  # sort by confidence
+            i = torchvision.ops.nms(boxes[k], scores[k], iou_thres)[:max_det]  # NMS
+            output.append(x[k[i]])
+        return output
+
+    # Batched NMS: images offset by the coordinate span so they never overlap, also with negative coordinates
+    # (image 0 unchanged), one nms() call for the batch; torchvision's stable score sort keeps the per-image
+    # order of equal scores
+    boxes = boxes + xi[:, None].to(boxes) * (boxes.max() - boxes.min() + 1)
+    i = torchvision.ops.nms(boxes, scores, iou_thres)  # sorted by decreasing score
+
+    # Split by image keeping the score order, at most max_det per image
+    i = i[xi[i].argsort(stable=True)]
+    counts = torch.bincount(xi[i], minlength=bs)
+    rank = torch.arange(len(i), device=x.device) - (counts.cumsum(0) - counts)[xi[i]]
+    i = i[rank < max_det]
+    return list(x[i].split(counts.clamp(max=max_det).tolist()))
+
+
 def strip_optimizer(f='weights/best.pt', s=''):  # from utils.general import *; strip_optimizer()
     # Strip optimizer from 'f' to finalize training, optionally save as 's'
     x = torch.load(f, map_location=torch.device('cpu'))